@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+from synthetic import generate
+
+# Scaling benchmarks for the heatmap engine and the ETL. Both are swept over
+# --ranks under --mpiexec; the ETL runs as init.py --mpi. Inputs come from
+# synthetic.py and are reused between runs. Every run goes through a small
+# measuring process that timestamps the engine's PROGRESS lines and reads the
+# peak RSS of the largest child. Results, including the commit they were
+# taken at, are written as JSON so two commits can be compared.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+ENGINE_SCRIPT = os.path.join(SRC_DIR, 'heatmap_engine.py')
+ETL_SCRIPT = os.path.join(SRC_DIR, 'init.py')
+DEFAULT_WORK_DIR = 'data/benchmark'
+
+
+def dataset(work_dir, rows, layout, sites, seed):
+    path = os.path.join(work_dir, f'synthetic_{layout}_{rows}_{sites}_{seed}.csv')
+    if not os.path.exists(path):
+        generate(path + '.tmp', rows, sites=sites, layout=layout, seed=seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def measure_command(command):
+    # Runs inside the measuring process, so RUSAGE_CHILDREN covers only this run
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    phases = {}
+    tail = []
+    for line in process.stdout:
+        now = time.perf_counter() - started
+        if line.startswith('PROGRESS '):
+            fields = dict(part.split('=', 1) for part in line.split()[1:])
+            # First time each rank enters a phase
+            phases.setdefault(fields['rank'], {}).setdefault(fields['phase'], now)
+        else:
+            tail = (tail + [line.rstrip()])[-20:]
+    returncode = process.wait()
+    return {'wall': time.perf_counter() - started, 'returncode': returncode, 'peak_rss_mb': peak_rss_mb(),
+            'rank_phases': phases, 'output': tail if returncode else []}
+
+
+def phase_durations(rank_phases, wall):
+    # A phase lasts until the rank enters its next one; the slowest rank
+    # defines the phase, and start-up runs until the first rank reports
+    if not rank_phases:
+        return {}
+    durations = {'startup': min(min(times.values()) for times in rank_phases.values())}
+    for times in rank_phases.values():
+        ordered = sorted(times.items(), key=lambda item: item[1])
+        for (phase, start), (_, end) in zip(ordered, ordered[1:]):
+            durations[phase] = max(durations.get(phase, 0.0), end - start)
+    durations['teardown'] = wall - max(max(times.values()) for times in rank_phases.values())
+    return durations
+
+
+def run_measured(command):
+    measured = subprocess.run([sys.executable, os.path.abspath(__file__), 'measure', '--'] + command,
+                              stdout=subprocess.PIPE, text=True, check=True)
+    result = json.loads(measured.stdout.strip().splitlines()[-1])
+    result['phases'] = phase_durations(result.pop('rank_phases'), result['wall'])
+    return result
+
+
+def repeat(command, repeats):
+    results = [run_measured(command) for _ in range(repeats)]
+    failed = [result for result in results if result['returncode'] != 0]
+    if failed:
+        raise RuntimeError(f"{shlex.join(command)} failed:\n" + '\n'.join(failed[0]['output']))
+    phases = {phase: statistics.median(result['phases'].get(phase, 0.0) for result in results)
+              for phase in results[0]['phases']}
+    return {'wall': statistics.median(result['wall'] for result in results),
+            'walls': [result['wall'] for result in results],
+            'peak_rss_mb': max(result['peak_rss_mb'] for result in results),
+            'phases': phases}
+
+
+def heatmap_command(args, path, ranks):
+    return (shlex.split(args.mpiexec) + ['-np', str(ranks), sys.executable, ENGINE_SCRIPT, '--input', path,
+                                         '--source', 'csv', '--no-show', '--progress',
+                                         '--output-dir', os.path.join(args.work_dir, 'output')]
+            + shlex.split(args.heatmap_args))
+
+
+def etl_command(args, path, ranks):
+    work = os.path.join(args.work_dir, 'etl')
+    return (shlex.split(args.mpiexec) + ['-np', str(ranks), sys.executable, ETL_SCRIPT, '--mpi', '--progress',
+                                         '--input', path,
+                                         '--output', os.path.join(work, 'processed.csv'),
+                                         '--cache-dir', os.path.join(work, 'columnar'),
+                                         '--cube-dir', os.path.join(work, 'rollup')]
+            + shlex.split(args.etl_args))
+
+
+def scaling(runs, key):
+    # Speedup and efficiency against the smallest rank count of each curve
+    base = runs[0]
+    for run in runs:
+        if key == 'strong':
+            run['speedup'] = base['wall'] / run['wall']
+            run['efficiency'] = run['speedup'] * base['ranks'] / run['ranks']
+        else:
+            run['efficiency'] = base['wall'] / run['wall']
+    return runs
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=SRC_DIR).stdout.strip()
+    except OSError:
+        commit = ''
+    import mpi4py
+    import numpy
+    import pandas
+    return {'commit': commit, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'host': platform.node(),
+            'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': numpy.__version__,
+            'pandas': pandas.__version__, 'mpi4py': mpi4py.__version__}
+
+
+def run_benchmarks(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = {'environment': environment(), 'config': {key: value for key, value in vars(args).items()
+                                                        if key != 'command'},
+               'strong': [], 'weak': [], 'etl': []}
+
+    if 'heatmap' in args.pipelines:
+        for rows in args.sizes:
+            path = dataset(args.work_dir, rows, 'processed', args.sites, args.seed)
+            runs = []
+            for ranks in args.ranks:
+                print(f"strong: {rows} rows on {ranks} ranks", flush=True)
+                runs.append(dict(repeat(heatmap_command(args, path, ranks), args.repeat), rows=rows, ranks=ranks))
+            results['strong'].append({'rows': rows, 'runs': scaling(runs, 'strong')})
+
+        if args.weak_rows:
+            runs = []
+            for ranks in args.ranks:
+                rows = args.weak_rows * ranks
+                print(f"weak: {rows} rows on {ranks} ranks", flush=True)
+                path = dataset(args.work_dir, rows, 'processed', args.sites, args.seed)
+                runs.append(dict(repeat(heatmap_command(args, path, ranks), args.repeat), rows=rows, ranks=ranks))
+            results['weak'] = scaling(runs, 'weak')
+
+    if 'etl' in args.pipelines:
+        for rows in args.sizes:
+            path = dataset(args.work_dir, rows, 'raw', args.sites, args.seed)
+            runs = []
+            for ranks in args.ranks:
+                print(f"etl: {rows} rows on {ranks} ranks", flush=True)
+                runs.append(dict(repeat(etl_command(args, path, ranks), args.repeat), rows=rows, ranks=ranks))
+            results['etl'].extend(scaling(runs, 'strong'))
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    return results
+
+
+def flatten(results):
+    runs = {}
+    for curve in results['strong']:
+        for run in curve['runs']:
+            runs[('strong', run['rows'], run['ranks'])] = run
+    for run in results['weak']:
+        runs[('weak', run['rows'], run['ranks'])] = run
+    for run in results['etl']:
+        runs[('etl', run['rows'], run['ranks'])] = run
+    return runs
+
+
+def print_results(results):
+    print(f"{'mode':<7}{'rows':>12}{'ranks':>6}{'wall s':>10}{'speedup':>9}{'eff':>7}{'rss MB':>9}  phases")
+    for (mode, rows, ranks), run in flatten(results).items():
+        phases = ' '.join(f'{phase}={seconds:.2f}' for phase, seconds in run['phases'].items())
+        speedup = f"{run['speedup']:.2f}" if 'speedup' in run else ''
+        efficiency = f"{run['efficiency']:.2f}" if 'efficiency' in run else ''
+        print(f"{mode:<7}{rows:>12}{ranks:>6}{run['wall']:>10.2f}{speedup:>9}{efficiency:>7}"
+              f"{run['peak_rss_mb']:>9.1f}  {phases}")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    print(f"{old['environment']['commit'][:10]} -> {new['environment']['commit'][:10]}")
+    print(f"{'mode':<7}{'rows':>12}{'ranks':>6}{'old s':>10}{'new s':>10}{'ratio':>8}{'old MB':>9}{'new MB':>9}")
+    old_runs = flatten(old)
+    for key, run in flatten(new).items():
+        if key not in old_runs:
+            continue
+        before = old_runs[key]
+        mode, rows, ranks = key
+        print(f"{mode:<7}{rows:>12}{ranks:>6}{before['wall']:>10.2f}{run['wall']:>10.2f}"
+              f"{run['wall'] / before['wall']:>8.2f}{before['peak_rss_mb']:>9.1f}{run['peak_rss_mb']:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Strong/weak scaling benchmarks for the heatmap engine and ETL.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='generate inputs as needed and run the benchmarks')
+    run.add_argument('--pipelines', nargs='+', choices=['heatmap', 'etl'], default=['heatmap', 'etl'])
+    run.add_argument('--sizes', nargs='+', type=int, default=[1_000_000], help='rows for strong scaling and ETL')
+    run.add_argument('--ranks', nargs='+', type=int, default=[1, 2, 4])
+    run.add_argument('--weak-rows', type=int, default=250_000, help='rows per rank for weak scaling (0 to skip)')
+    run.add_argument('--sites', type=int, default=1000)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--repeat', type=int, default=3, help='runs per point; the median is reported')
+    run.add_argument('--mpiexec', default='mpiexec', help="launcher, e.g. 'mpiexec --oversubscribe'")
+    run.add_argument('--heatmap-args', default='', help='extra heatmap_engine.py arguments')
+    run.add_argument('--etl-args', default='', help='extra init.py --mpi arguments, e.g. --median exact')
+    run.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='generated inputs and outputs')
+    run.add_argument('--output', default='benchmark_results.json')
+
+    show = commands.add_parser('compare', help='compare two result files')
+    show.add_argument('old')
+    show.add_argument('new')
+
+    measure = commands.add_parser('measure', help=argparse.SUPPRESS)
+    measure.add_argument('child', nargs=argparse.REMAINDER)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'measure':
+        child = args.child[1:] if args.child[:1] == ['--'] else args.child
+        print(json.dumps(measure_command(child)))
+    elif args.command == 'compare':
+        compare(args.old, args.new)
+    else:
+        print_results(run_benchmarks(args))
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
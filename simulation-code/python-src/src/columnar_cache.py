@@ -0,0 +1,192 @@
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+from dates import parse_dates
+
+# Columnar binary copy of the processed data: one .npy file per column plus a
+# small manifest. Readers memory-map only the columns they need, so a rank's
+# slice is a zero-copy view instead of a text parse.
+
+DEFAULT_CACHE_DIR = 'data/processed/columnar'
+MANIFEST = 'manifest.json'
+
+
+def column_file(column):
+    return re.sub(r'[^0-9A-Za-z]+', '_', column).strip('_') + '.npy'
+
+
+def source_signature(filepath):
+    stat = os.stat(filepath)
+    return {'path': os.path.abspath(filepath), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def encode_strings(series):
+    # Works for object and categorical columns alike
+    return series.astype(object).where(series.notna(), '').astype(str).str.encode('utf-8')
+
+
+def column_dtypes(data, date_columns=('Date',)):
+    # Storage dtype per column; strings are stored fixed-width so they can be
+    # memory-mapped too
+    dtypes = {}
+    for column in data.columns:
+        series = data[column]
+        if column in date_columns:
+            dtypes[column] = np.dtype(np.int32)
+        elif series.dtype.kind in 'biuf':
+            dtypes[column] = series.dtype
+        else:
+            width = int(encode_strings(series).str.len().max()) if len(series) else 0
+            dtypes[column] = np.dtype(f'S{max(width, 1)}')
+    return dtypes
+
+
+def merge_dtypes(left, right):
+    # Widen per-column dtypes seen in different chunks of the same file
+    merged = dict(left)
+    for column, dtype in right.items():
+        if column not in merged:
+            merged[column] = dtype
+        elif merged[column].kind == 'S' or dtype.kind == 'S':
+            width = max(merged[column].itemsize if merged[column].kind == 'S' else 1,
+                        dtype.itemsize if dtype.kind == 'S' else 1)
+            merged[column] = np.dtype(f'S{width}')
+        else:
+            merged[column] = np.promote_types(merged[column], dtype)
+    return merged
+
+
+def column_values(series, dtype, is_date=False):
+    if is_date:
+        # Dates are stored pre-parsed as int32 day ordinals
+        return parse_dates(series.astype(str).to_numpy())
+    if dtype.kind == 'S':
+        return np.asarray(encode_strings(series).to_numpy(), dtype=dtype)
+    return series.to_numpy(dtype=dtype)
+
+
+class ColumnarWriter:
+    # Fills preallocated .npy files chunk by chunk, so a cache can be written
+    # without holding the whole table in memory. With create=False it opens
+    # files another writer preallocated, e.g. one MPI rank per row range.
+    def __init__(self, cache_dir, rows, dtypes, date_columns=('Date',), position=0, create=True):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.rows = rows
+        self.dtypes = dtypes
+        self.date_columns = date_columns
+        self.position = position
+        self.arrays = {}
+        for column, dtype in dtypes.items():
+            path = os.path.join(cache_dir, column_file(column))
+            self.arrays[column] = np.lib.format.open_memmap(path, mode='w+' if create else 'r+', dtype=dtype,
+                                                            shape=(rows,))
+
+    def write(self, chunk):
+        end = self.position + len(chunk)
+        for column, array in self.arrays.items():
+            array[self.position:end] = column_values(chunk[column], array.dtype, column in self.date_columns)
+        self.position = end
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+
+    def close(self, source=None):
+        self.flush()
+        columns = {column: {'file': column_file(column), 'dtype': dtype.str} for column, dtype in self.dtypes.items()}
+        manifest = {'rows': self.position, 'columns': columns}
+        if source is not None:
+            manifest['source'] = source_signature(source)
+        with open(os.path.join(self.cache_dir, MANIFEST), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        self.arrays = {}
+        return manifest
+
+
+def write_cache(data, cache_dir=DEFAULT_CACHE_DIR, source=None, date_columns=('Date',)):
+    writer = ColumnarWriter(cache_dir, len(data), column_dtypes(data, date_columns), date_columns)
+    writer.write(data)
+    return writer.close(source)
+
+
+def append_cache(data, cache_dir=DEFAULT_CACHE_DIR, source=None, date_columns=('Date',)):
+    # Grows every column file in place: numpy leaves room in the .npy header
+    # for a longer shape, so only the header and the new rows are written.
+    # Returns None, leaving the cache untouched, when the rows do not fit the
+    # stored dtypes (say a longer string); the caller then rebuilds.
+    manifest = load_manifest(cache_dir)
+    if manifest is None:
+        return None
+    dtypes = {column: np.dtype(entry['dtype']) for column, entry in manifest['columns'].items()}
+    incoming = column_dtypes(data, date_columns)
+    if set(incoming) != set(dtypes) or merge_dtypes(dtypes, incoming) != dtypes:
+        return None
+    rows = manifest['rows'] + len(data)
+    headers = {}
+    for column, dtype in dtypes.items():
+        with open(os.path.join(cache_dir, column_file(column)), 'rb') as file:
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                np.lib.format.read_array_header_1_0(file)
+            else:
+                np.lib.format.read_array_header_2_0(file)
+            data_offset = file.tell()
+        header = io.BytesIO()
+        fields = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)}
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, fields)
+        else:
+            np.lib.format.write_array_header_2_0(header, fields)
+        # Files written without room for a longer shape are rebuilt instead
+        if len(header.getvalue()) != data_offset:
+            return None
+        headers[column] = header.getvalue()
+    for column, dtype in dtypes.items():
+        values = np.ascontiguousarray(column_values(data[column], dtype, column in date_columns), dtype=dtype)
+        with open(os.path.join(cache_dir, column_file(column)), 'r+b') as file:
+            file.write(headers[column])
+            file.seek(0, os.SEEK_END)
+            file.write(values.tobytes())
+    manifest['rows'] = rows
+    if source is not None:
+        manifest['source'] = source_signature(source)
+    with open(os.path.join(cache_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_manifest(cache_dir=DEFAULT_CACHE_DIR):
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def is_fresh(cache_dir, source):
+    # The cache is only used while it still describes the CSV it was built from
+    manifest = load_manifest(cache_dir)
+    if manifest is None or 'source' not in manifest or not os.path.exists(source):
+        return False
+    current = source_signature(source)
+    return manifest['source']['size'] == current['size'] and manifest['source']['mtime'] == current['mtime']
+
+
+def open_columns(cache_dir, columns):
+    manifest = load_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"No columnar cache at {cache_dir}")
+    arrays = {}
+    for column in columns:
+        entry = manifest['columns'][column]
+        arrays[column] = np.load(os.path.join(cache_dir, entry['file']), mmap_mode='r')
+    return arrays, manifest['rows']
+
+
+def rank_row_range(rows, rank, size):
+    return rows * rank // size, rows * (rank + 1) // size
@@ -0,0 +1,141 @@
+import argparse
+import codecs
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Parallel, streaming replacement for data-combine.ipynb. Per-site exports
+# are read and normalized in a process pool and appended to the combined file
+# in input order, so the concatenated frame never exists in memory.
+
+SNIFF_BYTES = 64 * 1024
+DELIMITERS = ',\t;|'
+
+
+def sniff(file_path):
+    # Encoding and delimiter from a prefix instead of a failed full read
+    with open(file_path, 'rb') as file:
+        prefix = file.read(SNIFF_BYTES)
+
+    if prefix.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif prefix.startswith(codecs.BOM_UTF16_LE) or prefix.startswith(codecs.BOM_UTF16_BE):
+        encoding = 'utf-16'
+    elif b'\x00' in prefix[:1024]:
+        # UTF-16 without a BOM; the zero byte position gives the byte order
+        encoding = 'utf-16-le' if prefix[1:2] == b'\x00' else 'utf-16-be'
+    else:
+        try:
+            # Incremental decoding tolerates a character cut off at the end of the prefix
+            codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = 'latin-1'
+
+    text = prefix.decode(encoding, errors='ignore')
+    sample = '\n'.join(text.splitlines()[:20])
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+    header = next(csv.reader(io.StringIO(sample), delimiter=delimiter), [])
+    return encoding, delimiter, header
+
+
+def list_csv_files(folder_path, exclude=()):
+    excluded = {os.path.abspath(path) for path in exclude}
+    files = sorted(name for name in os.listdir(folder_path) if name.endswith('.csv'))
+    return [os.path.join(folder_path, name) for name in files
+            if os.path.abspath(os.path.join(folder_path, name)) not in excluded]
+
+
+def union_columns(headers):
+    # Same column order pd.concat would produce: first appearance wins
+    columns = []
+    seen = set()
+    for header in headers:
+        for column in header:
+            if column not in seen:
+                seen.add(column)
+                columns.append(column)
+    return columns
+
+
+def normalize_file(file_path, encoding, delimiter, columns):
+    # Runs in a worker: read one export as text and re-emit it in the
+    # combined column order, without a header
+    try:
+        df = pd.read_csv(file_path, sep=delimiter, encoding=encoding, dtype=str, keep_default_na=False)
+        df = df.reindex(columns=columns, fill_value='')
+        return file_path, df.to_csv(index=False, header=False, lineterminator='\n').encode('utf-8'), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+def combine(folder_path, output_path, workers=None, files=None, columns=None):
+    # With columns given, the files are appended to an existing combined file
+    # that already has that header; their columns must be among them
+    if files is None:
+        files = list_csv_files(folder_path, exclude=[output_path])
+    sniffed = [sniff(file_path) for file_path in files]
+    append = columns is not None
+    if not append:
+        columns = union_columns(header for _, _, header in sniffed)
+    elif any(column not in columns for _, _, header in sniffed for column in header):
+        raise ValueError("New files have columns the combined file does not")
+
+    workers = workers or os.cpu_count() or 1
+    written = []
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'a' if append else 'w', newline='', encoding='utf-8') as output, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        if not append:
+            csv.writer(output, lineterminator='\n').writerow(columns)
+            output.flush()
+
+        # A bounded window of in-flight files keeps results in input order
+        # without buffering every file's rows
+        tasks = iter(zip(files, sniffed))
+        pending = deque()
+
+        def submit_next():
+            for file_path, (encoding, delimiter, _) in tasks:
+                pending.append(pool.submit(normalize_file, file_path, encoding, delimiter, columns))
+                return
+
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            file_path, rows, error = pending.popleft().result()
+            submit_next()
+            if error is not None:
+                print(f"Could not read file {os.path.basename(file_path)} because of error: {error}")
+                continue
+            output.buffer.write(rows)
+            written.append(file_path)
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Combine per-site AirNow CSV exports into one file.')
+    parser.add_argument('folder', nargs='?', default='data1', help='folder holding the per-site exports')
+    parser.add_argument('--output', default=None, help='combined CSV (default: <folder>/combined_file_final.csv)')
+    parser.add_argument('--workers', type=int, default=None, help='reader processes (default: CPU count)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.folder):
+        raise SystemExit(f"Export folder {args.folder} not found")
+    output_path = args.output or os.path.join(args.folder, 'combined_file_final.csv')
+    written = combine(args.folder, output_path, args.workers)
+    print(f"Combined {len(written)} files into {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+from mpi4py import MPI
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR
+from dates import GRAINS, MISSING_DAY, format_periods, to_periods
+from heatmap_engine import DATE_COLUMN, DEFAULT_INPUT, POLLUTANTS, read_cache_slice, read_data_slice, use_cache
+from partition import rank_byte_range
+from pollutant_stats import DEFAULT_STATS_DIR
+from schema import column_index
+
+# Covariance and correlation between all pollutant columns, overall and per
+# time period or state, from one scan. Every rank keeps pairwise, missing-aware
+# sufficient statistics per group as four p x p matrices, each one matrix
+# product over the group's rows: with M the validity mask and X the readings
+# (0 where missing), N = M'M counts the rows where both columns are present,
+# S = X'M and Q = (X*X)'M hold the sums and squares over those rows, and
+# C = X'X the cross-products. All groupings share one buffer and one
+# Allreduce. Pollutant readings vary on the order of their mean, so raw
+# moments lose little precision here.
+
+GROUPINGS = ['all', 'state'] + list(GRAINS)
+STATE_COLUMN = 'STATE_CODE'
+MOMENTS = 4  # N, S, Q, C
+
+
+def read_columns(filepath, pollutants, with_state, source, cache_dir, rank, size):
+    # Day ordinals, state codes (or None) and one reading column per pollutant
+    names = [POLLUTANTS[name]['name'] for name in pollutants]
+    extra = [STATE_COLUMN] if with_state else []
+    if use_cache(source, filepath, cache_dir):
+        days, values = read_cache_slice(cache_dir, rank, size, extra + names)
+    else:
+        start, end = rank_byte_range(filepath, rank, size)
+        columns = [column_index(name) for name in extra] + [POLLUTANTS[name]['column'] for name in pollutants]
+        days, values = read_data_slice(filepath, start, end, DATE_COLUMN, columns)
+    values = np.asarray(values, dtype=np.float64)
+    states = values[:, 0] if with_state else None
+    return days, states, np.ascontiguousarray(values[:, len(extra):])
+
+
+def group_keys(grouping, days, states):
+    # Integer key per row; negative keys are left out
+    if grouping == 'all':
+        return np.zeros(len(days), dtype=np.int64)
+    if grouping == 'state':
+        return np.where(np.isnan(states), -1, states).astype(np.int64)
+    periods = to_periods(days, grouping).astype(np.int64)
+    return np.where(days == MISSING_DAY, -1, periods)
+
+
+def key_ranges(keys, comm):
+    # Global (first, last) key of every grouping from one small Allreduce
+    bounds = np.array([value for key in keys for value in
+                       ((-key[key >= 0].min(), key[key >= 0].max()) if (key >= 0).any()
+                        else (np.iinfo(np.int64).min, np.iinfo(np.int64).min))], dtype=np.int64)
+    comm.Allreduce(MPI.IN_PLACE, bounds, op=MPI.MAX)
+    return [(-int(bounds[2 * i]), int(bounds[2 * i + 1])) for i in range(len(keys))]
+
+
+def accumulate(readings, keys, first, out):
+    # out: (groups, MOMENTS, p, p); one set of matrix products per group present
+    valid = ~np.isnan(readings)
+    mask = valid.astype(np.float64)
+    values = np.where(valid, readings, 0.0)
+    squares = values * values
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) else []
+    ends = np.r_[starts[1:], len(keys)] if len(keys) else []
+    for start, end in zip(starts, ends):
+        if sorted_keys[start] < 0:
+            continue
+        rows = order[start:end]
+        m, x, q = mask[rows], values[rows], squares[rows]
+        group = out[sorted_keys[start] - first]
+        group[0] += m.T @ m
+        group[1] += x.T @ m
+        group[2] += q.T @ m
+        group[3] += x.T @ x
+    return out
+
+
+def matrices(moments):
+    # Pairwise-complete covariance and correlation; NaN where a pair has < 2 rows
+    counts, sums, squares, products = moments
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = (products - sums * sums.T / counts) / (counts - 1)
+        variance_a = (squares - sums ** 2 / counts) / (counts - 1)
+        variance_b = variance_a.T
+        correlation = covariance / np.sqrt(variance_a * variance_b)
+    covariance = np.where(counts > 1, covariance, np.nan)
+    correlation = np.where(counts > 1, np.clip(correlation, -1.0, 1.0), np.nan)
+    return counts, covariance, correlation
+
+
+def group_label(grouping, key):
+    if grouping == 'all':
+        return 'all'
+    if grouping == 'state':
+        return str(key)
+    return str(format_periods([key], grouping)[0])
+
+
+def plain(matrix):
+    # JSON has no NaN; missing entries become null
+    return [[None if np.isnan(value) else float(value) for value in row] for row in matrix]
+
+
+def write_results(results, pollutants, run_info, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"correlation_{run_info['run_id']}")
+    with open(stem + '.json', 'w') as file:
+        json.dump(dict(run_info, pollutants=pollutants, groups=[
+            {'grouping': grouping, 'group': label, 'count': counts.astype(np.int64).tolist(),
+             'covariance': plain(covariance), 'correlation': plain(correlation)}
+            for grouping, label, (counts, covariance, correlation) in results]), file, indent=2)
+    with open(stem + '.csv', 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['grouping', 'group', 'pollutant_a', 'pollutant_b', 'count', 'covariance', 'correlation'])
+        for grouping, label, (counts, covariance, correlation) in results:
+            for i, a in enumerate(pollutants):
+                for j, b in enumerate(pollutants[i:], start=i):
+                    writer.writerow([grouping, label, a, b, int(counts[i, j]), covariance[i, j], correlation[i, j]])
+    return stem + '.json', stem + '.csv'
+
+
+def run(filepath, pollutants, groupings=('all',), output_dir=DEFAULT_STATS_DIR, source='auto',
+        cache_dir=DEFAULT_CACHE_DIR, comm=MPI.COMM_WORLD):
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    started = MPI.Wtime()
+
+    days, states, readings = read_columns(filepath, pollutants, 'state' in groupings, source, cache_dir, rank, size)
+    keys = [group_keys(grouping, days, states) for grouping in groupings]
+    ranges = key_ranges(keys, comm)
+
+    # One buffer for every grouping, so a single Allreduce merges them all
+    columns = len(pollutants)
+    spans = [max(last - first + 1, 0) for first, last in ranges]
+    buffer = np.zeros((sum(spans), MOMENTS, columns, columns))
+    offset = 0
+    for key, (first, _), span in zip(keys, ranges, spans):
+        accumulate(readings, key, first, buffer[offset:offset + span])
+        offset += span
+    comm.Allreduce(MPI.IN_PLACE, buffer, op=MPI.SUM)
+    if rank != 0:
+        return None
+
+    results = []
+    offset = 0
+    for grouping, (first, _), span in zip(groupings, ranges, spans):
+        for index in range(span):
+            moments = buffer[offset + index]
+            # Only groups that have rows (states are sparse codes, periods may have gaps)
+            if moments[0].max() > 0:
+                results.append((grouping, group_label(grouping, first + index), matrices(moments)))
+        offset += span
+
+    run_info = {'run_id': time.strftime('%Y%m%dT%H%M%S'), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'input': os.path.abspath(filepath), 'ranks': size, 'groupings': list(groupings),
+                'seconds': MPI.Wtime() - started}
+    paths = write_results(results, pollutants, run_info, output_dir)
+    overall = [result for result in results if result[0] == 'all']
+    if overall:
+        _, _, (_, _, correlation) = overall[0]
+        width = max(len(name) for name in pollutants) + 2
+        print(' ' * width + ''.join(f'{name:>{width}}' for name in pollutants))
+        for name, row in zip(pollutants, correlation):
+            print(f'{name:<{width}}' + ''.join(f'{value:>{width}.3f}' for value in row))
+    print(f"Matrices for {len(results)} groups written to {paths[0]} and {paths[1]}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Covariance and correlation between pollutants from one scan.')
+    parser.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS))
+    parser.add_argument('--by', nargs='+', choices=GROUPINGS, default=['all'],
+                        help='groupings to compute in the same pass (default: all rows together)')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='processed CSV to read')
+    parser.add_argument('--source', choices=['auto', 'csv', 'cache'], default='auto',
+                        help='read the CSV or the columnar cache; auto (default) prefers a fresh cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache written by init.py')
+    parser.add_argument('--output-dir', default=DEFAULT_STATS_DIR, help='directory for the JSON and CSV results')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run(args.input, args.pollutants, list(dict.fromkeys(args.by)), args.output_dir, args.source, args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
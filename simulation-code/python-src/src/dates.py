@@ -0,0 +1,114 @@
+import numpy as np
+
+# Dates travel between ranks as compact int32 day ordinals (days since
+# 1970-01-01). The fixed MM/DD/YYYY layout of the AirNow exports is parsed
+# with vectorized byte arithmetic; anything else goes through pandas.
+
+MISSING_DAY = np.iinfo(np.int32).min
+
+# Time grains and their numpy datetime units; month and year periods are
+# counted from 1970 like the day ordinals
+GRAINS = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+_SLASH = ord('/')
+_ZERO = ord('0')
+_MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def days_from_civil(year, month, day):
+    # Howard Hinnant's days_from_civil, vectorized over int64 arrays
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def days_in_month(year, month):
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return _MONTH_DAYS[month - 1] + ((month == 2) & leap)
+
+
+def _parse_fixed(raw):
+    # raw: 'S' array; returns (ordinals, ok) for entries shaped MM/DD/YYYY.
+    # Impossible dates such as 02/31/2024 are ok but MISSING_DAY, as pandas
+    # would have it, instead of rolling over into the next month.
+    count = len(raw)
+    ok = np.zeros(count, dtype=bool)
+    ordinals = np.full(count, MISSING_DAY, dtype=np.int64)
+    if count == 0 or raw.dtype.itemsize < 10:
+        return ordinals, ok
+
+    chars = np.ascontiguousarray(raw).view(np.uint8).reshape(count, raw.dtype.itemsize)
+    digits = chars[:, :10].astype(np.int64) - _ZERO
+    digit_positions = [0, 1, 3, 4, 6, 7, 8, 9]
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+
+    ok = (chars[:, 2] == _SLASH) & (chars[:, 5] == _SLASH)
+    ok &= ((digits[:, digit_positions] >= 0) & (digits[:, digit_positions] <= 9)).all(axis=1)
+    if raw.dtype.itemsize > 10:
+        ok &= (chars[:, 10:] == 0).all(axis=1)
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+
+    valid = ok.copy()
+    valid[ok] = day[ok] <= days_in_month(year[ok], month[ok])
+    ordinals[valid] = days_from_civil(year[valid], month[valid], day[valid])
+    return ordinals, ok
+
+
+def _parse_fallback(raw):
+    import pandas as pd  # Only needed for unusual layouts
+
+    text = pd.Series(raw).str.decode('utf-8') if raw.dtype.kind == 'S' else pd.Series(raw, dtype=object)
+    parsed = pd.to_datetime(text, errors='coerce', format='mixed')
+    ordinals = np.full(len(raw), MISSING_DAY, dtype=np.int64)
+    valid = parsed.notna().to_numpy()
+    ordinals[valid] = parsed[valid].to_numpy().astype('datetime64[D]').astype(np.int64)
+    return ordinals
+
+
+def parse_dates(dates):
+    # Returns int32 day ordinals; unparseable entries become MISSING_DAY
+    raw = np.asarray(dates)
+    if raw.dtype.kind in 'iu':
+        return raw.astype(np.int32)
+    if raw.dtype.kind == 'U':
+        try:
+            raw = raw.astype('S')
+        except UnicodeEncodeError:
+            return _parse_fallback(raw).astype(np.int32)
+    elif raw.dtype.kind != 'S':
+        raw = raw.astype('S')
+
+    ordinals, ok = _parse_fixed(raw)
+    if not ok.all():
+        ordinals[~ok] = _parse_fallback(raw[~ok])
+    return ordinals.astype(np.int32)
+
+
+def to_datetime64(ordinals):
+    return np.asarray(ordinals, dtype=np.int64).astype('datetime64[D]')
+
+
+def format_days(ordinals):
+    # ISO YYYY-MM-DD labels
+    return np.datetime_as_string(to_datetime64(ordinals), unit='D')
+
+
+def to_periods(ordinals, grain):
+    # Day ordinals -> month or year periods; MISSING_DAY is preserved
+    ordinals = np.asarray(ordinals)
+    if grain == 'day':
+        return ordinals.astype(np.int32)
+    missing = ordinals == MISSING_DAY
+    periods = to_datetime64(ordinals).astype(f'datetime64[{GRAINS[grain]}]').astype(np.int64)
+    return np.where(missing, MISSING_DAY, periods).astype(np.int32)
+
+
+def format_periods(periods, grain):
+    # YYYY-MM-DD, YYYY-MM or YYYY labels
+    units = GRAINS[grain]
+    return np.datetime_as_string(np.asarray(periods, dtype=np.int64).astype(f'datetime64[{units}]'), unit=units)
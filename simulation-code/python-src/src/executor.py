@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import shlex
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Execution backends for the heatmap engine. Under mpiexec every rank runs the
+# engine against MPI.COMM_WORLD as before. Without it the same scan runs as
+# independent parts, each read and binned on its own, either in this process
+# (serial) or in a pool of local worker processes (pool), and the parent adds
+# the parts' bins up. Small inputs skip the MPI launch entirely: 'auto' picks
+# serial below SERIAL_MAX_BYTES of scanning and a pool above it. mpi4py is
+# only imported when the MPI backend is chosen.
+
+BACKENDS = ['auto', 'mpi', 'pool', 'serial']
+SERIAL_MAX_BYTES = 32 * 1024 * 1024  # About a second of CSV parsing in one process
+CHUNKS_PER_WORKER = 16  # Parts per worker for --schedule dynamic, as scheduler.CHUNKS_PER_RANK
+MPIEXEC = shlex.split(os.environ.get('MPIEXEC', 'mpiexec'))  # e.g. 'mpiexec --oversubscribe'
+
+# Set by the common launchers (Open MPI, MPICH/Hydra, PMIx-based srun) in every rank
+LAUNCHER_VARIABLES = ['OMPI_COMM_WORLD_SIZE', 'PMI_SIZE', 'PMIX_RANK', 'MPI_LOCALNRANKS']
+
+
+def under_mpiexec():
+    return any(name in os.environ for name in LAUNCHER_VARIABLES)
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def choose_backend(requested, scan_bytes, needs_mpi=False):
+    # Under a launcher the other ranks already exist, so they are used
+    if requested != 'auto':
+        return requested
+    if needs_mpi or under_mpiexec():
+        return 'mpi'
+    return 'serial' if scan_bytes < SERIAL_MAX_BYTES else 'pool'
+
+
+def relaunch_with_mpiexec(ranks, command):
+    # Replaces this process (same pid, same process group) with mpiexec
+    # running `command` on every rank
+    if shutil.which(MPIEXEC[0]) is None:
+        raise SystemExit(f'{MPIEXEC[0]} not found; use --executor pool or serial')
+    sys.stdout.flush()
+    os.execvp(MPIEXEC[0], MPIEXEC + ['-np', str(ranks)] + command)
+
+
+class SerialComm:
+    # Just enough of a communicator for one process: every collective returns
+    # this process's own contribution
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return 1
+
+    def Barrier(self):
+        pass
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def gather(self, obj, root=0):
+        return [obj]
+
+    def allreduce(self, obj, op=None):
+        return obj
+
+    def Reduce(self, sendbuf, recvbuf, op=None, root=0):
+        recvbuf[...] = sendbuf
+
+
+class SerialExecutor:
+    name = 'serial'
+
+    def __init__(self, workers=1):
+        self.comm = SerialComm()
+        self.workers = 1
+
+    def map(self, task, parts):
+        return [task(part, parts) for part in range(parts)]
+
+
+class PoolExecutor:
+    name = 'pool'
+
+    def __init__(self, workers=None):
+        self.comm = SerialComm()
+        self.workers = workers or default_workers()
+
+    def map(self, task, parts):
+        # task(part, parts) must be picklable; results come back in part order.
+        # Forked workers start with this process's imports already loaded.
+        workers = min(self.workers, parts)
+        if workers <= 1:
+            return [task(part, parts) for part in range(parts)]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            return list(pool.map(task, range(parts), [parts] * parts))
+
+
+class MPIExecutor:
+    # SPMD: every rank runs the whole engine; there is nothing to map
+    name = 'mpi'
+
+    def __init__(self, workers=None):
+        from mpi4py import MPI
+
+        self.comm = MPI.COMM_WORLD
+        self.workers = self.comm.Get_size()
+
+
+EXECUTORS = {'mpi': MPIExecutor, 'pool': PoolExecutor, 'serial': SerialExecutor}
+
+
+def create_executor(backend, workers=None):
+    return EXECUTORS[backend](workers)
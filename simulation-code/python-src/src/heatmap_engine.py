@@ -0,0 +1,609 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR, is_fresh, load_manifest, open_columns, rank_row_range
+from dates import GRAINS, MISSING_DAY, format_periods, parse_dates, to_periods
+from executor import (BACKENDS, CHUNKS_PER_WORKER, SerialComm, choose_backend, create_executor, default_workers,
+                      relaunch_with_mpiexec, under_mpiexec)
+from instrument import Profiler, count, phase, report_progress, write_profile
+from partition import iter_lines, rank_byte_range
+from rollup import DEFAULT_CUBE_DIR, REGION_COLUMNS, geography_for, is_servable, query_cube
+from schema import column_index
+from sqlite_loader import DEFAULT_DB, date_bounds, query_daily
+
+# Column positions come from the shared schema of preprocessed_for_cpp.csv
+DATE_NAME = 'Date'
+DATE_COLUMN = column_index(DATE_NAME)
+POLLUTANTS = {
+    'PM10': {'name': 'Daily Mean PM10 Concentration', 'label': 'PM10', 'figure': 'PM10_heatmap_figure.png'},
+    'PM2.5': {'name': 'Daily Mean PM2.5 Concentration', 'label': 'PM2.5', 'figure': 'PM25_heatmap_figure.png'},
+    'Ozone': {'name': 'Daily Max 8-hour Ozone Concentration', 'label': 'ozone', 'figure': 'ozone_heatmap_figure.png'},
+    'NO2': {'name': 'Daily Max 1-hour NO2 Concentration', 'label': 'no2', 'figure': 'no2_heatmap_figure.png'},
+    'CO': {'name': 'Daily Max 8-hour CO Concentration', 'label': 'CO', 'figure': 'CO_heatmap_figure.png'},
+    'Pb': {'name': 'Daily Mean Pb Concentration', 'label': 'pb', 'figure': 'pb_heatmap_figure.png'},
+    'SO2': {'name': 'Daily Max 1-hour SO2 Concentration', 'label': 'SO2', 'figure': 'SO2_heatmap_figure.png'},
+}
+for pollutant in POLLUTANTS.values():
+    pollutant['column'] = column_index(pollutant['name'])
+
+GRAIN_TITLES = {'day': ('Daily', 'Day'), 'month': ('Monthly', 'Month'), 'year': ('Yearly', 'Year')}
+
+PROGRESS_EVERY = 100_000
+
+DEFAULT_INPUT = 'data/processed/preprocessed_for_cpp.csv'
+DEFAULT_OUTPUT_DIR = 'data/output'
+
+
+def read_data_slice(filepath, start, end, date_column, columns, progress=None):
+    # Every requested column is extracted from the same pass over this rank's
+    # byte range; unparseable readings become NaN
+    dates = []
+    rows = []
+    for line in iter_lines(filepath, start, end):
+        if progress is not None and rows and len(rows) % PROGRESS_EVERY == 0:
+            progress(len(rows))
+        values = line.decode('utf-8').strip().split(',')
+        if len(values) <= date_column:
+            continue
+        row = []
+        for column in columns:
+            try:
+                row.append(float(values[column]))
+            except (ValueError, IndexError):
+                row.append(np.nan)
+        dates.append(values[date_column])
+        rows.append(row)
+    # Dates are turned into day ordinals right here, on the rank that read them
+    readings = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns))
+    return parse_dates(dates), readings
+
+
+def read_cache_slice(cache_dir, rank, size, names):
+    # Memory-map only the date and requested pollutant columns, so only the
+    # rank's rows are read from disk. Parsing the dates and stacking the
+    # columns into one (rows, columns) array copy those rows once.
+    arrays, rows = open_columns(cache_dir, [DATE_NAME] + names)
+    start, end = rank_row_range(rows, rank, size)
+    days = parse_dates(arrays[DATE_NAME][start:end])
+    readings = np.column_stack([arrays[name][start:end] for name in names]) if names else np.empty((end - start, 0))
+    return days, readings
+
+
+def figure_path(output_dir, pollutant, grain='day', region_suffix=''):
+    figure = POLLUTANTS[pollutant]['figure']
+    if grain != 'day':
+        figure = figure.replace('_heatmap_figure.png', f'_{GRAIN_TITLES[grain][0].lower()}_heatmap.png')
+    if region_suffix:
+        stem, extension = os.path.splitext(figure)
+        figure = f'{stem}_{region_suffix}{extension}'
+    return os.path.join(output_dir, figure)
+
+
+def figure_spec(periods, means, pollutant, output_dir, grain='day', region_suffix='', layers=None):
+    # Everything render.py needs to draw one heatmap, as plain picklable data.
+    # layers: optional (name, values) rows drawn under the means, one value per period
+    label = POLLUTANTS[pollutant]['label']
+    adjective, unit = GRAIN_TITLES[grain]
+    spec = {
+        'path': figure_path(output_dir, pollutant, grain, region_suffix),
+        'values': means,
+        'tick_labels': [str(text) for text in format_periods(periods, grain)],
+        'title': f'Heatmap of {adjective} {label} Concentrations',
+        'xlabel': unit,
+        'ylabel': pollutant,
+        'colorbar': f'{label} Concentration',
+    }
+    if layers:
+        spec['values'] = np.vstack([means] + [values for _, values in layers])
+        spec['row_labels'] = [pollutant] + [name for name, _ in layers]
+    return spec
+
+
+def rolling_rows(rolling_dir, pollutant, periods):
+    # Network rolling layers from rolling.py, aligned to the observed days
+    from rolling import load_layers
+
+    loaded = load_layers(rolling_dir, pollutant)
+    if loaded is None:
+        return None
+    first_day, names, values = loaded
+    offsets = np.asarray(periods, dtype=np.int64) - first_day
+    inside = (offsets >= 0) & (offsets < values.shape[1])
+    rows = np.full((len(names), len(offsets)), np.nan)
+    rows[:, inside] = values[:, offsets[inside]]
+    return list(zip(names, rows))
+
+
+def widest(left, right):
+    return min(left[0], right[0]), max(left[1], right[1])
+
+
+def global_day_range(days, comm):
+    known = days[days != MISSING_DAY]
+    local_first = int(known.min()) if len(known) else np.iinfo(np.int32).max
+    local_last = int(known.max()) if len(known) else np.iinfo(np.int32).min
+    return comm.allreduce((local_first, local_last), op=widest)
+
+
+def reduce_bins(local, comm, profile=None):
+    rank = comm.Get_rank()
+    total = np.empty_like(local) if rank == 0 else None
+    with phase(profile, 'reduce'):
+        comm.Reduce(local, total, root=0)  # Sums by default
+        # Root takes in one buffer from every other rank
+        count(profile, sent=local.nbytes if rank else 0,
+              received=local.nbytes * (comm.Get_size() - 1) if rank == 0 else 0)
+    return total
+
+
+def local_bins(days, readings, first_day, span, out=None):
+    local = np.zeros((readings.shape[1], 2, span), dtype=np.float64) if out is None else out
+    for i in range(readings.shape[1]):
+        values = readings[:, i]
+        valid = (days != MISSING_DAY) & ~np.isnan(values)
+        offsets = days[valid].astype(np.int64) - first_day
+        local[i, 0] = np.bincount(offsets, weights=values[valid], minlength=span)
+        local[i, 1] = np.bincount(offsets, minlength=span)
+    return local
+
+
+def bin_periods(days, readings, comm, profile=None):
+    # Per-period (sum, count) arrays for every column, combined with a single
+    # buffer Reduce; the message size depends on the number of periods, not rows
+    with phase(profile, 'bin'):
+        first_day, last_day = global_day_range(days, comm)
+        span = max(last_day - first_day + 1, 0)
+        local = local_bins(days, readings, first_day, span)
+        count(profile, rows=len(days))
+    return first_day, reduce_bins(local, comm, profile)
+
+
+def bin_chunks(parts, columns, comm, profile=None):
+    # parts: this rank's (chunk, days, readings). Each chunk is binned over its
+    # own period range and only the chunks a rank pulled travel to root, in
+    # one Gatherv; root adds them up in chunk order with merge_bins. The
+    # result does not depend on the rank count or on which rank pulled which
+    # chunk, and equals a pool run with as many parts. Returns (0, None) off root.
+    with phase(profile, 'bin'):
+        binned = [(chunk,) + bin_periods(days, readings, SerialComm()) for chunk, days, readings in parts]
+        count(profile, rows=sum(len(days) for _, days, _ in parts))
+    with phase(profile, 'reduce'):
+        layout = comm.gather([(chunk, first, totals.shape[-1]) for chunk, first, totals in binned], root=0)
+        send = (np.concatenate([totals.ravel() for _, _, totals in binned]) if binned
+                else np.empty(0, dtype=np.float64))
+        received = None
+        if layout is not None:
+            sizes = [sum(columns * 2 * span for _, _, span in rank_layout) for rank_layout in layout]
+            received = np.empty(sum(sizes), dtype=np.float64)
+            comm.Gatherv(send, [received, sizes], root=0)
+        else:
+            comm.Gatherv(send, None, root=0)
+        count(profile, sent=send.nbytes if comm.Get_rank() else 0,
+              received=received.nbytes - send.nbytes if received is not None else 0)
+    if layout is None:
+        return 0, None
+    partials = []
+    offset = 0
+    for chunk, first, span in (entry for rank_layout in layout for entry in rank_layout):
+        size = columns * 2 * span
+        partials.append((chunk, first, received[offset:offset + size].reshape(columns, 2, span)))
+        offset += size
+    return merge_bins([(first, totals) for _, first, totals in sorted(partials, key=lambda part: part[0])], columns)
+
+
+def merge_bins(partials, columns):
+    # Adds up (first_period, totals) of parts binned over their own period
+    # ranges, in part order, on the union of the ranges
+    ranges = [(first, first + totals.shape[-1]) for first, totals in partials if totals.shape[-1]]
+    if not ranges:
+        return 0, np.zeros((columns, 2, 0), dtype=np.float64)
+    first_period = min(first for first, _ in ranges)
+    merged = np.zeros((columns, 2, max(end for _, end in ranges) - first_period), dtype=np.float64)
+    for first, totals in partials:
+        offset = first - first_period
+        if totals.shape[-1]:
+            merged[..., offset:offset + totals.shape[-1]] += totals
+    return first_period, merged
+
+
+def bin_aggregated(days, sums, counts, comm, profile=None):
+    # Same layout as bin_periods for rows that were already summed; several
+    # rows may fall into the same period
+    with phase(profile, 'bin'):
+        first_day, last_day = global_day_range(days, comm)
+        span = max(last_day - first_day + 1, 0)
+
+        local = np.zeros((sums.shape[1], 2, span), dtype=np.float64)
+        offsets = days.astype(np.int64) - first_day
+        for i in range(sums.shape[1]):
+            np.add.at(local[i, 0], offsets, sums[:, i])
+            np.add.at(local[i, 1], offsets, counts[:, i])
+        count(profile, rows=len(days))
+    return first_day, reduce_bins(local, comm, profile)
+
+
+def rebin(first_day, totals, grain):
+    # Fold daily (sum, count) bins into a coarser grain at root; days are
+    # contiguous, so their periods are sorted
+    if grain == 'day' or totals.shape[-1] == 0:
+        return first_day, totals
+    periods = to_periods(first_day + np.arange(totals.shape[-1], dtype=np.int32), grain)
+    offsets = periods.astype(np.int64) - periods[0]
+    span = int(offsets[-1]) + 1
+    coarse = np.zeros(totals.shape[:-1] + (span,), dtype=np.float64)
+    for index in np.ndindex(totals.shape[:-1]):
+        coarse[index] = np.bincount(offsets, weights=totals[index], minlength=span)
+    return int(periods[0]), coarse
+
+
+def limit_days(days, start_day=None, end_day=None):
+    # Rows outside the requested date range are treated like unparseable dates
+    outside = np.zeros(len(days), dtype=bool)
+    if start_day is not None:
+        outside |= days < start_day
+    if end_day is not None:
+        outside |= days > end_day
+    return np.where(outside, MISSING_DAY, days).astype(np.int32)
+
+
+def limit_region(days, region_values, state_code=None, county_code=None, site_id=None):
+    # region_values holds the STATE_CODE, COUNTY_CODE and Site ID columns
+    outside = np.zeros(len(days), dtype=bool)
+    for i, value in enumerate((state_code, county_code, site_id)):
+        if value is not None:
+            outside |= region_values[:, i] != value
+    return np.where(outside, MISSING_DAY, days).astype(np.int32)
+
+
+def region_suffix(state_code=None, county_code=None, site_id=None):
+    parts = [f'{name}{value}' for name, value in (('state', state_code), ('county', county_code), ('site', site_id))
+             if value is not None]
+    return '_'.join(parts)
+
+
+def read_sqlite_slice(db_path, rank, size, names, comm, **filters):
+    # Rank 0 of comm finds the date span; each rank (or pool part) then lets
+    # SQLite aggregate its share of the days with the filters pushed down
+    bounds = date_bounds(db_path, **filters) if comm.Get_rank() == 0 else None
+    first_day, last_day = comm.bcast(bounds, root=0)
+    if first_day is None:
+        return np.empty(0, dtype=np.int32), np.empty((0, len(names))), np.empty((0, len(names)))
+    span = last_day - first_day + 1
+    start = first_day + span * rank // size
+    end = first_day + span * (rank + 1) // size - 1
+    if end < start:
+        return np.empty(0, dtype=np.int32), np.empty((0, len(names))), np.empty((0, len(names)))
+    filters = dict(filters, start_day=start, end_day=end)
+    return query_daily(db_path, names, **filters)
+
+
+class ScanJob:
+    # What one scan reads, filters and bins, as plain data so that pool
+    # workers can each run a part of it
+    def __init__(self, filepath, pollutants, source, cache_dir, db_path, bin_grain, start_day=None, end_day=None,
+                 region=None, progress=False):
+        self.filepath = filepath
+        self.source = source
+        self.cache_dir = cache_dir
+        self.db_path = db_path
+        self.bin_grain = bin_grain
+        self.start_day = start_day
+        self.end_day = end_day
+        self.region = region or {}
+        self.progress = progress
+        self.profile_origin = None  # Set to the parent profile's origin to time the parts
+        self.names = [POLLUTANTS[name]['name'] for name in pollutants]
+        self.region_names = REGION_COLUMNS[:len(REGION_COLUMNS) if self.region else 0]
+        self.columns = ([POLLUTANTS[name]['column'] for name in pollutants] +
+                        [column_index(name) for name in self.region_names])
+        self.cached = source != 'sqlite' and use_cache(source, filepath, cache_dir)
+
+    def read(self, part, parts, report=None, profile=None):
+        # One scan of the part serves every requested pollutant
+        if self.cached:
+            days, readings = read_cache_slice(self.cache_dir, part, parts, self.names + self.region_names)
+            count(profile, rows=len(days), read=readings.nbytes + days.nbytes)
+        else:
+            # Seek straight to the part's byte range; no up-front line count
+            start, end = rank_byte_range(self.filepath, part, parts)
+            days, readings = read_data_slice(self.filepath, start, end, DATE_COLUMN, self.columns,
+                                             progress=(lambda rows: report('read', rows)) if report else None)
+            count(profile, rows=len(days), read=end - start)
+        return days, readings
+
+    def limit(self, days, readings):
+        days = limit_days(days, self.start_day, self.end_day)
+        if self.region:
+            days = limit_region(days, readings[:, len(self.names):], **self.region)
+        return days, readings[:, :len(self.names)]
+
+    def read_sqlite(self, part, parts, comm):
+        return read_sqlite_slice(self.db_path, part, parts, self.names, comm, start_day=self.start_day,
+                                 end_day=self.end_day, **self.region)
+
+    def bin_part(self, part, parts):
+        # Read, filter and bin one part on its own; see merge_bins. Returns
+        # (first_period, totals, profile records) so the phases timed in a
+        # worker process reach the parent's profile.
+        comm = SerialComm()
+        profile = Profiler(comm, self.profile_origin) if self.profile_origin is not None else None
+        if self.source == 'sqlite':
+            with phase(profile, 'read'):
+                days, sums, counts = self.read_sqlite(part, parts, comm)
+                count(profile, rows=len(days))
+            first_period, totals = bin_aggregated(to_periods(days, self.bin_grain), sums, counts, comm, profile)
+        else:
+            report = (lambda name, rows=0: report_progress(part, name, rows)) if self.progress else None
+            with phase(profile, 'read'):
+                days, readings = self.read(part, parts, report, profile)
+            if report:
+                report('aggregate', len(days))
+            with phase(profile, 'filter'):
+                days, readings = self.limit(days, readings)
+            first_period, totals = bin_periods(to_periods(days, self.bin_grain), readings, comm, profile)
+        return first_period, totals, profile.worker_records() if profile is not None else []
+
+
+def period_means(first_period, sums, counts):
+    # Periods come back sorted by construction; only observed ones are kept
+    observed = counts > 0
+    periods = first_period + np.flatnonzero(observed)
+    return periods.astype(np.int32), sums[observed] / counts[observed]
+
+
+def read_cube_means(cube_dir, grain, names, start_day=None, end_day=None, region=None):
+    periods, sums, counts, _, _ = query_cube(cube_dir, grain, names, **(region or {}))
+    keep = np.ones(len(periods), dtype=bool)
+    if start_day is not None:
+        keep &= periods >= to_periods([start_day], grain)[0]
+    if end_day is not None:
+        keep &= periods <= to_periods([end_day], grain)[0]
+    order = np.argsort(periods[keep], kind='stable')
+    periods, sums, counts = periods[keep][order], sums[keep][order], counts[keep][order]
+    results = []
+    for i in range(len(names)):
+        observed = counts[:, i] > 0
+        results.append((periods[observed], sums[observed, i] / counts[observed, i]))
+    return results
+
+
+def use_cache(source, filepath, cache_dir):
+    if source == 'cache':
+        return True
+    return source == 'auto' and is_fresh(cache_dir, filepath)
+
+
+def period_aligned(grain, start_day=None, end_day=None):
+    # Whether the date range covers whole periods of the grain; the cube only
+    # holds whole periods, so it cannot answer a range that cuts one
+    if start_day is not None and to_periods([start_day - 1], grain)[0] == to_periods([start_day], grain)[0]:
+        return False
+    if end_day is not None and to_periods([end_day + 1], grain)[0] == to_periods([end_day], grain)[0]:
+        return False
+    return True
+
+
+def use_cube(source, filepath, cube_dir, grains, names, region, start_day=None, end_day=None):
+    if source not in ('auto', 'cube'):
+        return False
+    if not all(period_aligned(grain, start_day, end_day) for grain in grains):
+        return False
+    geography, _ = geography_for(**(region or {}))
+    return all(is_servable(cube_dir, grain, geography, names, None if source == 'cube' else filepath)
+               for grain in grains)
+
+
+def scan_bytes(filepath, names, source, cache_dir, db_path, cube_dir, grains, region, start_day=None, end_day=None):
+    # Rough amount of data a run has to scan, for picking an executor
+    if use_cube(source, filepath, cube_dir, grains, names, region, start_day, end_day):
+        return 0
+    if source == 'sqlite':
+        return os.path.getsize(db_path) if os.path.exists(db_path) else 0
+    if use_cache(source, filepath, cache_dir):
+        manifest = load_manifest(cache_dir)
+        if manifest is None:
+            return 0
+        return sum(manifest['rows'] * np.dtype(manifest['columns'][name]['dtype']).itemsize
+                   for name in [DATE_NAME] + names)
+    return os.path.getsize(filepath) if os.path.exists(filepath) else 0
+
+
+def render_all(specs, show, progress, workers=None):
+    # Only rank 0 renders, so only rank 0 pays for matplotlib
+    from render import is_headless, render_batch, show_heatmaps
+
+    if show and not is_headless():
+        paths = show_heatmaps(specs)
+    else:
+        # Headless runs write every figure from a pool of Agg workers
+        paths = render_batch(specs, workers)
+    if progress:
+        for path in paths:
+            sys.stdout.write(f'FIGURE {path}\n')
+            sys.stdout.flush()
+    return paths
+
+
+def run(filepath, pollutants, output_dir, show=True, source='auto', cache_dir=DEFAULT_CACHE_DIR,
+        db_path=DEFAULT_DB, cube_dir=DEFAULT_CUBE_DIR, grains=('day',), start_day=None, end_day=None, region=None,
+        progress=False, render_workers=None, profile_dir=None, schedule='static', chunks=None, shared=False,
+        rolling_dir=None, executor=None):
+    # Without an executor: the MPI ranks under mpiexec, otherwise this process alone
+    executor = executor or create_executor('mpi' if under_mpiexec() else 'serial')
+    comm = executor.comm
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    names = [POLLUTANTS[name]['name'] for name in pollutants]
+    region = {key: value for key, value in (region or {}).items() if value is not None}
+    suffix = region_suffix(**region)
+    report = (lambda name, rows=0: report_progress(rank, name, rows)) if progress else (lambda name, rows=0: None)
+    profile = Profiler(comm) if profile_dir else None
+
+    if use_cube(source, filepath, cube_dir, grains, names, region, start_day, end_day):
+        # Materialized grains: rank 0 answers straight from the rollup cube
+        if rank == 0:
+            report('cube')
+            specs = []
+            with phase(profile, 'cube'):
+                for grain in grains:
+                    results = read_cube_means(cube_dir, grain, names, start_day, end_day, region)
+                    specs += [figure_spec(periods, means, name, output_dir, grain, suffix)
+                              for name, (periods, means) in zip(pollutants, results)]
+            report('render')
+            with phase(profile, 'render'):
+                render_all(specs, show, progress, render_workers)
+    else:
+        report('read')
+        # Several grains are all derived from one set of daily bins
+        bin_grain = grains[0] if len(grains) == 1 else 'day'
+        # A cube that cannot answer (e.g. dates cutting a period) falls back to a fresh cache, then the CSV
+        source = 'auto' if source == 'cube' else source
+        job = ScanJob(filepath, pollutants, source, cache_dir, db_path, bin_grain, start_day, end_day, region, progress)
+
+        if executor.name != 'mpi':
+            # Independent parts, each binned where it was read and added up here
+            dynamic = schedule == 'dynamic' and executor.workers > 1
+            parts = (chunks or CHUNKS_PER_WORKER * executor.workers) if dynamic else executor.workers
+            job.profile_origin = profile.origin if profile is not None else None
+            with phase(profile, 'scan'):
+                binned = executor.map(job.bin_part, parts)
+                first_period, totals = merge_bins([(first, part_totals) for first, part_totals, _ in binned],
+                                                  len(names))
+            if profile is not None:
+                profile.merge_workers([record for _, _, records in binned for record in records])
+        elif source == 'sqlite':
+            with phase(profile, 'read'):
+                days, sums, counts = job.read_sqlite(rank, size, comm)
+                count(profile, rows=len(days))
+            first_period, totals = bin_aggregated(to_periods(days, bin_grain), sums, counts, comm, profile)
+        else:
+            def read_part(part, parts):
+                return job.read(part, parts, report if progress else None, profile)
+
+            dataset = None
+            if shared:
+                from shared_data import load_node_dataset
+
+                # Parse once per node into a shared window; parts become zero-copy views of it
+                with phase(profile, 'load'):
+                    dataset = load_node_dataset(read_part, len(job.columns), comm)
+                read_part = dataset.part
+
+            if schedule == 'dynamic':
+                from scheduler import default_chunks, pull_chunks
+
+                # Many small parts pulled from a shared counter instead of one fixed slice per rank
+                chunks = chunks or default_chunks(comm)
+                with phase(profile, 'read'):
+                    parts = pull_chunks(read_part, chunks, comm)
+                report('aggregate', sum(len(part_days) for _, (part_days, _) in parts))
+                with phase(profile, 'filter'):
+                    parts = [(chunk,) + job.limit(*part) for chunk, part in parts]
+                parts = [(chunk, to_periods(part_days, bin_grain), part_readings)
+                         for chunk, part_days, part_readings in parts]
+                first_period, totals = bin_chunks(parts, len(names), comm, profile)
+            else:
+                with phase(profile, 'read'):
+                    days, readings = read_part(rank, size)
+                report('aggregate', len(days))
+                with phase(profile, 'filter'):
+                    days, readings = job.limit(days, readings)
+
+                # Pre-aggregate locally and reduce the period bins at root
+                first_period, totals = bin_periods(to_periods(days, bin_grain), readings, comm, profile)
+            if dataset is not None:
+                dataset.free()
+
+        if rank == 0:
+            # Rank 0 only divides and plots
+            report('render')
+            specs = []
+            with phase(profile, 'means'):
+                for grain in grains:
+                    first, grain_totals = ((first_period, totals) if grain == bin_grain
+                                           else rebin(first_period, totals, grain))
+                    for i, name in enumerate(pollutants):
+                        periods, means = period_means(first, grain_totals[i, 0], grain_totals[i, 1])
+                        # Rolling layers are daily and cover the whole network
+                        layers = (rolling_rows(rolling_dir, name, periods)
+                                  if rolling_dir and grain == 'day' and not region else None)
+                        specs.append(figure_spec(periods, means, name, output_dir, grain, suffix, layers))
+            with phase(profile, 'render'):
+                render_all(specs, show, progress, render_workers)
+    report('done')
+    if profile is not None:
+        write_profile(profile, profile_dir)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render pollutant heatmaps from one scan of the processed data.')
+    parser.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS),
+                        help='pollutants to render (default: all)')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='processed CSV to read')
+    parser.add_argument('--source', choices=['auto', 'csv', 'cache', 'cube', 'sqlite'], default='auto',
+                        help='read the CSV, the columnar cache, the rollup cube or the SQLite database; '
+                             'auto (default) prefers a fresh cube, then a fresh cache, then the CSV')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache written by init.py')
+    parser.add_argument('--cube-dir', default=DEFAULT_CUBE_DIR, help='rollup cube written by init.py')
+    parser.add_argument('--db', default=DEFAULT_DB, help='database written by sqlite_loader.py')
+    parser.add_argument('--grain', nargs='+', choices=list(GRAINS), default=['day'],
+                        help='time grains of the heatmaps; several grains share one read')
+    parser.add_argument('--start', help='first date to include (YYYY-MM-DD or MM/DD/YYYY)')
+    parser.add_argument('--end', help='last date to include')
+    parser.add_argument('--state-code', type=int, help='only this STATE_CODE')
+    parser.add_argument('--county-code', type=int, help='only this COUNTY_CODE (together with --state-code)')
+    parser.add_argument('--site-id', type=int, help='only this Site ID')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='directory for the heatmap figures')
+    parser.add_argument('--no-show', action='store_true', help='save the figures without opening a window')
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help='processes writing figures when headless (default: CPU count)')
+    parser.add_argument('--progress', action='store_true', help='print PROGRESS/FIGURE lines for job managers')
+    parser.add_argument('--schedule', choices=['static', 'dynamic'], default='static',
+                        help='static: one equal slice per rank; dynamic: ranks pull small chunks from a shared '
+                             'counter (CSV and cache sources)')
+    parser.add_argument('--chunks', type=int, default=None,
+                        help='number of chunks for --schedule dynamic (default: 16 per rank)')
+    parser.add_argument('--shared-memory', action='store_true',
+                        help='load the data once per node into an MPI shared window instead of once per rank')
+    parser.add_argument('--rolling-dir', default=None,
+                        help='add the rolling.py layers (moving averages, maxima, streaks) under daily heatmaps')
+    parser.add_argument('--executor', choices=BACKENDS, default='auto',
+                        help='mpi: ranks under mpiexec (relaunched with --workers ranks when started without it); '
+                             'pool: local worker processes; serial: this process only; auto (default): mpi under '
+                             'mpiexec, otherwise serial for small scans and a pool for large ones')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='pool processes, or ranks when relaunching under mpiexec (default: CPU count)')
+    parser.add_argument('--profile', metavar='DIR', default=None,
+                        help='write per-rank phase timings (profile.json) and a Chrome trace (trace.json) to DIR; '
+                             'with --executor pool every worker process gets its own track')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parse_args(argv)
+    start_day, end_day = (int(parse_dates([value])[0]) if value else None for value in (args.start, args.end))
+    region = {'state_code': args.state_code, 'county_code': args.county_code, 'site_id': args.site_id}
+    if args.county_code is not None and args.state_code is None:
+        raise SystemExit('--county-code needs --state-code; county codes repeat across states')
+    names = [POLLUTANTS[name]['name'] for name in args.pollutants]
+    work = scan_bytes(args.input, names, args.source, args.cache_dir, args.db, args.cube_dir, args.grain,
+                      {key: value for key, value in region.items() if value is not None}, start_day, end_day)
+    backend = choose_backend(args.executor, work, needs_mpi=args.shared_memory)
+    if args.shared_memory and backend != 'mpi':
+        raise SystemExit('--shared-memory needs --executor mpi')
+    if backend == 'mpi' and not under_mpiexec():
+        relaunch_with_mpiexec(args.workers or default_workers(),
+                              [sys.executable, os.path.abspath(__file__)] + argv + ['--executor', 'mpi'])
+    run(args.input, args.pollutants, args.output_dir, show=not args.no_show, source=args.source,
+        cache_dir=args.cache_dir, db_path=args.db, cube_dir=args.cube_dir, grains=list(dict.fromkeys(args.grain)),
+        start_day=start_day, end_day=end_day, region=region, progress=args.progress,
+        render_workers=args.render_workers, profile_dir=args.profile, schedule=args.schedule, chunks=args.chunks,
+        shared=args.shared_memory, rolling_dir=args.rolling_dir, executor=create_executor(backend, args.workers))
+
+
+if __name__ == "__main__":
+    main()
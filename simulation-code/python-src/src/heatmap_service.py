@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import json
+import os
+import secrets
+import stat
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# Long-lived heatmap service. The dataset is loaded once and kept resident,
+# figures are drawn by a pool of warm render processes, and results are cached
+# by (pollutants, grain, filters, data fingerprint). Clients such as
+# ui_heatmap.py talk to it over a local socket instead of paying mpiexec,
+# interpreter and import start-up for every click.
+#
+# Only the client half is imported by the UI; numpy and matplotlib are
+# imported when a server starts, and mpi4py not at all.
+#
+# Connections carry pickles, so both ends must share a secret key: the
+# HEATMAP_SERVICE_KEY environment variable, or a random per-user key file
+# (mode 0600, created by the keygen command). Without one the service will
+# not start and clients do not connect.
+
+DEFAULT_ADDRESS = ('localhost', 6060)
+KEY_FILE = os.environ.get('HEATMAP_SERVICE_KEY_FILE',
+                          os.path.join(os.path.expanduser('~'), '.config', 'heatmap_service', 'authkey'))
+RESULT_CACHE_SIZE = 256
+
+
+class ServiceKeyError(Exception):
+    pass
+
+
+def generate_key(path=KEY_FILE):
+    # A new random key, readable by this user only
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write(secrets.token_hex(32))
+    return path
+
+
+def load_authkey(path=KEY_FILE):
+    key = os.environ.get('HEATMAP_SERVICE_KEY')
+    if key:
+        return key.encode()
+    if not os.path.exists(path):
+        raise ServiceKeyError("No heatmap service key: set HEATMAP_SERVICE_KEY or run 'heatmap_service.py keygen'")
+    info = os.stat(path)
+    if info.st_mode & (stat.S_IRWXG | stat.S_IRWXO) or (hasattr(os, 'getuid') and info.st_uid != os.getuid()):
+        raise ServiceKeyError(f"{path} must be owned by you and readable by you only (chmod 600)")
+    with open(path) as file:
+        key = file.read().strip()
+    if not key:
+        raise ServiceKeyError(f"{path} is empty; run 'heatmap_service.py keygen'")
+    return key.encode()
+
+
+def request(message, address=DEFAULT_ADDRESS, timeout=None):
+    with Client(address, authkey=load_authkey()) as conn:
+        conn.send(message)
+        if timeout is not None and not conn.poll(timeout):
+            raise TimeoutError(f"No reply from heatmap service at {address}")
+        return conn.recv()
+
+
+def is_running(address=DEFAULT_ADDRESS):
+    try:
+        return request({'op': 'ping'}, address, timeout=2).get('ok', False)
+    except (OSError, EOFError, TimeoutError, AuthenticationError, ServiceKeyError):
+        return False
+
+
+def request_render(pollutants, grain='day', region=None, start=None, end=None, output_dir=None,
+                   address=DEFAULT_ADDRESS):
+    message = {'op': 'render', 'pollutants': list(pollutants), 'grain': grain, 'region': region or {},
+               'start': start, 'end': end}
+    if output_dir is not None:
+        message['output_dir'] = output_dir
+    return request(message, address)
+
+
+class HeatmapService:
+    def __init__(self, filepath, cache_dir, cube_dir, output_dir, workers=2):
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        self.filepath = filepath
+        self.cache_dir = cache_dir
+        self.cube_dir = cube_dir
+        self.output_dir = output_dir
+        from render import render_pool
+
+        # Warm Agg workers; the figures never touch MPI or pyplot
+        self.pool = render_pool(workers)
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.load()
+
+    def data_fingerprint(self):
+        parts = []
+        for path in (self.filepath, os.path.join(self.cache_dir, 'manifest.json'),
+                     os.path.join(self.cube_dir, 'manifest.json')):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts.append(f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}')
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+    def load(self):
+        import numpy as np
+        from executor import SerialComm
+        import heatmap_engine as engine
+
+        # Every pollutant plus the region columns, resident for the life of the service
+        names = [engine.POLLUTANTS[name]['name'] for name in engine.POLLUTANTS]
+        columns = names + engine.REGION_COLUMNS
+        if engine.use_cache('auto', self.filepath, self.cache_dir):
+            days, readings = engine.read_cache_slice(self.cache_dir, 0, 1, columns)
+        else:
+            start, end = engine.rank_byte_range(self.filepath, 0, 1)
+            indexes = [engine.column_index(name) for name in columns]
+            days, readings = engine.read_data_slice(self.filepath, start, end, engine.DATE_COLUMN, indexes)
+        self.days = days
+        self.readings = np.ascontiguousarray(readings[:, :len(names)])
+        self.regions = np.ascontiguousarray(readings[:, len(names):])
+        self.names = names
+        self.comm = SerialComm()
+        self.fingerprint = self.data_fingerprint()
+        self.results.clear()
+
+    def compute(self, pollutant, grain, region, start_day, end_day):
+        import heatmap_engine as engine
+
+        name = engine.POLLUTANTS[pollutant]['name']
+        if engine.use_cube('auto', self.filepath, self.cube_dir, [grain], [name], region, start_day, end_day):
+            return engine.read_cube_means(self.cube_dir, grain, [name], start_day, end_day, region)[0]
+        column = self.names.index(name)
+        days = engine.limit_days(self.days, start_day, end_day)
+        if region:
+            days = engine.limit_region(days, self.regions, **region)
+        first_period, totals = engine.bin_periods(engine.to_periods(days, grain),
+                                                  self.readings[:, [column]], self.comm)
+        return engine.period_means(first_period, totals[0, 0], totals[0, 1])
+
+    def render(self, message):
+        from dates import parse_dates
+        import heatmap_engine as engine
+        from render import save_figure
+
+        # Reload transparently when the processed data changed underneath us
+        with self.lock:
+            if self.data_fingerprint() != self.fingerprint:
+                self.load()
+            fingerprint = self.fingerprint
+
+        grain = message.get('grain', 'day')
+        region = {key: value for key, value in (message.get('region') or {}).items() if value is not None}
+        output_dir = message.get('output_dir', self.output_dir)
+        start_day, end_day = (int(parse_dates([value])[0]) if value else None
+                              for value in (message.get('start'), message.get('end')))
+        suffix = engine.region_suffix(**region)
+
+        figures = {}
+        cached = []
+        pending = []
+        for pollutant in message['pollutants']:
+            key = (pollutant, grain, tuple(sorted(region.items())), start_day, end_day, output_dir, fingerprint)
+            with self.lock:
+                path = self.results.get(key)
+                if path is not None and os.path.exists(path):
+                    self.results.move_to_end(key)
+                    figures[pollutant] = path
+                    cached.append(pollutant)
+                    continue
+            periods, means = self.compute(pollutant, grain, region, start_day, end_day)
+            spec = engine.figure_spec(periods, means, pollutant, output_dir, grain, suffix)
+            pending.append((key, self.pool.submit(save_figure, spec)))
+        for key, future in pending:
+            path = future.result()
+            figures[key[0]] = path
+            with self.lock:
+                self.results[key] = path
+                while len(self.results) > RESULT_CACHE_SIZE:
+                    self.results.popitem(last=False)
+        return {'ok': True, 'figures': [figures[pollutant] for pollutant in message['pollutants']],
+                'cached': cached, 'fingerprint': fingerprint}
+
+    def handle(self, conn):
+        with conn:
+            try:
+                message = conn.recv()
+                started = time.perf_counter()
+                if message.get('op') == 'ping':
+                    reply = {'ok': True, 'fingerprint': self.fingerprint}
+                elif message.get('op') == 'render':
+                    reply = self.render(message)
+                elif message.get('op') == 'reload':
+                    with self.lock:
+                        self.load()
+                    reply = {'ok': True, 'fingerprint': self.fingerprint}
+                elif message.get('op') == 'shutdown':
+                    reply = {'ok': True}
+                    self.stopping = True
+                else:
+                    reply = {'ok': False, 'error': f"Unknown request: {message.get('op')}"}
+                reply['seconds'] = time.perf_counter() - started
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            try:
+                conn.send(reply)
+            except OSError:
+                pass
+        if self.stopping:
+            # Wake the accept() in serve() so it can see the flag
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+
+    def serve(self, address=DEFAULT_ADDRESS):
+        self.stopping = False
+        self.address = address
+        self.authkey = load_authkey()
+        with Listener(address, authkey=self.authkey) as listener:
+            print(f"Heatmap service listening on {address[0]}:{address[1]}", flush=True)
+            while not self.stopping:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    # Includes clients without the key; they are dropped, the service keeps running
+                    continue
+                # Each request gets its own thread so a slow render does not block pings
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        self.pool.shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Warm heatmap service and client.')
+    parser.add_argument('--host', default=DEFAULT_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='load the dataset and answer render requests')
+    serve.add_argument('--input', default='data/processed/preprocessed_for_cpp.csv')
+    serve.add_argument('--cache-dir', default='data/processed/columnar')
+    serve.add_argument('--cube-dir', default='data/processed/rollup')
+    serve.add_argument('--output-dir', default='data/output')
+    serve.add_argument('--workers', type=int, default=2, help='render processes')
+
+    render = commands.add_parser('render', help='ask a running service for figures')
+    render.add_argument('pollutants', nargs='+')
+    render.add_argument('--grain', default='day')
+    render.add_argument('--start')
+    render.add_argument('--end')
+    render.add_argument('--state-code', type=int)
+    render.add_argument('--county-code', type=int)
+    render.add_argument('--site-id', type=int)
+
+    commands.add_parser('stop', help='shut a running service down')
+    commands.add_parser('keygen', help=f'write a new random key to {KEY_FILE} (mode 0600)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    address = (args.host, args.port)
+    if args.command == 'keygen':
+        print(f"New heatmap service key written to {generate_key()}")
+        return
+    try:
+        load_authkey()
+    except ServiceKeyError as e:
+        raise SystemExit(str(e))
+    if args.command == 'serve':
+        HeatmapService(args.input, args.cache_dir, args.cube_dir, args.output_dir, args.workers).serve(address)
+    elif args.command == 'render':
+        region = {'state_code': args.state_code, 'county_code': args.county_code, 'site_id': args.site_id}
+        print(json.dumps(request_render(args.pollutants, args.grain, region, args.start, args.end,
+                                        address=address), indent=2))
+    else:
+        print(json.dumps(request({'op': 'shutdown'}, address)))
+
+
+if __name__ == "__main__":
+    main()
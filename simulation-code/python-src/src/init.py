@@ -1,43 +1,284 @@
-import pandas as pd
+import argparse
+import io
+import os
+
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR, ColumnarWriter, column_dtypes, merge_dtypes, write_cache
+from instrument import report_progress
+from partition import rank_byte_range, read_byte_range, read_header
+from rollup import DEFAULT_CUBE_DIR, build_from_cache
+from schema import DROPPED_COLUMNS, POLLUTANT_COLUMNS, read_airnow_csv
+from sketch import DEFAULT_ALPHA, QuantileSketch
+
+DEFAULT_CHUNK_ROWS = 200_000
+WRITE_BLOCK = 1 << 30  # Bytes per collective write call; MPI counts are ints
 
 def load_and_preprocess_data(file_path):
-    data = pd.read_csv(file_path)
-    # Step 1: Clean `DAILY_AQI_VALUE`
-    # Convert DAILY_AQI_VALUE to numeric, setting errors='coerce' to turn non-convertible values into NaNs
-    data['DAILY_AQI_VALUE'] = pd.to_numeric(data['DAILY_AQI_VALUE'], errors='coerce')
+    # Step 1: Typed read with the declared AirNow schema
+    # DAILY_AQI_VALUE is coerced to numeric by the reader, turning non-convertible values into NaNs
+    data = read_airnow_csv(file_path)
 
     # Step 2: Handle Missing Data for Key Pollutants
     # For simplicity in this ETL phase, fill missing values with the median of each column
     # This is a simplistic approach, more sophisticated methods might be needed for accurate simulations
-    pollutant_columns = [
-        'Daily Mean PM10 Concentration',
-        'Daily Mean PM2.5 Concentration',
-        'Daily Max 8-hour Ozone Concentration',
-        'Daily Max 1-hour NO2 Concentration',
-        'Daily Max 8-hour CO Concentration',
-        'Daily Mean Pb Concentration',
-        'Daily Max 1-hour SO2 Concentration'
-        ]
-
-    for col in pollutant_columns:
-        data[col].fillna(data[col].median(), inplace=True)
+    for col in POLLUTANT_COLUMNS:
+        data[col] = data[col].fillna(data[col].median())
     
-    data.drop(columns=['Site Name', 'CBSA_CODE', 'CBSA_NAME'], inplace=True)   
+    data.drop(columns=DROPPED_COLUMNS, inplace=True)   
     
     data.head()
     data.info()
         
     return data
 
-def main():
-    input_path = 'data/raw/combined_file_final.csv'
-    processed_data = load_and_preprocess_data(input_path)
-    
-    # Save the preprocessed data to a file that will be read by the C++ simulation
-    output_path = 'data/processed/preprocessed_for_cpp.csv'
-    processed_data.to_csv(output_path, index=False)
+def read_chunks(file_path, chunk_rows):
+    for chunk in read_airnow_csv(file_path, chunksize=chunk_rows):
+        yield chunk.drop(columns=DROPPED_COLUMNS)
+
+def scan_medians(file_path, chunk_rows, method='sketch', alpha=DEFAULT_ALPHA):
+    # Pass one: per-column medians plus the row count and column dtypes the
+    # columnar writer needs. 'sketch' keeps a fixed-size mergeable sketch per
+    # column, so memory does not grow with the input. 'exact' keeps every
+    # non-null pollutant value (8 bytes each, up to 56 bytes per input
+    # row), which undoes the point of streaming on inputs larger than RAM.
+    if method == 'sketch':
+        sketches = {col: QuantileSketch(alpha) for col in POLLUTANT_COLUMNS}
+    else:
+        parts = {col: [] for col in POLLUTANT_COLUMNS}
+    rows = 0
+    dtypes = {}
+    for chunk in read_chunks(file_path, chunk_rows):
+        rows += len(chunk)
+        dtypes = merge_dtypes(dtypes, column_dtypes(chunk))
+        for col in POLLUTANT_COLUMNS:
+            values = chunk[col].to_numpy(dtype=np.float64)
+            if method == 'sketch':
+                sketches[col].add(values)
+            else:
+                parts[col].append(values[~np.isnan(values)])
+
+    if method == 'sketch':
+        medians = {col: sketches[col].median() for col in POLLUTANT_COLUMNS}
+    else:
+        medians = {}
+        for col in POLLUTANT_COLUMNS:
+            values = np.concatenate(parts[col]) if parts[col] else np.empty(0)
+            medians[col] = float(np.median(values)) if len(values) else np.nan
+    return medians, rows, dtypes
+
+def stream_preprocess(input_path, output_path, chunk_rows=DEFAULT_CHUNK_ROWS, method='sketch', cache_dir=None):
+    # Bounded-memory ETL: memory is set by chunk_rows, not by the input size
+    medians, rows, dtypes = scan_medians(input_path, chunk_rows, method)
+
+    # Pass two: fill, drop and write each chunk straight to the outputs
+    writer = None
+    with open(output_path, 'w', newline='') as output:
+        for i, chunk in enumerate(read_chunks(input_path, chunk_rows)):
+            chunk = chunk.fillna(medians)
+            chunk.to_csv(output, index=False, header=(i == 0))
+            if cache_dir is not None:
+                if writer is None:
+                    writer = ColumnarWriter(cache_dir, rows, {col: dtypes[col] for col in chunk.columns})
+                writer.write(chunk)
+    if writer is not None:
+        writer.close(source=output_path)
+    return medians
+
+def read_partition(file_path, rank, size):
+    # This rank's byte range of the raw CSV, parsed by the same typed reader
+    header, _ = read_header(file_path)
+    start, end = rank_byte_range(file_path, rank, size)
+    data = read_airnow_csv(io.BytesIO(header + read_byte_range(file_path, start, end)))
+    return data.drop(columns=DROPPED_COLUMNS)
+
+def weighted_medians(values, weights):
+    # Per column of a (ranks, targets) array: the value at which half of the weight is reached
+    order = np.argsort(np.where(weights > 0, values, np.inf), axis=0)
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=0), axis=0)
+    index = np.argmax(2 * cumulative >= cumulative[-1], axis=0)
+    return np.take_along_axis(values, order, axis=0)[index, np.arange(values.shape[1])]
+
+def select_kth(columns, ks, comm):
+    # The ks-th smallest values (0-based) over all ranks, one per target, from
+    # locally sorted columns. Every round the count-weighted median of the
+    # ranks' local medians splits each target's remaining candidates, so at
+    # least a quarter of them drop out; one allgather and one Allreduce per
+    # round serve all targets. Targets out of range come back as NaN.
+    from mpi4py import MPI
+
+    ks = np.array(ks, dtype=np.int64)
+    low = np.zeros(len(columns), dtype=np.int64)
+    high = np.array([len(column) for column in columns], dtype=np.int64)
+    totals = high.copy()
+    comm.Allreduce(MPI.IN_PLACE, totals, op=MPI.SUM)
+    found = np.full(len(columns), np.nan)
+    active = (ks >= 0) & (ks < totals)
+    while active.any():
+        counts = np.where(active, high - low, 0)
+        medians = np.array([column[start + count // 2] if count else np.nan
+                            for column, start, count in zip(columns, low, counts)])
+        gathered = comm.allgather((medians, counts))
+        pivots = weighted_medians(np.stack([medians for medians, _ in gathered]),
+                                  np.stack([counts for _, counts in gathered]))
+        local = np.zeros((2, len(columns)), dtype=np.int64)
+        for i in np.flatnonzero(active):
+            candidates = columns[i][low[i]:high[i]]
+            local[0, i] = np.searchsorted(candidates, pivots[i], 'left')
+            local[1, i] = np.searchsorted(candidates, pivots[i], 'right')
+        split = local.copy()
+        comm.Allreduce(MPI.IN_PLACE, split, op=MPI.SUM)
+        less, upto = split
+        below = active & (ks < less)
+        above = active & (ks >= upto)
+        hit = active & ~below & ~above
+        found[hit] = pivots[hit]
+        high = np.where(below, low + local[0], high)
+        low = np.where(above, low + local[1], low)
+        ks = np.where(above, ks - upto, ks)
+        active &= ~hit
+    return found
+
+def global_medians(data, method, comm, alpha=DEFAULT_ALPHA):
+    # Same medians as the serial paths, agreed on by all ranks: 'exact' by a
+    # distributed selection of the middle values, 'sketch' by merging the
+    # ranks' sketches with one Allreduce
+    from mpi4py import MPI
+
+    values = [data[col].to_numpy(dtype=np.float64) for col in POLLUTANT_COLUMNS]
+    if method == 'sketch':
+        sketches = [QuantileSketch(alpha) for _ in POLLUTANT_COLUMNS]
+        for sketch, column in zip(sketches, values):
+            sketch.add(column)
+        counts = np.stack([sketch.counts for sketch in sketches])
+        comm.Allreduce(MPI.IN_PLACE, counts, op=MPI.SUM)
+        for sketch, merged in zip(sketches, counts):
+            sketch.counts = merged
+        return {col: sketch.median() for col, sketch in zip(POLLUTANT_COLUMNS, sketches)}
+
+    columns = [np.sort(column[~np.isnan(column)]) for column in values]
+    counts = np.array([len(column) for column in columns], dtype=np.int64)
+    comm.Allreduce(MPI.IN_PLACE, counts, op=MPI.SUM)
+    # Both middle values of every column in one selection; they coincide for odd counts
+    middle = select_kth(columns + columns, np.concatenate([(counts - 1) // 2, counts // 2]), comm)
+    lower, upper = middle[:len(columns)], middle[len(columns):]
+    return {col: float((low + high) / 2) for col, low, high in zip(POLLUTANT_COLUMNS, lower, upper)}
+
+def write_ordered(path, payload, comm):
+    # Collective MPI-IO write: each rank's bytes land right after those of the
+    # ranks before it
+    from mpi4py import MPI
+
+    offset = comm.exscan(len(payload)) or 0
+    total, rounds = comm.allreduce((len(payload), -(-len(payload) // WRITE_BLOCK)),
+                                   op=lambda left, right: (left[0] + right[0], max(left[1], right[1])))
+    view = memoryview(payload)
+    output = MPI.File.Open(comm, path, MPI.MODE_WRONLY | MPI.MODE_CREATE)
+    output.Set_size(total)  # Drops the tail of an older, longer file
+    for block in range(rounds):
+        # Every rank joins every round, with an empty block once it is done
+        start = min(block * WRITE_BLOCK, len(payload))
+        output.Write_at_all(offset + start, view[start:start + WRITE_BLOCK])
+    output.Close()
+    return total
+
+def write_cache_partition(data, cache_dir, source, comm):
+    # Rank 0 preallocates the column files for all rows, every rank fills its
+    # own rows, and rank 0 writes the manifest once all of them are in place
+    rank = comm.Get_rank()
+    rows = comm.allreduce(len(data))
+    first = comm.exscan(len(data)) or 0
+    dtypes = comm.allreduce(column_dtypes(data), op=merge_dtypes)
+    writer = ColumnarWriter(cache_dir, rows, dtypes) if rank == 0 else None
+    comm.Barrier()
+    if writer is None:
+        writer = ColumnarWriter(cache_dir, rows, dtypes, position=first, create=False)
+    writer.write(data)
+    writer.flush()
+    comm.Barrier()
+    if rank == 0:
+        writer.position = rows
+        writer.close(source=source)
+
+def mpi_preprocess(input_path, output_path, method='sketch', cache_dir=None, comm=None, progress=False):
+    # Every rank parses, fills and writes its own byte range of the input;
+    # only the medians and the output offsets are agreed on collectively.
+    # With progress, every rank prints a PROGRESS line as it enters a phase.
+    from mpi4py import MPI
+
+    comm = comm or MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    report = (lambda name, rows=0: report_progress(rank, name, rows)) if progress else (lambda name, rows=0: None)
+    started = MPI.Wtime()
+    report('read')
+    data = read_partition(input_path, rank, comm.Get_size())
+    report('medians', len(data))
+    medians = global_medians(data, method, comm)
+    report('fill', len(data))
+    data = data.fillna(medians)
+    report('write', len(data))
+    size = write_ordered(output_path, data.to_csv(index=False, header=(rank == 0)).encode('utf-8'), comm)
+    if cache_dir is not None:
+        report('cache', len(data))
+        write_cache_partition(data, cache_dir, output_path, comm)
+    rows = comm.reduce(len(data), root=0)
+    if rank == 0:
+        print(f"Preprocessed {rows} rows ({size} bytes) on {comm.Get_size()} ranks in "
+              f"{MPI.Wtime() - started:.2f}s")
+    return medians
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Preprocess the combined AirNow export for the simulations.')
+    parser.add_argument('--input', default='data/raw/combined_file_final.csv')
+    parser.add_argument('--output', default='data/processed/preprocessed_for_cpp.csv')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache for the heatmap readers')
+    parser.add_argument('--cube-dir', default=DEFAULT_CUBE_DIR, help='rollup cube for daily/monthly/yearly heatmaps')
+    parser.add_argument('--stream', action='store_true', help='two-pass chunked mode for inputs larger than RAM')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help='rows held in memory at once in --stream mode')
+    parser.add_argument('--median', choices=['exact', 'sketch'], default='sketch',
+                        help="median fill in --stream/--mpi mode: 'sketch' uses fixed memory (about 1%% relative "
+                             "error); 'exact' holds every pollutant value in memory")
+    parser.add_argument('--mpi', action='store_true',
+                        help='run under mpiexec: every rank preprocesses and writes its own byte range of the input')
+    parser.add_argument('--progress', action='store_true', help='print PROGRESS lines per rank and phase (--mpi)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+
+    if args.mpi:
+        if args.stream:
+            raise SystemExit('--mpi and --stream are separate modes')
+        from mpi4py import MPI
+
+        rank = MPI.COMM_WORLD.Get_rank()
+        mpi_preprocess(args.input, args.output, args.median, args.cache_dir, progress=args.progress)
+        # The cube is built from the finished cache by one rank
+        if rank != 0:
+            if args.progress:
+                report_progress(rank, 'done')
+            return
+        if args.progress:
+            report_progress(rank, 'rollup')
+    elif args.stream:
+        stream_preprocess(args.input, args.output, args.chunk_rows, args.median, args.cache_dir)
+    else:
+        processed_data = load_and_preprocess_data(args.input)
+
+        # Save the preprocessed data to a file that will be read by the C++ simulation
+        processed_data.to_csv(args.output, index=False)
+
+        # Columnar copy for the heatmap readers, which memory-map only the columns they need
+        write_cache(processed_data, args.cache_dir, source=args.output)
+
+    # Pre-aggregated cube, built from the cache in bounded memory
+    build_from_cache(args.cache_dir, args.cube_dir)
     
     print("Data preprocessing complete. Ready for C++ simulation.")
+    if args.mpi and args.progress:
+        report_progress(0, 'done')
 
 if __name__ == "__main__":
     main()
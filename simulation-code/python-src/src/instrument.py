@@ -0,0 +1,161 @@
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+# Per-rank phase instrumentation. Each rank records wall time, rows, bytes
+# read/sent/received and its peak RSS for every phase it runs; the records
+# stay local until one gather at the end. Rank 0 writes a JSON summary and a
+# Chrome trace (chrome://tracing or ui.perfetto.dev, one track per rank) and
+# flags phases whose slowest rank is well behind the mean. Without MPI the
+# scan runs in local worker processes; they record their own phases against
+# the parent's clock and send them back with their results, and each pool
+# worker process gets a track of its own.
+
+SKEW_RATIO = 1.5
+SKEW_MIN_SECONDS = 0.05  # Ignore imbalance in phases too short to matter
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def report_progress(rank, phase, rows=0):
+    # Machine-readable progress for job managers and benchmark.py reading our
+    # stdout. One write per line so mpiexec does not interleave ranks mid-line
+    sys.stdout.write(f'PROGRESS rank={rank} phase={phase} rows={rows}\n')
+    sys.stdout.flush()
+
+
+class Profiler:
+    def __init__(self, comm, origin=None):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        if origin is None:
+            # A common starting line so the ranks' tracks line up in the trace
+            comm.Barrier()
+            origin = time.perf_counter()
+        # A worker process passes its parent's origin; perf_counter is a
+        # system-wide monotonic clock, so the timestamps stay comparable
+        self.origin = origin
+        self.records = []
+        self.current = None
+
+    @contextmanager
+    def phase(self, name):
+        record = {'phase': name, 'rank': self.rank, 'start': time.perf_counter() - self.origin, 'rows': 0,
+                  'bytes_read': 0, 'bytes_sent': 0, 'bytes_received': 0}
+        outer, self.current = self.current, record
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - self.origin - record['start']
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.records.append(record)
+            self.current = outer
+
+    def count(self, rows=0, read=0, sent=0, received=0):
+        if self.current is not None:
+            self.current['rows'] += int(rows)
+            self.current['bytes_read'] += int(read)
+            self.current['bytes_sent'] += int(sent)
+            self.current['bytes_received'] += int(received)
+
+    def worker_records(self):
+        return [dict(record, worker=os.getpid()) for record in self.records]
+
+    def merge_workers(self, records):
+        # Records from worker_records() of local worker processes; each
+        # process becomes a track after this process's own. Parts that ran in
+        # this process (the serial executor) stay on its track.
+        tracks = {}
+        for record in records:
+            if record['worker'] == os.getpid():
+                self.records.append({key: value for key, value in record.items() if key != 'worker'})
+                continue
+            track = tracks.setdefault(record['worker'], self.rank + 1 + len(tracks))
+            self.records.append(dict(record, rank=track))
+
+    def gather(self):
+        records = self.comm.gather(self.records, root=0)
+        return [record for rank_records in records for record in rank_records] if records is not None else None
+
+
+def phase(profile, name):
+    # Lets instrumented code run unchanged when profiling is off
+    return profile.phase(name) if profile is not None else nullcontext()
+
+
+def count(profile, **amounts):
+    if profile is not None:
+        profile.count(**amounts)
+
+
+def summarize(records, size):
+    phases = {}
+    for record in records:
+        phases.setdefault(record['phase'], []).append(record)
+
+    summary = {'ranks': size, 'wall': max(record['start'] + record['seconds'] for record in records),
+               'phases': {}, 'flags': []}
+    for name, entries in phases.items():
+        per_rank = {}
+        for entry in entries:
+            per_rank[entry['rank']] = per_rank.get(entry['rank'], 0.0) + entry['seconds']
+        seconds = list(per_rank.values())
+        mean = sum(seconds) / len(seconds)
+        slowest = max(per_rank, key=per_rank.get)
+        ratio = per_rank[slowest] / mean if mean > 0 else 1.0
+        stats = {
+            'ranks': len(per_rank), 'max': per_rank[slowest], 'mean': mean, 'min': min(seconds),
+            'max_mean_ratio': ratio, 'slowest_rank': slowest,
+            'rows': sum(entry['rows'] for entry in entries),
+            'bytes_read': sum(entry['bytes_read'] for entry in entries),
+            'bytes_sent': sum(entry['bytes_sent'] for entry in entries),
+            'bytes_received': sum(entry['bytes_received'] for entry in entries),
+            'peak_rss_mb': max(entry['peak_rss_mb'] for entry in entries),
+        }
+        # Root-only phases cannot be imbalanced
+        stats['skewed'] = len(per_rank) > 1 and ratio > SKEW_RATIO and per_rank[slowest] > SKEW_MIN_SECONDS
+        if stats['skewed']:
+            summary['flags'].append(f"phase {name}: slowest rank {slowest} took {per_rank[slowest]:.3f}s, "
+                                    f"{ratio:.2f}x the mean of {mean:.3f}s")
+        summary['phases'][name] = stats
+    summary['records'] = records
+    return summary
+
+
+def chrome_trace(records):
+    # Complete ('X') events in microseconds; one thread track per rank
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': 'heatmap_engine'}}]
+    tracks = {}
+    for record in records:
+        tracks.setdefault(record['rank'], f"worker {record['worker']}" if 'worker' in record else f"rank {record['rank']}")
+    for rank in sorted(tracks):
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': rank, 'args': {'name': tracks[rank]}})
+    for record in records:
+        events.append({'name': record['phase'], 'ph': 'X', 'pid': 0, 'tid': record['rank'],
+                       'ts': record['start'] * 1e6, 'dur': record['seconds'] * 1e6,
+                       'args': {key: record[key] for key in ('rows', 'bytes_read', 'bytes_sent', 'bytes_received',
+                                                             'peak_rss_mb')}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_profile(profile, output_dir):
+    # Collective: every rank must call it
+    records = profile.gather()
+    if records is None:
+        return None
+    summary = summarize(records, profile.comm.Get_size())
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'profile.json'), 'w') as file:
+        json.dump(summary, file, indent=2)
+    with open(os.path.join(output_dir, 'trace.json'), 'w') as file:
+        json.dump(chrome_trace(records), file)
+    for flag in summary['flags']:
+        print(f"Load imbalance: {flag}")
+    return summary
@@ -0,0 +1,187 @@
+import itertools
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from heatmap_service import is_running, request_render
+
+# Runs heatmap jobs off the UI thread. Jobs wait in a queue until the core
+# budget has room for their ranks, stream per-rank progress from the engine's
+# PROGRESS lines, and can be cancelled. The engine picks its own executor from
+# the input size (small inputs run in one process, without mpiexec); each job
+# runs in its own process group so cancelling takes every worker or rank down
+# with it. Observers receive events
+# through a thread-safe queue that the UI drains on its own schedule.
+
+ENGINE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'heatmap_engine.py')
+KILL_GRACE_SECONDS = 3
+
+
+class HeatmapJob:
+    def __init__(self, job_id, pollutant, ranks, extra_args):
+        self.id = job_id
+        self.pollutant = pollutant
+        self.ranks = ranks
+        self.extra_args = list(extra_args)
+        self.status = 'queued'
+        self.progress = {}  # rank -> (phase, rows); replaced, never changed in place, so the UI can read it
+        self.figures = []
+        self.error = None
+        self.process = None
+        self.cancelled = False
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        progress = self.progress
+        if not progress:
+            return ''
+        rows = sum(rows for _, rows in progress.values())
+        phases = sorted({phase for phase, _ in progress.values()})
+        return f"{'/'.join(phases)} ({rows:,} rows)"
+
+
+class JobManager:
+    def __init__(self, core_budget=None, use_service=True):
+        self.core_budget = core_budget or os.cpu_count() or 1
+        self.use_service = use_service
+        self.jobs = {}
+        self.pending = []
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def submit(self, pollutant, ranks=4, extra_args=()):
+        ranks = max(1, min(ranks, self.core_budget))
+        job = HeatmapJob(next(self.ids), pollutant, ranks, extra_args)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.pending.append(job)
+        self._emit(job)
+        self._schedule()
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in ('done', 'failed', 'cancelled'):
+                return False
+            job.cancelled = True
+            process = job.process
+            if job in self.pending:
+                self.pending.remove(job)
+                job.status = 'cancelled'
+            elif process is None:
+                # A service request cannot be stopped; its reply is dropped when it comes
+                job.status = 'cancelled'
+        if process is not None:
+            self._kill_group(process)
+        self._emit(job)
+        return True
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def set_core_budget(self, cores):
+        self.core_budget = max(1, cores)
+        self._schedule()
+
+    def _cores_in_use(self):
+        return sum(job.ranks for job in self.jobs.values() if job.status == 'running')
+
+    def _schedule(self):
+        # Start queued jobs in order while their ranks fit in the budget
+        with self.lock:
+            while self.pending and self._cores_in_use() + self.pending[0].ranks <= self.core_budget:
+                job = self.pending.pop(0)
+                job.status = 'running'
+                job.started = time.time()
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        try:
+            if self.use_service and not job.extra_args and is_running():
+                self._run_service(job)
+            else:
+                self._run_engine(job)
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        job.finished = time.time()
+        if job.cancelled:
+            job.status = 'cancelled'
+        self._emit(job)
+        self._schedule()
+
+    def _run_service(self, job):
+        job.progress = {0: ('service', 0)}
+        self._emit(job)
+        reply = request_render([job.pollutant])
+        with self.lock:
+            if job.cancelled:
+                return
+            if not reply.get('ok'):
+                raise RuntimeError(reply.get('error'))
+            job.figures = reply['figures']
+            job.status = 'done'
+
+    def _run_engine(self, job):
+        command = [sys.executable, ENGINE_SCRIPT, '--pollutants', job.pollutant, '--no-show', '--progress',
+                   '--workers', str(job.ranks)] + job.extra_args
+        with self.lock:
+            if job.cancelled:
+                return
+            # A new session makes the engine (or the mpiexec it relaunches as) lead its own process group
+            job.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                           start_new_session=True)
+        output = []
+        for line in job.process.stdout:
+            line = line.strip()
+            if line.startswith('PROGRESS '):
+                fields = dict(part.split('=', 1) for part in line.split()[1:])
+                rank = int(fields['rank'])
+                # Later phases report rows=0; keep the count already read
+                rows = max(int(fields['rows']), job.progress.get(rank, ('', 0))[1])
+                job.progress = {**job.progress, rank: (fields['phase'], rows)}
+                self._emit(job)
+            elif line.startswith('FIGURE '):
+                job.figures.append(os.path.abspath(line[len('FIGURE '):]))
+            else:
+                output.append(line)
+        returncode = job.process.wait()
+        if job.cancelled:
+            return
+        if returncode != 0:
+            raise RuntimeError('\n'.join(output[-10:]) or f'heatmap engine exited with status {returncode}')
+        job.status = 'done'
+
+    def _kill_group(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout=KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _emit(self, job):
+        self.events.put(job)
+
+    def drain(self):
+        # Jobs that changed since the last call, newest state only
+        changed = {}
+        while True:
+            try:
+                job = self.events.get_nowait()
+            except queue.Empty:
+                return list(changed.values())
+            changed[job.id] = job
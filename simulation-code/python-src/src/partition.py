@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+# Byte-range partitioning of a CSV file. Each rank seeks straight to its own
+# share of the file, so nobody has to count lines up front and adding ranks
+# divides the I/O instead of multiplying it. A line belongs to the range that
+# contains its first byte. exchange() repartitions rows that were read this
+# way by an owner rank of their own choosing.
+
+
+def read_header(filepath):
+    with open(filepath, 'rb') as file:
+        header = file.readline()
+    return header, len(header)
+
+
+def byte_ranges(filepath, parts):
+    _, data_start = read_header(filepath)
+    file_size = os.path.getsize(filepath)
+    span = file_size - data_start
+    bounds = [data_start + span * i // parts for i in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def rank_byte_range(filepath, rank, size):
+    return byte_ranges(filepath, size)[rank]
+
+
+def exchange(records, owners, comm):
+    # Every row of the float64 records goes to rank owners[row]; one Alltoallv.
+    # Rows arrive grouped by sending rank, each group in its original order.
+    from mpi4py import MPI
+
+    size = comm.Get_size()
+    order = np.argsort(owners, kind='stable')
+    records = np.ascontiguousarray(records[order])
+    width = records.shape[1]
+    send_counts = np.bincount(owners, minlength=size).astype(np.int64)
+    recv_counts = np.empty(size, dtype=np.int64)
+    comm.Alltoall(send_counts, recv_counts)
+    received = np.empty((int(recv_counts.sum()), width), dtype=np.float64)
+    comm.Alltoallv([records, send_counts * width, MPI.DOUBLE], [received, recv_counts * width, MPI.DOUBLE])
+    return received
+
+
+def line_start(file, offset):
+    # Offset of the first line starting at or after `offset`
+    if offset <= 0:
+        return 0
+    file.seek(offset - 1)
+    file.readline()
+    return file.tell()
+
+
+def read_byte_range(filepath, start, end):
+    # The same lines as iter_lines, as one block of bytes read in one call
+    if start >= end:
+        return b''
+    with open(filepath, 'rb') as file:
+        first = line_start(file, start)
+        last = line_start(file, end)
+        file.seek(first)
+        return file.read(max(last - first, 0))
+
+
+def iter_lines(filepath, start, end):
+    # Yields the raw lines (bytes) whose first byte lies in [start, end)
+    if start >= end:
+        return
+    with open(filepath, 'rb') as file:
+        if start > 0:
+            # Align to the first line starting at or after `start`
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            yield line
+            position += len(line)
@@ -0,0 +1,362 @@
+import argparse
+import ast
+import hashlib
+import io
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from columnar_cache import DEFAULT_CACHE_DIR, append_cache, write_cache
+from combine import combine, list_csv_files, sniff
+from init import DEFAULT_CHUNK_ROWS, stream_preprocess
+from partition import read_header
+from pollutant_stats import DEFAULT_STATS_DIR
+from rollup import DEFAULT_CUBE_DIR, build_from_cache, merge_into
+from schema import DROPPED_COLUMNS, RAW_SCHEMA, read_airnow_csv
+from sqlite_loader import DEFAULT_DB, load_csv
+
+# Incremental runner for combine -> ETL -> SQLite / statistics / heatmaps.
+# Every stage is fingerprinted by its code, its parameters and its inputs,
+# and the fingerprints of the last run are kept in a state file. A stage
+# whose fingerprint is unchanged is skipped. When the only change upstream is
+# new data (new exports in the data folder, rows appended to the combined or
+# processed file), combine, ETL and the SQLite load process just the new part
+# and append it to their outputs; everything else is rerun in full.
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STATE = 'data/pipeline_state.json'
+TAIL_BYTES = 64 * 1024
+HASH_BLOCK = 1 << 20
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tail_digest(path, size):
+    with open(path, 'rb') as file:
+        file.seek(max(size - TAIL_BYTES, 0))
+        return hashlib.sha256(file.read(size - file.tell())).hexdigest()
+
+
+def file_mark(path):
+    # Large derived files are identified by size, mtime and a digest of their
+    # last bytes, so checking them does not cost a full read
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'tail': tail_digest(path, stat.st_size)}
+
+
+def appended_from(path, mark):
+    # Offset of the new bytes if the file only grew since mark was taken
+    if mark is None or not os.path.exists(path):
+        return None
+    if os.path.getsize(path) < mark['size'] or tail_digest(path, mark['size']) != mark['tail']:
+        return None
+    return mark['size']
+
+
+def text_digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def local_imports(module):
+    # Modules of this directory that module imports, at the top or inside functions
+    with open(os.path.join(SRC_DIR, module), 'rb') as file:
+        tree = ast.parse(file.read(), module)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split('.')[0])
+    return {name + '.py' for name in names if os.path.exists(os.path.join(SRC_DIR, name + '.py'))}
+
+
+def code_modules(entries):
+    # The entry modules and everything they import from here, transitively
+    found = set()
+    pending = list(entries)
+    while pending:
+        module = pending.pop()
+        if module not in found:
+            found.add(module)
+            pending.extend(local_imports(module))
+    return sorted(found)
+
+
+def code_digest(entries):
+    return text_digest({module: file_digest(os.path.join(SRC_DIR, module)) for module in code_modules(entries)})
+
+
+def export_digests(config, state):
+    # Raw exports are small; they are content-hashed, reusing the previous
+    # hash while size and mtime are unchanged
+    known = state.setdefault('digests', {})
+    digests = {}
+    for path in list_csv_files(config.folder, exclude=[config.combined]):
+        stat = os.stat(path)
+        entry = known.get(path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            entry = known[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': file_digest(path)}
+        digests[path] = entry['sha256']
+    return digests
+
+
+def mpi_command(config, script, arguments):
+    launcher = shlex.split(config.mpiexec) + ['-np', str(config.ranks)] if config.ranks > 1 else []
+    return launcher + [sys.executable, os.path.join(SRC_DIR, script)] + arguments
+
+
+def run_combine(config, previous, inputs):
+    files = list_csv_files(config.folder, exclude=[config.combined])
+    if not files:
+        raise SystemExit(f"combine: no .csv exports in {config.folder} (set --folder)")
+    if previous is not None:
+        old = previous['inputs']
+        unchanged = all(inputs.get(path) == digest for path, digest in old.items())
+        new_files = [path for path in files if path not in old]
+        columns = sniff(config.combined)[2]
+        if unchanged and all(column in columns for path in new_files for column in sniff(path)[2]):
+            written = combine(config.folder, config.combined, config.workers, new_files, columns)
+            return {'mode': 'delta', 'files': len(written)}
+    written = combine(config.folder, config.combined, config.workers, files)
+    return {'mode': 'full', 'files': len(written)}
+
+
+def read_new_rows(config, start):
+    # Raw rows past `start`, typed like a normal read of the combined file
+    header, _ = read_header(config.combined)
+    names = sniff(config.combined)[2]
+    schema = {name: dtype for name, dtype in RAW_SCHEMA.items() if name in names}
+    with open(config.combined, 'rb') as file:
+        file.seek(max(start, len(header)))
+        data = read_airnow_csv(file, schema=schema, header=None, names=names)
+    return data.drop(columns=DROPPED_COLUMNS)
+
+
+def run_etl(config, previous, inputs):
+    start = appended_from(config.combined, previous['inputs']['combined']) if previous is not None else None
+    if start is not None:
+        # Appended rows are filled with the medians of the last full run
+        data = read_new_rows(config, start).fillna(previous['medians'])
+        if len(data) == 0:
+            return {'mode': 'delta', 'rows': 0, 'medians': previous['medians']}
+        with open(config.processed, 'a', newline='') as output:
+            data.to_csv(output, index=False, header=False)
+        if append_cache(data, config.cache_dir, source=config.processed) is not None:
+            with tempfile.TemporaryDirectory() as work:
+                delta_cache, delta_cube = os.path.join(work, 'columnar'), os.path.join(work, 'rollup')
+                write_cache(data, delta_cache, source=config.processed)
+                build_from_cache(delta_cache, delta_cube)
+                merge_into(config.cube_dir, delta_cube)
+            return {'mode': 'delta', 'rows': len(data), 'medians': previous['medians']}
+        # The new rows do not fit the cached dtypes; rebuild the binary outputs
+        shutil.rmtree(config.cache_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(config.processed) or '.', exist_ok=True)
+    medians = stream_preprocess(config.combined, config.processed, config.chunk_rows, config.median,
+                                config.cache_dir)
+    build_from_cache(config.cache_dir, config.cube_dir)
+    return {'mode': 'full', 'medians': medians}
+
+
+def run_sqlite(config, previous, inputs):
+    start = appended_from(config.processed, previous['inputs']['processed']) if previous is not None else None
+    if start is not None:
+        header, _ = read_header(config.processed)
+        with open(config.processed, 'rb') as file:
+            file.seek(max(start, len(header)))
+            delta = io.BytesIO(header + file.read())
+        return {'mode': 'delta', 'rows': load_csv(delta, config.db, reindex=False)}
+    os.makedirs(os.path.dirname(config.db) or '.', exist_ok=True)
+    return {'mode': 'full', 'rows': load_csv(config.processed, config.db, replace=True)}
+
+
+def run_stats(config, previous, inputs):
+    subprocess.run(mpi_command(config, 'pollutant_stats.py', ['--input', config.processed, '--cache-dir',
+                                                               config.cache_dir, '--output-dir', config.stats_dir]),
+                   check=True)
+    return {'mode': 'full'}
+
+
+def run_figures(config, previous, inputs):
+    # The engine picks its executor itself; --ranks only caps its workers
+    command = [sys.executable, os.path.join(SRC_DIR, 'heatmap_engine.py'), '--input', config.processed,
+               '--cache-dir', config.cache_dir, '--cube-dir', config.cube_dir, '--output-dir', config.figure_dir,
+               '--no-show', '--workers', str(config.ranks), '--grain'] + config.grains
+    subprocess.run(command, check=True, env=dict(os.environ, MPIEXEC=config.mpiexec))
+    return {'mode': 'full'}
+
+
+# In dependency order. 'inputs' fingerprints what the stage reads, 'outputs'
+# what it writes (an output changed by hand forces a full rerun) and 'params'
+# the settings that change its results. 'code' names the stage's entry
+# modules; they are fingerprinted with all their local imports. 'requires' lists the paths the stage
+# reads, with the option that sets each, and 'dirs' the directories it writes.
+STAGES = {
+    'combine': {
+        'after': [],
+        'code': ['combine.py'],
+        'params': lambda config: {'folder': config.folder, 'combined': config.combined},
+        'inputs': export_digests,
+        'outputs': lambda config: [config.combined],
+        'requires': lambda config: [(config.folder, '--folder')],
+        'dirs': lambda config: [os.path.dirname(config.combined)],
+        'run': run_combine,
+    },
+    'etl': {
+        'after': ['combine'],
+        'code': ['init.py'],
+        'params': lambda config: {'processed': config.processed, 'cache_dir': config.cache_dir,
+                                  'cube_dir': config.cube_dir, 'median': config.median},
+        'inputs': lambda config, state: {'combined': file_mark(config.combined)},
+        'outputs': lambda config: [config.processed, os.path.join(config.cache_dir, 'manifest.json'),
+                                   os.path.join(config.cube_dir, 'manifest.json')],
+        'requires': lambda config: [(config.combined, '--combined')],
+        'dirs': lambda config: [os.path.dirname(config.processed), config.cache_dir, config.cube_dir],
+        'run': run_etl,
+    },
+    'sqlite': {
+        'after': ['etl'],
+        'code': ['sqlite_loader.py'],
+        'params': lambda config: {'db': config.db},
+        'inputs': lambda config, state: {'processed': file_mark(config.processed)},
+        'outputs': lambda config: [config.db],
+        'requires': lambda config: [(config.processed, '--processed')],
+        'dirs': lambda config: [os.path.dirname(config.db)],
+        'run': run_sqlite,
+    },
+    'stats': {
+        'after': ['etl'],
+        'code': ['pollutant_stats.py'],
+        'params': lambda config: {'stats_dir': config.stats_dir},
+        'inputs': lambda config, state: {'processed': file_mark(config.processed),
+                                  'cache': file_mark(os.path.join(config.cache_dir, 'manifest.json'))},
+        'outputs': lambda config: [],
+        'requires': lambda config: [(config.processed, '--processed')],
+        'dirs': lambda config: [config.stats_dir],
+        'run': run_stats,
+    },
+    'figures': {
+        'after': ['etl'],
+        'code': ['heatmap_engine.py'],
+        'params': lambda config: {'figure_dir': config.figure_dir, 'grains': config.grains},
+        'inputs': lambda config, state: {'processed': file_mark(config.processed),
+                                  'cube': file_mark(os.path.join(config.cube_dir, 'manifest.json'))},
+        'outputs': lambda config: [],
+        'requires': lambda config: [(config.processed, '--processed')],
+        'dirs': lambda config: [config.figure_dir],
+        'run': run_figures,
+    },
+}
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {'stages': {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_state(state, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def prepare_paths(config, selected=None, dry_run=False):
+    # A stage's inputs must exist unless a stage before it in this run writes
+    # them; output directories are created up front
+    for name, stage in STAGES.items():
+        if selected and name not in selected:
+            continue
+        if not stage['after'] or (selected and not set(stage['after']) & set(selected)):
+            for path, option in stage['requires'](config):
+                if not os.path.exists(path):
+                    raise SystemExit(f"{name}: {path} not found (set {option})")
+        if not dry_run:
+            for directory in stage['dirs'](config):
+                os.makedirs(directory or '.', exist_ok=True)
+
+
+def run_pipeline(config, selected=None, full=False, dry_run=False):
+    prepare_paths(config, selected, dry_run)
+    state = load_state(config.state)
+    ran = set()
+    for name, stage in STAGES.items():
+        if selected and name not in selected:
+            continue
+        key = text_digest({'code': code_digest(stage['code']), 'params': stage['params'](config)})
+        inputs = stage['inputs'](config, state)
+        record = state['stages'].get(name)
+        # The last run still counts if code, parameters and outputs are as it left them
+        previous = None
+        if not full and record is not None and record['key'] == key:
+            if all(file_mark(path) == record['outputs'].get(path) for path in stage['outputs'](config)):
+                previous = record
+        if previous is not None and previous['inputs'] == inputs and not ran.intersection(stage['after']):
+            print(f"{name}: up to date")
+            continue
+        if dry_run:
+            # Whatever depends on a stale stage will rerun too
+            ran.add(name)
+            print(f"{name}: {'stale' if previous is not None else 'no usable previous run'}")
+            continue
+
+        print(f"{name}: running", flush=True)
+        started = time.perf_counter()
+        result = stage['run'](config, previous, inputs)
+        seconds = time.perf_counter() - started
+        ran.add(name)
+        state['stages'][name] = dict(result, key=key, inputs=stage['inputs'](config, state),
+                                     outputs={path: file_mark(path) for path in stage['outputs'](config)},
+                                     seconds=seconds, finished=time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+        save_state(state, config.state)
+        print(f"{name}: {result['mode']} run in {seconds:.2f}s")
+    return state
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the stale stages of the combine -> ETL -> analytics pipeline.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None,
+                        help='only these stages (default: all)')
+    parser.add_argument('--full', action='store_true', help='rerun the selected stages from scratch')
+    parser.add_argument('--dry-run', action='store_true', help='only report which stages are stale')
+    parser.add_argument('--state', default=DEFAULT_STATE, help='fingerprints of the last run')
+    parser.add_argument('--folder', default='data1', help='folder holding the per-site exports')
+    parser.add_argument('--combined', default='data/raw/combined_file_final.csv')
+    parser.add_argument('--processed', default='data/processed/preprocessed_for_cpp.csv')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--cube-dir', default=DEFAULT_CUBE_DIR)
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--stats-dir', default=DEFAULT_STATS_DIR)
+    parser.add_argument('--figure-dir', default='data/output')
+    parser.add_argument('--grains', nargs='+', choices=['day', 'month', 'year'], default=['day'])
+    parser.add_argument('--median', choices=['exact', 'sketch'], default='sketch',
+                        help="'exact' holds every pollutant value in memory during preprocessing")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=None, help='combine reader processes (default: CPU count)')
+    parser.add_argument('--ranks', type=int, default=1,
+                        help='MPI ranks for the statistics stage, workers for the heatmap stage')
+    parser.add_argument('--mpiexec', default='mpiexec', help="launcher, e.g. 'mpiexec --oversubscribe'")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run_pipeline(args, args.stages, args.full, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+from mpi4py import MPI
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR
+from heatmap_engine import DATE_COLUMN, DEFAULT_INPUT, POLLUTANTS, read_cache_slice, read_data_slice, use_cache
+from partition import rank_byte_range
+from sketch import DEFAULT_ALPHA, QuantileSketch
+
+# Summary statistics for every pollutant from one distributed scan, replacing
+# the seven *_simulation.cpp passes and their appended "Global Average" lines.
+# Each rank reads its slice once and keeps fixed-size sufficient statistics
+# per pollutant (count, sum, min, max, threshold exceedances and a quantile
+# sketch); these are merged with buffer Allreduces, followed by one more
+# Allreduce of squared deviations from the global mean for the variance.
+# Rank 0 writes a timestamped JSON and CSV per run.
+
+# Alert thresholds of the C++ simulations (alert_high_*_concentration);
+# ozone has no alert there
+THRESHOLDS = {'PM10': 30.0, 'PM2.5': 10.0, 'Ozone': None, 'NO2': 30.0, 'CO': 0.9, 'Pb': 0.5, 'SO2': 3.0}
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+DEFAULT_STATS_DIR = 'data/output/analysis'
+CSV_FIELDS = ['pollutant', 'column', 'count', 'missing', 'mean', 'variance', 'std', 'min', 'max'] + \
+             [f'p{round(q * 100)}' for q in QUANTILES] + ['threshold', 'exceedances', 'exceedance_rate', 'alert']
+
+
+def read_readings(filepath, pollutants, source, cache_dir, rank, size):
+    # One column per pollutant from a single read of this rank's slice
+    if use_cache(source, filepath, cache_dir):
+        names = [POLLUTANTS[name]['name'] for name in pollutants]
+        _, readings = read_cache_slice(cache_dir, rank, size, names)
+    else:
+        start, end = rank_byte_range(filepath, rank, size)
+        columns = [POLLUTANTS[name]['column'] for name in pollutants]
+        _, readings = read_data_slice(filepath, start, end, DATE_COLUMN, columns)
+    return np.asarray(readings, dtype=np.float64)
+
+
+def local_stats(readings, thresholds, alpha=DEFAULT_ALPHA):
+    # Per column: rows, valid count, sum, min, max, exceedances and sketch counts
+    valid = ~np.isnan(readings)
+    counts = valid.sum(axis=0).astype(np.float64)
+    sums = np.where(valid, readings, 0.0).sum(axis=0)
+    mins = np.where(valid, readings, np.inf).min(axis=0, initial=np.inf)
+    maxs = np.where(valid, readings, -np.inf).max(axis=0, initial=-np.inf)
+    limits = np.array([np.inf if threshold is None else threshold for threshold in thresholds])
+    with np.errstate(invalid='ignore'):
+        exceedances = (readings > limits).sum(axis=0).astype(np.float64)
+    sketches = [QuantileSketch(alpha) for _ in thresholds]
+    for i, sketch in enumerate(sketches):
+        sketch.add(readings[:, i])
+    totals = np.concatenate([[len(readings)], counts, sums, exceedances])
+    return totals, mins, maxs, sketches
+
+
+def merge_stats(readings, thresholds, comm, alpha=DEFAULT_ALPHA):
+    # Collective: every rank must call it, even with no rows
+    columns = len(thresholds)
+    totals, mins, maxs, sketches = local_stats(readings, thresholds, alpha)
+    comm.Allreduce(MPI.IN_PLACE, totals, op=MPI.SUM)
+    comm.Allreduce(MPI.IN_PLACE, mins, op=MPI.MIN)
+    comm.Allreduce(MPI.IN_PLACE, maxs, op=MPI.MAX)
+    sketch_counts = np.stack([sketch.counts for sketch in sketches])
+    comm.Allreduce(MPI.IN_PLACE, sketch_counts, op=MPI.SUM)
+    for sketch, merged in zip(sketches, sketch_counts):
+        sketch.counts = merged
+
+    rows = int(totals[0])
+    counts, sums, exceedances = totals[1:].reshape(3, columns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    # Deviations from the global mean avoid the cancellation of sum-of-squares
+    squares = np.nansum((readings - means) ** 2, axis=0) if len(readings) else np.zeros(columns)
+    comm.Allreduce(MPI.IN_PLACE, squares, op=MPI.SUM)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variances = squares / counts
+    return rows, counts, means, variances, mins, maxs, exceedances, sketches
+
+
+def build_results(pollutants, thresholds, rows, counts, means, variances, mins, maxs, exceedances, sketches):
+    results = []
+    for i, pollutant in enumerate(pollutants):
+        observed = counts[i] > 0
+        value = (lambda number: float(number) if observed else None)
+        result = {'pollutant': pollutant, 'column': POLLUTANTS[pollutant]['name'], 'count': int(counts[i]),
+                  'missing': rows - int(counts[i]), 'mean': value(means[i]), 'variance': value(variances[i]),
+                  'std': value(np.sqrt(variances[i])), 'min': value(mins[i]), 'max': value(maxs[i])}
+        for q in QUANTILES:
+            result[f'p{round(q * 100)}'] = value(sketches[i].quantile(q))
+        threshold = thresholds[i]
+        result['threshold'] = threshold
+        result['exceedances'] = int(exceedances[i]) if threshold is not None else None
+        result['exceedance_rate'] = (float(exceedances[i] / counts[i])
+                                     if threshold is not None and observed else None)
+        # Same rule as alert_high_*_concentration: the global mean is over the threshold
+        result['alert'] = bool(threshold is not None and observed and means[i] > threshold)
+        results.append(result)
+    return results
+
+
+def write_results(results, run_info, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.join(output_dir, f"pollutant_stats_{run_info['run_id']}")
+    with open(stem + '.json', 'w') as file:
+        json.dump(dict(run_info, pollutants=results), file, indent=2)
+    with open(stem + '.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    return stem + '.json', stem + '.csv'
+
+
+def run(filepath, pollutants, output_dir=DEFAULT_STATS_DIR, source='auto', cache_dir=DEFAULT_CACHE_DIR,
+        alpha=DEFAULT_ALPHA, comm=MPI.COMM_WORLD):
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    thresholds = [THRESHOLDS[name] for name in pollutants]
+    started = MPI.Wtime()
+
+    readings = read_readings(filepath, pollutants, source, cache_dir, rank, size)
+    stats = merge_stats(readings, thresholds, comm, alpha)
+    if rank != 0:
+        return None
+
+    results = build_results(pollutants, thresholds, *stats)
+    run_info = {'run_id': time.strftime('%Y%m%dT%H%M%S'), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'input': os.path.abspath(filepath),
+                'source': 'cache' if use_cache(source, filepath, cache_dir) else 'csv',
+                'ranks': size, 'rows': stats[0], 'quantile_alpha': alpha, 'seconds': MPI.Wtime() - started}
+    paths = write_results(results, run_info, output_dir)
+    for result in results:
+        print(f"Global Average {result['pollutant']} Concentration: {result['mean']}")
+        if result['alert']:
+            print(f"Alert: High {result['pollutant']} concentration detected: {result['mean']}")
+    print(f"Statistics for {stats[0]} rows written to {paths[0]} and {paths[1]}")
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Summary statistics for every pollutant from one scan of the data.')
+    parser.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS),
+                        help='pollutants to summarize (default: all)')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='processed CSV to read')
+    parser.add_argument('--source', choices=['auto', 'csv', 'cache'], default='auto',
+                        help='read the CSV or the columnar cache; auto (default) prefers a fresh cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache written by init.py')
+    parser.add_argument('--output-dir', default=DEFAULT_STATS_DIR, help='directory for the JSON and CSV results')
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA,
+                        help='relative error of the percentile sketch (default: %(default)s)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    run(args.input, args.pollutants, args.output_dir, args.source, args.cache_dir, args.alpha)
+
+
+if __name__ == "__main__":
+    main()
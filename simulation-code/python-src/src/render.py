@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+
+# Figure rendering for the heatmap engine and service. Figures are drawn on a
+# bare Agg canvas (no pyplot state, no GUI), the 1xN matrix is a single image
+# artist, and only a readable number of tick labels is placed. Batches are
+# spread over worker processes.
+
+MAX_TICKS = 24
+FIGSIZE = (20, 8)
+
+
+def is_headless():
+    if os.environ.get('MPLBACKEND', '').lower() == 'agg':
+        return True
+    if sys.platform in ('win32', 'darwin'):
+        return False
+    return not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+def use_agg():
+    # Must run before pyplot is imported anywhere in the process
+    matplotlib.use('Agg')
+
+
+if is_headless():
+    use_agg()
+
+
+def tick_positions(count, max_ticks=MAX_TICKS):
+    if count == 0:
+        return np.empty(0, dtype=np.int64)
+    step = -(-count // max_ticks)
+    return np.arange(0, count, step)
+
+
+def draw_heatmap(fig, spec):
+    # spec: values, tick_labels (one per column), title, xlabel, ylabel, colorbar;
+    # 2-D values with row_labels stack extra layers, each with its own scale
+    values = np.atleast_2d(np.asarray(spec['values'], dtype=np.float64))
+    row_labels = spec.get('row_labels', [spec['ylabel']])
+    axes = fig.subplots(len(values), 1, sharex=True, squeeze=False)[:, 0]
+    for ax, row, label in zip(axes, values, row_labels):
+        image = ax.imshow(row[np.newaxis, :], aspect='auto', cmap='viridis', interpolation='nearest')
+        fig.colorbar(image, ax=ax, label=spec['colorbar'] if ax is axes[0] else None, pad=0.01 if len(values) > 1 else 0.05)
+        ax.set_yticks([0], labels=[label])
+    axes[0].set_title(spec['title'])
+    axes[-1].set_xlabel(spec['xlabel'])
+    positions = tick_positions(values.shape[1])
+    axes[-1].set_xticks(positions, labels=[spec['tick_labels'][i] for i in positions], rotation=45, ha='right')
+    # Fixed margins instead of tight_layout's text measuring pass
+    fig.subplots_adjust(left=0.08 if len(values) > 1 else 0.05, right=0.98, bottom=0.15, top=0.93, hspace=0.15)
+    return fig
+
+
+def draw_map(fig, spec):
+    # spec: values (rows x cols, north up), extent (west, east, south, north), title, colorbar
+    ax = fig.add_subplot(1, 1, 1)
+    image = ax.imshow(spec['values'], extent=spec['extent'], origin='upper', aspect='equal', cmap='viridis',
+                      interpolation='nearest')
+    fig.colorbar(image, ax=ax, label=spec['colorbar'])
+    ax.set_title(spec['title'])
+    ax.set_xlabel('Longitude')
+    ax.set_ylabel('Latitude')
+    return fig
+
+
+DRAWERS = {'heatmap': draw_heatmap, 'map': draw_map}
+
+
+def save_figure(spec):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    DRAWERS[spec.get('kind', 'heatmap')](fig, spec)
+    os.makedirs(os.path.dirname(spec['path']) or '.', exist_ok=True)
+    fig.savefig(spec['path'])
+    return os.path.abspath(spec['path'])
+
+
+def init_worker():
+    use_agg()
+    # Pay the canvas imports once per worker, not once per figure
+    from matplotlib.backends import backend_agg  # noqa: F401
+
+
+def render_pool(workers):
+    # Spawned, not forked: callers may already have initialized MPI
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def render_batch(specs, workers=None):
+    # Paths come back in the order of specs
+    workers = min(workers or os.cpu_count() or 1, len(specs))
+    if workers <= 1:
+        return [save_figure(spec) for spec in specs]
+    with render_pool(workers) as pool:
+        return list(pool.map(save_figure, specs))
+
+
+def show_heatmaps(specs):
+    # Interactive path: same drawing, on pyplot figures that stay open
+    import matplotlib.pyplot as plt
+
+    paths = []
+    for spec in specs:
+        fig = plt.figure(figsize=FIGSIZE)
+        DRAWERS[spec.get('kind', 'heatmap')](fig, spec)
+        fig.savefig(spec['path'])
+        paths.append(os.path.abspath(spec['path']))
+    plt.show()
+    return paths
@@ -0,0 +1,391 @@
+import argparse
+import heapq
+import json
+import os
+import time
+
+from mpi4py import MPI
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR
+from dates import MISSING_DAY, format_days, parse_dates
+from heatmap_engine import (DATE_COLUMN, DEFAULT_INPUT, POLLUTANTS, figure_spec, local_bins, period_means,
+                            read_cache_slice, read_data_slice, reduce_bins, use_cache)
+from partition import exchange, rank_byte_range
+from pollutant_stats import THRESHOLDS, build_results
+from schema import column_index
+from sketch import DEFAULT_ALPHA, QuantileSketch
+
+# Discrete-event replay of the processed data over a day, week, month or year.
+# Every site (or state) is a source that emits its records as timestamped
+# events; a heap-based scheduler interleaves the sources in simulated time
+# together with end-of-day ticks, and hands each event to pluggable sinks.
+# Records are hash-partitioned across ranks by site or state, so every source
+# lives on exactly one rank. The simulated clock runs a fixed factor faster
+# than wall-clock time, or as fast as possible, and the sustained event rate
+# is reported so runs can be sized.
+
+SECONDS_PER_DAY = 86400
+WINDOWS = ['day', 'week', 'month', 'year']
+KEY_COLUMNS = ['Site ID', 'STATE_CODE']
+PARTITIONS = {'site': 1, 'state': 2}  # Column of the key in a record row
+FIRST_READING = 3  # Record rows are day, Site ID, STATE_CODE, readings...
+MAX_ALERTS = 20
+DEFAULT_REPLAY_DIR = 'data/output/replay'
+
+
+def window_end(start_day, window):
+    # Exclusive last day; month and year windows keep the day of month,
+    # clamped to the end of a shorter month
+    if window == 'day':
+        return start_day + 1
+    if window == 'week':
+        return start_day + 7
+    start = np.datetime64(int(start_day), 'D')
+    unit = 'M' if window == 'month' else 'Y'
+    period = start.astype(f'datetime64[{unit}]')
+    following = (period + 1).astype('datetime64[D]')
+    end = min(following + (start - period.astype('datetime64[D]')), (period + 2).astype('datetime64[D]'))
+    return int(end.astype(np.int64))
+
+
+def read_records(filepath, pollutants, source, cache_dir, rank, size):
+    names = [POLLUTANTS[name]['name'] for name in pollutants]
+    if use_cache(source, filepath, cache_dir):
+        days, values = read_cache_slice(cache_dir, rank, size, KEY_COLUMNS + names)
+    else:
+        start, end = rank_byte_range(filepath, rank, size)
+        columns = [column_index(name) for name in KEY_COLUMNS + names]
+        days, values = read_data_slice(filepath, start, end, DATE_COLUMN, columns)
+    return np.column_stack([days, values]).astype(np.float64)
+
+
+class Scheduler:
+    # Min-heap of (time, order, sequence, action, payload). At equal times a
+    # lower order runs first and the sequence keeps insertion order.
+    def __init__(self, speedup=None):
+        self.queue = []
+        self.sequence = 0
+        self.speedup = speedup
+        self.now = None
+
+    def schedule(self, when, action, payload=None, order=1):
+        heapq.heappush(self.queue, (when, order, self.sequence, action, payload))
+        self.sequence += 1
+
+    def run(self, until, sim_origin, wall_origin):
+        paced = None
+        while self.queue and self.queue[0][0] <= until:
+            when, _, _, action, payload = heapq.heappop(self.queue)
+            if self.speedup and when != paced:
+                # Hold the event back until wall-clock time catches up with it
+                paced = when
+                delay = wall_origin + (when - sim_origin) / self.speedup - MPI.Wtime()
+                if delay > 0:
+                    time.sleep(delay)
+            self.now = when
+            action(payload)
+
+
+class Sink:
+    # on_event gets the event time and the index of its record row; finish
+    # is collective and returns the sink's result on rank 0
+    name = None
+
+    def start(self, replay):
+        self.replay = replay
+
+    def on_event(self, when, index):
+        pass
+
+    def on_tick(self, when):
+        pass
+
+    def finish(self, comm):
+        return None
+
+
+class BatchSink(Sink):
+    # Buffers the day's records and processes them as one array at the tick
+    def start(self, replay):
+        super().start(replay)
+        self.pending = []
+
+    def on_event(self, when, index):
+        self.pending.append(index)
+
+    def on_tick(self, when):
+        if self.pending:
+            self.on_batch(self.replay.records[self.pending])
+            self.pending = []
+
+    def on_batch(self, rows):
+        pass
+
+
+class HeatmapSink(BatchSink):
+    # Running per-day (sum, count) bins, the same layout the heatmap engine reduces
+    name = 'heatmap'
+
+    def start(self, replay):
+        super().start(replay)
+        self.bins = np.zeros((len(replay.pollutants), 2, replay.end_day - replay.first_day), dtype=np.float64)
+
+    def on_batch(self, rows):
+        self.bins += local_bins(rows[:, 0].astype(np.int32), rows[:, FIRST_READING:], self.replay.first_day,
+                                self.bins.shape[2])
+
+    def finish(self, comm):
+        totals = reduce_bins(self.bins, comm)
+        if totals is None:
+            return None
+        result = {}
+        for i, pollutant in enumerate(self.replay.pollutants):
+            days, means = period_means(self.replay.first_day, totals[i, 0], totals[i, 1])
+            result[pollutant] = {'days': [str(day) for day in format_days(days)], 'means': means.tolist()}
+        return result
+
+
+class AlertSink(Sink):
+    # Readings over the alert_high_*_concentration thresholds, as they happen
+    name = 'alerts'
+
+    def start(self, replay):
+        super().start(replay)
+        self.limits = np.array([np.inf if THRESHOLDS[name] is None else THRESHOLDS[name]
+                                for name in replay.pollutants])
+        self.counts = np.zeros(len(self.limits), dtype=np.int64)
+        self.first = []
+
+    def on_event(self, when, index):
+        row = self.replay.records[index]
+        over = np.flatnonzero(row[FIRST_READING:] > self.limits)
+        if len(over) == 0:
+            return
+        self.counts[over] += 1
+        if len(self.first) < MAX_ALERTS:
+            self.first += [(when, int(row[1]), self.replay.pollutants[i], float(row[FIRST_READING + i])) for i in over]
+
+    def finish(self, comm):
+        comm.Allreduce(MPI.IN_PLACE, self.counts, op=MPI.SUM)
+        first = comm.gather(self.first, root=0)
+        if first is None:
+            return None
+        earliest = sorted(alert for rank_alerts in first for alert in rank_alerts)[:MAX_ALERTS]
+        return {'counts': dict(zip(self.replay.pollutants, self.counts.tolist())),
+                'first': [{'day': str(format_days([int(when // SECONDS_PER_DAY)])[0]), 'site_id': site,
+                           'pollutant': pollutant, 'value': value}
+                          for when, site, pollutant, value in earliest]}
+
+
+def merge_moments(a, b):
+    # Chan et al. pairwise merge of per-column (count, mean, M2)
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        delta = mean_b - mean_a
+        mean = np.where(count > 0, mean_a + delta * count_b / count, 0.0)
+        m2 = np.where(count > 0, m2_a + m2_b + delta ** 2 * count_a * count_b / count, 0.0)
+    return count, mean, m2
+
+
+class StatsSink(BatchSink):
+    # Running pollutant_stats metrics; moments are merged day by day, so the
+    # replayed records are never kept
+    name = 'stats'
+
+    def start(self, replay):
+        super().start(replay)
+        columns = len(replay.pollutants)
+        self.thresholds = [THRESHOLDS[name] for name in replay.pollutants]
+        self.limits = np.array([np.inf if threshold is None else threshold for threshold in self.thresholds])
+        self.moments = (np.zeros(columns), np.zeros(columns), np.zeros(columns))
+        self.mins = np.full(columns, np.inf)
+        self.maxs = np.full(columns, -np.inf)
+        self.totals = np.zeros(1 + columns)  # rows, exceedances
+        self.sketches = [QuantileSketch(DEFAULT_ALPHA) for _ in range(columns)]
+
+    def on_batch(self, rows):
+        readings = rows[:, FIRST_READING:]
+        valid = ~np.isnan(readings)
+        count = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(readings, axis=0) / count, 0.0)
+        m2 = np.nansum((readings - mean) ** 2, axis=0)
+        self.moments = merge_moments(self.moments, (count, mean, m2))
+        self.mins = np.minimum(self.mins, np.where(valid, readings, np.inf).min(axis=0))
+        self.maxs = np.maximum(self.maxs, np.where(valid, readings, -np.inf).max(axis=0))
+        with np.errstate(invalid='ignore'):
+            self.totals += np.concatenate([[len(rows)], (readings > self.limits).sum(axis=0)])
+        for i, sketch in enumerate(self.sketches):
+            sketch.add(readings[:, i])
+
+    def finish(self, comm):
+        count, mean, m2 = comm.allreduce(self.moments, op=merge_moments)
+        comm.Allreduce(MPI.IN_PLACE, self.mins, op=MPI.MIN)
+        comm.Allreduce(MPI.IN_PLACE, self.maxs, op=MPI.MAX)
+        comm.Allreduce(MPI.IN_PLACE, self.totals, op=MPI.SUM)
+        sketch_counts = np.stack([sketch.counts for sketch in self.sketches])
+        comm.Allreduce(MPI.IN_PLACE, sketch_counts, op=MPI.SUM)
+        if comm.Get_rank() != 0:
+            return None
+        for sketch, merged in zip(self.sketches, sketch_counts):
+            sketch.counts = merged
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variances = m2 / count
+        return build_results(self.replay.pollutants, self.thresholds, int(self.totals[0]), count, mean, variances,
+                             self.mins, self.maxs, self.totals[1:], self.sketches)
+
+
+SINKS = {sink.name: sink for sink in (HeatmapSink, AlertSink, StatsSink)}
+
+
+class Replay:
+    def __init__(self, records, pollutants, first_day, end_day, sinks, speedup=None, partition='site'):
+        self.records = records
+        self.pollutants = pollutants
+        self.first_day = first_day
+        self.end_day = end_day
+        self.sinks = sinks
+        self.partition = partition
+        self.scheduler = Scheduler(speedup)
+        self.events = 0
+
+    def _emit(self, payload):
+        source, index = payload
+        when = self.scheduler.now
+        for sink in self.sinks:
+            sink.on_event(when, index)
+        self.events += 1
+        self._advance(source)
+
+    def _advance(self, source):
+        # Only a source's next record sits in the heap
+        for when, index in source:
+            self.scheduler.schedule(when, self._emit, (source, index))
+            return
+
+    def _tick(self, day):
+        # End of a simulated day; runs before records stamped at the same instant
+        when = self.scheduler.now
+        for sink in self.sinks:
+            sink.on_tick(when)
+        if day + 1 < self.end_day:
+            self.scheduler.schedule((day + 2) * SECONDS_PER_DAY, self._tick, day + 1, order=0)
+
+    def sources(self):
+        # One time-ordered stream of record indexes per site or state
+        keys = self.records[:, PARTITIONS[self.partition]]
+        order = np.lexsort((self.records[:, 0], keys))
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for indexes in np.split(order, bounds) if len(order) else []:
+            times = self.records[indexes, 0].astype(np.int64) * SECONDS_PER_DAY
+            yield zip(times.tolist(), indexes.tolist())
+
+    def run(self, comm):
+        for sink in self.sinks:
+            sink.start(self)
+        for source in self.sources():
+            self._advance(source)
+        self.scheduler.schedule((self.first_day + 1) * SECONDS_PER_DAY, self._tick, self.first_day, order=0)
+        # Common start line so paced ranks share one simulated clock
+        comm.Barrier()
+        started = MPI.Wtime()
+        self.scheduler.run(self.end_day * SECONDS_PER_DAY, self.first_day * SECONDS_PER_DAY, started)
+        self.seconds = MPI.Wtime() - started
+        return {sink.name: sink.finish(comm) for sink in self.sinks}
+
+
+def throughput(replay, comm):
+    # Sustained rate over the slowest rank's wall time
+    per_rank = comm.gather((replay.events, replay.seconds), root=0)
+    if per_rank is None:
+        return None
+    events = sum(count for count, _ in per_rank)
+    wall = max(seconds for _, seconds in per_rank)
+    simulated = (replay.end_day - replay.first_day) * SECONDS_PER_DAY
+    return {'events': events, 'wall_seconds': wall, 'events_per_second': events / wall if wall > 0 else None,
+            'simulated_seconds': simulated, 'achieved_speedup': simulated / wall if wall > 0 else None,
+            'per_rank': [{'rank': rank, 'events': count, 'wall_seconds': seconds,
+                          'events_per_second': count / seconds if seconds > 0 else None}
+                         for rank, (count, seconds) in enumerate(per_rank)]}
+
+
+def run(filepath, pollutants, window='day', start_day=None, speedup=None, partition='site', sinks=tuple(SINKS),
+        output_dir=DEFAULT_REPLAY_DIR, figures=False, source='auto', cache_dir=DEFAULT_CACHE_DIR,
+        comm=MPI.COMM_WORLD):
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+
+    records = read_records(filepath, pollutants, source, cache_dir, rank, size)
+    records = records[(records[:, 0] != MISSING_DAY) & ~np.isnan(records[:, 1:FIRST_READING]).any(axis=1)]
+    if start_day is None:
+        # Default to the first day in the data
+        start_day = comm.allreduce(int(records[:, 0].min()) if len(records) else np.iinfo(np.int32).max,
+                                   op=MPI.MIN)
+    end_day = window_end(start_day, window)
+    records = records[(records[:, 0] >= start_day) & (records[:, 0] < end_day)]
+    records = exchange(records, records[:, PARTITIONS[partition]].astype(np.int64) % size, comm)
+
+    replay = Replay(records, pollutants, start_day, end_day, [SINKS[name]() for name in sinks], speedup, partition)
+    results = replay.run(comm)
+    rates = throughput(replay, comm)
+    if rank != 0:
+        return None
+
+    report = {'run_id': time.strftime('%Y%m%dT%H%M%S'), 'input': os.path.abspath(filepath), 'window': window,
+              'start': str(format_days([start_day])[0]), 'end': str(format_days([end_day - 1])[0]),
+              'partition': partition, 'ranks': size, 'speedup': speedup, 'throughput': rates, 'sinks': results}
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"replay_{report['run_id']}.json")
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Replayed {report['start']} to {report['end']}: {rates['events']} events in "
+          f"{rates['wall_seconds']:.3f}s ({rates['events_per_second'] or 0:,.0f} events/s, "
+          f"{rates['achieved_speedup'] or 0:,.0f}x real time)")
+    if 'alerts' in results:
+        for alert in results['alerts']['first']:
+            print(f"Alert: High {alert['pollutant']} concentration detected: {alert['value']} "
+                  f"(site {alert['site_id']}, {alert['day']})")
+    if figures and 'heatmap' in results:
+        from render import render_batch
+
+        specs = [figure_spec(parse_dates(bins['days']), np.array(bins['means']), pollutant, output_dir,
+                             region_suffix='replay')
+                 for pollutant, bins in results['heatmap'].items()]
+        for figure in render_batch(specs):
+            print(f"Heatmap written to {figure}")
+    print(f"Replay report written to {path}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Replay the processed data as discrete events through sinks.')
+    parser.add_argument('--window', choices=WINDOWS, default='day', help='simulated span (default: day)')
+    parser.add_argument('--start', help='first simulated day (YYYY-MM-DD or MM/DD/YYYY; default: first in the data)')
+    parser.add_argument('--speedup', type=float, default=0,
+                        help='simulated seconds per wall-clock second; 0 (default) runs as fast as possible')
+    parser.add_argument('--partition', choices=list(PARTITIONS), default='site',
+                        help='distribute sources across ranks by site or by state')
+    parser.add_argument('--sinks', nargs='+', choices=list(SINKS), default=list(SINKS))
+    parser.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS))
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='processed CSV to read')
+    parser.add_argument('--source', choices=['auto', 'csv', 'cache'], default='auto',
+                        help='read the CSV or the columnar cache; auto (default) prefers a fresh cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache written by init.py')
+    parser.add_argument('--output-dir', default=DEFAULT_REPLAY_DIR, help='directory for the report and figures')
+    parser.add_argument('--figures', action='store_true', help='also render the replayed days as heatmaps')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_day = int(parse_dates([args.start])[0]) if args.start else None
+    run(args.input, args.pollutants, args.window, start_day, args.speedup or None, args.partition, args.sinks,
+        args.output_dir, args.figures, args.source, args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
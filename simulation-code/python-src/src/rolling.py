@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import warnings
+
+from mpi4py import MPI
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from columnar_cache import DEFAULT_CACHE_DIR
+from dates import MISSING_DAY, format_days
+from heatmap_engine import (DATE_COLUMN, DEFAULT_INPUT, POLLUTANTS, global_day_range, read_cache_slice,
+                            read_data_slice, use_cache)
+from partition import exchange, rank_byte_range
+from pollutant_stats import THRESHOLDS
+from schema import column_index
+
+# Rolling-window analytics per pollutant and site: trailing moving averages,
+# rolling maxima and consecutive-exceedance streaks. The daily site grid is
+# partitioned by day across ranks. A rank's windows reach back over its left
+# edge, so only those last (window - 1) days travel from the ranks on the
+# left, and a streak carries over as one run length per site from a prefix
+# scan. Each rank writes its own days as a part file; the per-day network
+# layers (site mean of the averages, highest rolling max, longest active
+# streak) are gathered on rank 0 for the heatmap engine's --rolling-dir.
+
+DEFAULT_WINDOWS = [7, 30]
+DEFAULT_ROLLING_DIR = 'data/processed/rolling'
+MANIFEST = 'manifest.json'
+SITE_COLUMN = 'Site ID'
+FIRST_READING = 2  # Exchanged rows are day, Site ID, readings...
+
+
+def day_range(first_day, span, rank, size):
+    return first_day + span * rank // size, first_day + span * (rank + 1) // size
+
+
+def layer_names(windows, threshold):
+    names = [f'{window}-day mean' for window in windows] + [f'{window}-day max' for window in windows]
+    return names + (['exceedance streak'] if threshold is not None else [])
+
+
+def read_site_rows(filepath, pollutants, source, cache_dir, rank, size):
+    names = [POLLUTANTS[name]['name'] for name in pollutants]
+    if use_cache(source, filepath, cache_dir):
+        days, values = read_cache_slice(cache_dir, rank, size, [SITE_COLUMN] + names)
+    else:
+        start, end = rank_byte_range(filepath, rank, size)
+        columns = [column_index(SITE_COLUMN)] + [POLLUTANTS[name]['column'] for name in pollutants]
+        days, values = read_data_slice(filepath, start, end, DATE_COLUMN, columns)
+    rows = np.column_stack([days, values]).astype(np.float64)
+    return rows[(days != MISSING_DAY) & ~np.isnan(rows[:, 1])]
+
+
+def site_grid(rows, sites, start, days):
+    # (pollutants, sites, days) daily site means; NaN where a site has no reading
+    columns = rows.shape[1] - FIRST_READING
+    cells = np.searchsorted(sites, rows[:, 1]) * days + (rows[:, 0].astype(np.int64) - start)
+    grid = np.empty((columns, len(sites), days))
+    for i in range(columns):
+        values = rows[:, FIRST_READING + i]
+        valid = ~np.isnan(values)
+        sums = np.bincount(cells[valid], weights=values[valid], minlength=len(sites) * days)
+        counts = np.bincount(cells[valid], minlength=len(sites) * days)
+        with np.errstate(invalid='ignore'):
+            grid[i] = (sums / counts).reshape(len(sites), days)
+    return grid
+
+
+def exchange_halo(grid, first_day, span, halo, comm):
+    # Prepends the `halo` days before this rank's first day, received from
+    # whichever ranks own them (normally just the left neighbour); days
+    # before the data start stay NaN
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    start, end = day_range(first_day, span, rank, size)
+    requests = []
+    for other in range(rank + 1, size):
+        other_start, _ = day_range(first_day, span, other, size)
+        if other_start - halo >= end:
+            break
+        low, high = max(start, other_start - halo), min(end, other_start)
+        if low < high:
+            requests.append(comm.Isend(np.ascontiguousarray(grid[:, :, low - start:high - start]), dest=other))
+    padded = np.full(grid.shape[:2] + (halo + grid.shape[2],), np.nan)
+    padded[:, :, halo:] = grid
+    for other in range(rank - 1, -1, -1):
+        other_start, other_end = day_range(first_day, span, other, size)
+        if other_end <= start - halo:
+            break
+        low, high = max(other_start, start - halo), min(other_end, start)
+        if low < high:
+            received = np.empty(grid.shape[:2] + (high - low,))
+            comm.Recv(received, source=other)
+            padded[:, :, low - start + halo:high - start + halo] = received
+    MPI.Request.Waitall(requests)
+    return padded
+
+
+def moving_mean(padded, window, halo):
+    # Trailing mean over the valid days of each window, from cumulative sums
+    valid = ~np.isnan(padded)
+    zeros = np.zeros(padded.shape[:-1] + (1,))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, padded, 0.0), axis=-1)], axis=-1)
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=-1)], axis=-1)
+    end = np.arange(halo, padded.shape[-1]) + 1
+    window_sums = sums[..., end] - sums[..., end - window]
+    window_counts = counts[..., end] - counts[..., end - window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+
+def rolling_max(padded, window, halo):
+    # Zero-copy strided windows ending on each of the rank's own days
+    windows = sliding_window_view(np.where(np.isnan(padded), -np.inf, padded), window, axis=-1)
+    maxima = windows[..., halo - window + 1:, :].max(axis=-1)
+    return np.where(np.isneginf(maxima), np.nan, maxima)
+
+
+def merge_runs(left, right):
+    # (trailing run, whole span exceeded) of two adjacent day ranges
+    left_run, left_full = left
+    right_run, right_full = right
+    return np.where(right_full, left_run + right_run, right_run), left_full & right_full
+
+
+def exceedance_streaks(grid, threshold, comm):
+    # Consecutive days over the threshold ending on each day; the run
+    # entering this rank comes from an exclusive prefix scan over the ranks
+    with np.errstate(invalid='ignore'):
+        exceeded = grid > threshold
+    days = np.arange(grid.shape[-1])
+    last_break = np.maximum.accumulate(np.where(exceeded, -1, days), axis=-1)
+    runs = days - last_break
+    trailing = runs[:, -1] if grid.shape[-1] else np.zeros(grid.shape[0], dtype=np.int64)
+    full = last_break[:, -1] < 0 if grid.shape[-1] else np.ones(grid.shape[0], dtype=bool)
+    carried = comm.exscan((trailing, full), op=merge_runs)
+    if carried is not None:
+        runs = np.where(last_break < 0, runs + carried[0][:, np.newaxis], runs)
+    return runs.astype(np.float64)
+
+
+def site_layers(grid, padded, windows, halo, thresholds, comm):
+    # Per pollutant: (layers, sites, days) in layer_names order
+    layers = []
+    for i, threshold in enumerate(thresholds):
+        stack = [moving_mean(padded[i], window, halo) for window in windows]
+        stack += [rolling_max(padded[i], window, halo) for window in windows]
+        if threshold is not None:
+            stack.append(exceedance_streaks(grid[i], threshold, comm))
+        layers.append(np.stack(stack))
+    return layers
+
+
+def network_layers(layers, windows):
+    # One value per day: site mean of the averages; highest max and longest streak
+    count = len(windows)
+    with warnings.catch_warnings():
+        # Days on which no site has a value stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        rows = [np.nanmean(layers[:count], axis=1), np.nanmax(layers[count:], axis=1)]
+    return np.concatenate(rows)
+
+
+def gather_days(values, comm):
+    # Rank-ordered day slices of (layers, days) arrays onto rank 0
+    counts = comm.gather(values.size, root=0)
+    gathered = np.empty(sum(counts)) if counts is not None else None
+    comm.Gatherv(np.ascontiguousarray(values).ravel(), [gathered, counts] if counts is not None else None, root=0)
+    if gathered is None:
+        return None
+    pieces = np.split(gathered, np.cumsum(counts)[:-1])
+    return np.concatenate([piece.reshape(values.shape[0], -1) for piece in pieces], axis=1)
+
+
+def run(filepath, pollutants, windows=DEFAULT_WINDOWS, output_dir=DEFAULT_ROLLING_DIR, source='auto',
+        cache_dir=DEFAULT_CACHE_DIR, comm=MPI.COMM_WORLD):
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    windows = sorted(set(windows))
+    halo = windows[-1] - 1
+    thresholds = [THRESHOLDS[name] for name in pollutants]
+
+    rows = read_site_rows(filepath, pollutants, source, cache_dir, rank, size)
+    first_day, last_day = global_day_range(rows[:, 0].astype(np.int32), comm)
+    span = max(last_day - first_day + 1, 0)
+    sites = np.unique(np.concatenate(comm.allgather(np.unique(rows[:, 1]))))
+
+    # Every rank takes a contiguous run of days, for all sites
+    bounds = np.array([day_range(first_day, span, other, size)[1] for other in range(size)])
+    rows = exchange(rows, np.searchsorted(bounds, rows[:, 0], side='right'), comm)
+    start, end = day_range(first_day, span, rank, size)
+    grid = site_grid(rows, sites, start, end - start)
+    del rows
+
+    padded = exchange_halo(grid, first_day, span, halo, comm)
+    layers = site_layers(grid, padded, windows, halo, thresholds, comm)
+    del padded
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.savez(os.path.join(output_dir, f'part_{rank:04d}.npz'), start=start, end=end, sites=sites,
+             **{pollutant: layer for pollutant, layer in zip(pollutants, layers)})
+    network = [gather_days(network_layers(layer, windows), comm) for layer in layers]
+    if rank != 0:
+        return None
+
+    np.savez(os.path.join(output_dir, 'layers.npz'), first_day=first_day,
+             **{pollutant: layer for pollutant, layer in zip(pollutants, network)})
+    manifest = {'first_day': str(format_days([first_day])[0]), 'days': span, 'sites': len(sites),
+                'windows': windows, 'parts': size,
+                'layers': {pollutant: layer_names(windows, threshold)
+                           for pollutant, threshold in zip(pollutants, thresholds)}}
+    with open(os.path.join(output_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    print(f"Rolling layers for {span} days and {len(sites)} sites written to {output_dir}")
+    return manifest
+
+
+def load_layers(rolling_dir, pollutant):
+    # (first_day, layer names, (layers, days) values) for the heatmap engine
+    path = os.path.join(rolling_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        manifest = json.load(file)
+    if pollutant not in manifest['layers']:
+        return None
+    with np.load(os.path.join(rolling_dir, 'layers.npz')) as layers:
+        return int(layers['first_day']), manifest['layers'][pollutant], layers[pollutant]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Rolling averages, maxima and exceedance streaks per site.')
+    parser.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS))
+    parser.add_argument('--windows', nargs='+', type=int, default=DEFAULT_WINDOWS, help='window lengths in days')
+    parser.add_argument('--input', default=DEFAULT_INPUT, help='processed CSV to read')
+    parser.add_argument('--source', choices=['auto', 'csv', 'cache'], default='auto',
+                        help='read the CSV or the columnar cache; auto (default) prefers a fresh cache')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache written by init.py')
+    parser.add_argument('--output-dir', default=DEFAULT_ROLLING_DIR, help='part files and heatmap layers')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if min(args.windows) < 1:
+        raise SystemExit('--windows must be positive')
+    run(args.input, args.pollutants, args.windows, args.output_dir, args.source, args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR, load_manifest, open_columns, source_signature
+from dates import GRAINS, MISSING_DAY, parse_dates, to_periods
+from schema import POLLUTANT_COLUMNS
+
+# Materialized rollup cube: sum/count/min/max of every pollutant per time
+# grain x geography. Each (grain, geography) pair is one sparse .npz holding
+# only the groups that have data, so serving a heatmap is a lookup instead of
+# a re-read of the raw rows. Partial cubes merge group-wise, which is how new
+# data is folded in incrementally.
+
+DEFAULT_CUBE_DIR = 'data/processed/rollup'
+MANIFEST = 'manifest.json'
+GEOGRAPHIES = ['all', 'state', 'county', 'site']
+REGION_COLUMNS = ['STATE_CODE', 'COUNTY_CODE', 'Site ID']
+BLOCK_ROWS = 1_000_000
+
+
+def region_keys(geography, state_codes, county_codes, site_ids):
+    if geography == 'all':
+        return np.zeros(len(state_codes), dtype=np.int64)
+    if geography == 'state':
+        return state_codes.astype(np.int64)
+    if geography == 'county':
+        return county_key(state_codes.astype(np.int64), county_codes.astype(np.int64))
+    return site_ids.astype(np.int64)
+
+
+def county_key(state_code, county_code):
+    # County codes are only unique within a state
+    return state_code * 1000 + county_code
+
+
+def reduce_groups(keys, sums, counts, mins, maxs):
+    # Combine rows sharing a (period, region) key; inputs may be raw rows or
+    # already-aggregated groups
+    if len(keys) == 0:
+        return keys, sums, counts, mins, maxs
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1])
+    return (keys[starts],
+            np.add.reduceat(sums[order], starts, axis=0),
+            np.add.reduceat(counts[order], starts, axis=0),
+            np.minimum.reduceat(mins[order], starts, axis=0),
+            np.maximum.reduceat(maxs[order], starts, axis=0))
+
+
+def aggregate_rows(periods, regions, readings):
+    valid_day = periods != MISSING_DAY
+    periods, regions, readings = periods[valid_day], regions[valid_day], readings[valid_day]
+    observed = ~np.isnan(readings)
+    keys = np.column_stack([periods.astype(np.int64), regions])
+    return reduce_groups(keys,
+                         np.where(observed, readings, 0.0),
+                         observed.astype(np.int64),
+                         np.where(observed, readings, np.inf),
+                         np.where(observed, readings, -np.inf))
+
+
+def concat_groups(parts, pollutants):
+    if not parts:
+        width = len(pollutants)
+        return (np.empty((0, 2), dtype=np.int64), np.empty((0, width)), np.empty((0, width), dtype=np.int64),
+                np.empty((0, width)), np.empty((0, width)))
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+def build_partial(days, state_codes, county_codes, site_ids, readings, grains, geographies):
+    partial = {}
+    for grain in grains:
+        periods = to_periods(days, grain)
+        for geography in geographies:
+            regions = region_keys(geography, state_codes, county_codes, site_ids)
+            partial[(grain, geography)] = aggregate_rows(periods, regions, readings)
+    return partial
+
+
+def cube_file(grain, geography):
+    return f'{grain}_{geography}.npz'
+
+
+def save_cube(cube_dir, groups, pollutants, source=None, rows=0):
+    os.makedirs(cube_dir, exist_ok=True)
+    for (grain, geography), (keys, sums, counts, mins, maxs) in groups.items():
+        empty = counts == 0
+        np.savez(os.path.join(cube_dir, cube_file(grain, geography)),
+                 periods=keys[:, 0].astype(np.int32), regions=keys[:, 1], sum=sums, count=counts,
+                 min=np.where(empty, np.nan, mins), max=np.where(empty, np.nan, maxs))
+    manifest = {
+        'pollutants': pollutants,
+        'grains': sorted({grain for grain, _ in groups}, key=list(GRAINS).index),
+        'geographies': sorted({geography for _, geography in groups}, key=GEOGRAPHIES.index),
+        'rows': rows,
+    }
+    if source is not None:
+        manifest['source'] = source
+    with open(os.path.join(cube_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_cube_manifest(cube_dir=DEFAULT_CUBE_DIR):
+    path = os.path.join(cube_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def load_groups(cube_dir, grain, geography):
+    with np.load(os.path.join(cube_dir, cube_file(grain, geography))) as cube:
+        keys = np.column_stack([cube['periods'].astype(np.int64), cube['regions']])
+        empty = cube['count'] == 0
+        return (keys, cube['sum'], cube['count'],
+                np.where(empty, np.inf, cube['min']), np.where(empty, -np.inf, cube['max']))
+
+
+def build_from_cache(cache_dir=DEFAULT_CACHE_DIR, cube_dir=DEFAULT_CUBE_DIR, grains=tuple(GRAINS),
+                     geographies=tuple(GEOGRAPHIES), pollutants=POLLUTANT_COLUMNS, block_rows=BLOCK_ROWS):
+    # Memory is bounded by block_rows plus the (small) group tables
+    arrays, rows = open_columns(cache_dir, ['Date'] + REGION_COLUMNS + list(pollutants))
+    parts = {(grain, geography): [] for grain in grains for geography in geographies}
+    for start in range(0, rows, block_rows):
+        end = min(start + block_rows, rows)
+        readings = np.column_stack([np.asarray(arrays[name][start:end], dtype=np.float64) for name in pollutants])
+        partial = build_partial(parse_dates(arrays['Date'][start:end]), arrays['STATE_CODE'][start:end],
+                                arrays['COUNTY_CODE'][start:end], arrays['Site ID'][start:end],
+                                readings, grains, geographies)
+        for key, groups in partial.items():
+            parts[key].append(groups)
+            # Fold blocks as we go so the group tables stay compact
+            parts[key] = [reduce_groups(*concat_groups(parts[key], pollutants))]
+    groups = {key: concat_groups(value, pollutants) for key, value in parts.items()}
+    source = (load_manifest(cache_dir) or {}).get('source')
+    return save_cube(cube_dir, groups, list(pollutants), source=source, rows=rows)
+
+
+def merge_into(cube_dir, delta_dir):
+    # Incremental update: fold a cube built from new rows into an existing one
+    existing = load_cube_manifest(cube_dir)
+    delta = load_cube_manifest(delta_dir)
+    if existing is None:
+        raise FileNotFoundError(f"No rollup cube at {cube_dir}")
+    if delta is None:
+        raise FileNotFoundError(f"No rollup cube at {delta_dir}")
+    if existing['pollutants'] != delta['pollutants']:
+        raise ValueError("Cubes were built for different pollutant columns")
+    groups = {}
+    for grain in existing['grains']:
+        for geography in existing['geographies']:
+            merged = [load_groups(cube_dir, grain, geography)]
+            if grain in delta['grains'] and geography in delta['geographies']:
+                merged.append(load_groups(delta_dir, grain, geography))
+            groups[(grain, geography)] = reduce_groups(*concat_groups(merged, existing['pollutants']))
+    return save_cube(cube_dir, groups, existing['pollutants'], source=delta.get('source'),
+                     rows=existing['rows'] + delta['rows'])
+
+
+def geography_for(state_code=None, county_code=None, site_id=None):
+    # The finest filter given decides which geography table answers it
+    if site_id is not None:
+        return 'site', int(site_id)
+    if county_code is not None:
+        if state_code is None:
+            raise ValueError("A county filter needs its state code too")
+        return 'county', int(county_key(state_code, county_code))
+    if state_code is not None:
+        return 'state', int(state_code)
+    return 'all', 0
+
+
+def is_servable(cube_dir, grain, geography, pollutants, source_path=None):
+    manifest = load_cube_manifest(cube_dir)
+    if manifest is None or grain not in manifest['grains'] or geography not in manifest['geographies']:
+        return False
+    if any(name not in manifest['pollutants'] for name in pollutants):
+        return False
+    if source_path is None:
+        return True
+    # Only serve a cube built from the current processed file
+    if 'source' not in manifest or not os.path.exists(source_path):
+        return False
+    current = source_signature(source_path)
+    return manifest['source']['size'] == current['size'] and manifest['source']['mtime'] == current['mtime']
+
+
+def query_cube(cube_dir, grain, pollutants, state_code=None, county_code=None, site_id=None):
+    geography, region = geography_for(state_code, county_code, site_id)
+    manifest = load_cube_manifest(cube_dir)
+    columns = [manifest['pollutants'].index(name) for name in pollutants]
+    with np.load(os.path.join(cube_dir, cube_file(grain, geography))) as cube:
+        selected = cube['regions'] == region
+        return (cube['periods'][selected], cube['sum'][selected][:, columns], cube['count'][selected][:, columns],
+                cube['min'][selected][:, columns], cube['max'][selected][:, columns])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build or update the pollutant rollup cube.')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help='columnar cache to aggregate')
+    parser.add_argument('--cube-dir', default=DEFAULT_CUBE_DIR)
+    parser.add_argument('--grains', nargs='+', choices=list(GRAINS), default=list(GRAINS))
+    parser.add_argument('--geographies', nargs='+', choices=GEOGRAPHIES, default=GEOGRAPHIES)
+    parser.add_argument('--merge', action='store_true',
+                        help='aggregate --cache-dir as new rows and fold them into the existing cube')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.merge:
+        delta_dir = args.cube_dir.rstrip('/') + '.delta'
+        build_from_cache(args.cache_dir, delta_dir, args.grains, args.geographies)
+        manifest = merge_into(args.cube_dir, delta_dir)
+    else:
+        manifest = build_from_cache(args.cache_dir, args.cube_dir, args.grains, args.geographies)
+    print(f"Rollup cube covers {manifest['rows']} rows in {args.cube_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+from mpi4py import MPI
+import numpy as np
+
+# Dynamic work distribution for the heatmap readers. The input is cut into
+# many more chunks than ranks and every rank pulls the next chunk index from
+# a shared counter on rank 0 (one MPI fetch-and-add per chunk, no master
+# process), so fast ranks simply take more chunks and all ranks finish close
+# to the average instead of waiting on the slowest fixed slice.
+
+CHUNKS_PER_RANK = 16
+
+
+class ChunkCounter:
+    def __init__(self, comm=MPI.COMM_WORLD):
+        self.comm = comm
+        rank = comm.Get_rank()
+        self.win = MPI.Win.Allocate(8 if rank == 0 else 0, 8, comm=comm)
+        if rank == 0:
+            self.win.Lock(0)
+            self.win.Put(np.zeros(1, dtype=np.int64), 0)
+            self.win.Unlock(0)
+        comm.Barrier()
+        self.one = np.ones(1, dtype=np.int64)
+        self.result = np.empty(1, dtype=np.int64)
+
+    def next(self):
+        self.win.Lock(0, MPI.LOCK_SHARED)
+        self.win.Fetch_and_op(self.one, self.result, 0, 0, MPI.SUM)
+        self.win.Unlock(0)
+        return int(self.result[0])
+
+    def free(self):
+        self.win.Free()
+
+
+def pull_chunks(read_chunk, chunks, comm=MPI.COMM_WORLD):
+    # read_chunk(index, chunks) -> result; returns this rank's (index, result)
+    # pairs. Collective: every rank must call it.
+    counter = ChunkCounter(comm)
+    taken = []
+    while True:
+        index = counter.next()
+        if index >= chunks:
+            break
+        taken.append((index, read_chunk(index, chunks)))
+    counter.free()
+    return taken
+
+
+def default_chunks(comm=MPI.COMM_WORLD):
+    return CHUNKS_PER_RANK * comm.Get_size()
@@ -0,0 +1,85 @@
+import numpy as np
+
+# Declared dtypes for the AirNow daily export, shared by every reader in
+# python-src. Numerics are pinned to compact widths and repeated strings are
+# categoricals, so pandas never falls back to inferring object columns.
+
+POLLUTANT_COLUMNS = [
+    'Daily Mean PM10 Concentration',
+    'Daily Mean PM2.5 Concentration',
+    'Daily Max 8-hour Ozone Concentration',
+    'Daily Max 1-hour NO2 Concentration',
+    'Daily Max 8-hour CO Concentration',
+    'Daily Mean Pb Concentration',
+    'Daily Max 1-hour SO2 Concentration'
+    ]
+
+# Column order of data/raw/combined_file_final.csv
+RAW_SCHEMA = {
+    'Date': 'category',
+    'Source': 'category',
+    'Site ID': np.int32,
+    'POC': np.int32,
+    'Daily Mean PM10 Concentration': np.float32,
+    'UNITS': 'category',
+    'DAILY_AQI_VALUE': object,  # Mixed types in the exports; coerced below
+    'Site Name': 'category',
+    'DAILY_OBS_COUNT': np.int32,
+    'PERCENT_COMPLETE': np.float32,
+    'AQS_PARAMETER_CODE': np.int32,
+    'AQS_PARAMETER_DESC': 'category',
+    'CBSA_CODE': np.float32,  # Missing for rural sites
+    'CBSA_NAME': 'category',
+    'STATE_CODE': np.int32,
+    'STATE': 'category',
+    'COUNTY_CODE': np.int32,
+    'COUNTY': 'category',
+    'SITE_LATITUDE': np.float64,
+    'SITE_LONGITUDE': np.float64,
+    'Daily Mean PM2.5 Concentration': np.float32,
+    'Daily Max 8-hour Ozone Concentration': np.float32,
+    'Daily Max 1-hour NO2 Concentration': np.float32,
+    'Daily Max 8-hour CO Concentration': np.float32,
+    'Daily Mean Pb Concentration': np.float32,
+    'Daily Max 1-hour SO2 Concentration': np.float32,
+}
+
+DROPPED_COLUMNS = ['Site Name', 'CBSA_CODE', 'CBSA_NAME']
+
+# Column order of data/processed/preprocessed_for_cpp.csv
+PROCESSED_SCHEMA = {name: dtype for name, dtype in RAW_SCHEMA.items() if name not in DROPPED_COLUMNS}
+PROCESSED_SCHEMA['DAILY_AQI_VALUE'] = np.float32
+PROCESSED_COLUMNS = list(PROCESSED_SCHEMA)
+
+
+def column_index(name, schema=PROCESSED_SCHEMA):
+    return list(schema).index(name)
+
+
+def parser_engine():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return 'c'
+    return 'pyarrow'
+
+
+def coerce_columns(data):
+    import pandas as pd
+
+    # DAILY_AQI_VALUE mixes numbers and text in the raw exports
+    if 'DAILY_AQI_VALUE' in data.columns and data['DAILY_AQI_VALUE'].dtype.kind != 'f':
+        data['DAILY_AQI_VALUE'] = pd.to_numeric(data['DAILY_AQI_VALUE'], errors='coerce').astype(np.float32)
+    return data
+
+
+def read_airnow_csv(file_path, schema=RAW_SCHEMA, chunksize=None, **kwargs):
+    # pyarrow parses with multiple threads but cannot stream chunks, so
+    # chunked reads always use the C engine
+    import pandas as pd  # Deferred so importing the schema alone stays cheap
+
+    engine = 'c' if chunksize is not None else parser_engine()
+    reader = pd.read_csv(file_path, dtype=schema, engine=engine, chunksize=chunksize, **kwargs)
+    if chunksize is not None:
+        return (coerce_columns(chunk) for chunk in reader)
+    return coerce_columns(reader)
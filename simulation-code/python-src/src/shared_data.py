@@ -0,0 +1,74 @@
+from mpi4py import MPI
+import numpy as np
+
+from columnar_cache import rank_row_range
+
+# Node-level shared dataset, the Python counterpart of the shared window in
+# the C++ simulations (MPI_Comm_split_type + MPI_Win_allocate_shared). The
+# ranks of each node parse their share of the input, the node's leader
+# allocates one shared window for the whole column set, and every rank copies
+# its rows in at its offset. Afterwards each rank holds zero-copy NumPy views,
+# so adding ranks on a node does not multiply the dataset in memory.
+
+
+def node_communicator(comm=MPI.COMM_WORLD):
+    return comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.Get_rank())
+
+
+class SharedArray:
+    def __init__(self, node, shape, dtype):
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        # Only the node leader contributes memory; the rest map its segment
+        self.win = MPI.Win.Allocate_shared(nbytes if node.Get_rank() == 0 else 0, dtype.itemsize, comm=node)
+        buffer, _ = self.win.Shared_query(0)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=buffer)
+
+    def free(self):
+        self.array = None
+        self.win.Free()
+
+
+class NodeDataset:
+    def __init__(self, node, days, readings):
+        self.node = node
+        self._days = days
+        self._readings = readings
+        self.days = days.array
+        self.readings = readings.array
+        self.rows = len(self.days)
+
+    def part(self, index, parts):
+        # Zero-copy rows of one part; every node holds all rows
+        start, end = rank_row_range(self.rows, index, parts)
+        return self.days[start:end], self.readings[start:end]
+
+    def free(self):
+        # Collective over the node
+        self.days = self.readings = None
+        self._days.free()
+        self._readings.free()
+        self.node.Free()
+
+
+def load_node_dataset(read_part, columns, comm=MPI.COMM_WORLD):
+    # read_part(index, parts) -> (days, readings) for one part of the input;
+    # each node reads the whole input, split over its own ranks
+    node = node_communicator(comm)
+    node_rank = node.Get_rank()
+    days, readings = read_part(node_rank, node.Get_size())
+    counts = node.allgather(len(days))
+    offset = sum(counts[:node_rank])
+    rows = sum(counts)
+
+    shared_days = SharedArray(node, (rows,), np.int32)
+    shared_readings = SharedArray(node, (rows, columns), np.float64)
+    shared_days.win.Fence()
+    shared_readings.win.Fence()
+    shared_days.array[offset:offset + len(days)] = days
+    shared_readings.array[offset:offset + len(days)] = readings
+    del days, readings
+    # Every rank's rows are in place before anyone reads the window
+    shared_days.win.Fence()
+    shared_readings.win.Fence()
+    return NodeDataset(node, shared_days, shared_readings)
@@ -0,0 +1,71 @@
+import math
+
+import numpy as np
+
+# Mergeable quantile sketch with relative-error guarantees (DDSketch style).
+# Values are counted in logarithmic buckets over a fixed key range, so two
+# sketches merge by adding their count arrays. The fixed shape also lets MPI
+# ranks merge sketches with a single buffer Allreduce.
+
+DEFAULT_ALPHA = 0.01
+MIN_MAGNITUDE = 1e-9
+MAX_MAGNITUDE = 1e9
+
+
+class QuantileSketch:
+    def __init__(self, alpha=DEFAULT_ALPHA, min_magnitude=MIN_MAGNITUDE, max_magnitude=MAX_MAGNITUDE):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.min_magnitude = min_magnitude
+        self.min_key = self._keys(np.array([min_magnitude]))[0]
+        self.max_key = self._keys(np.array([max_magnitude]))[0]
+        buckets = int(self.max_key - self.min_key) + 1
+        # Row 0 counts negative values by magnitude, row 1 positive values;
+        # the extra trailing slot of row 0 counts values too close to zero
+        self.counts = np.zeros((2, buckets + 1), dtype=np.float64)
+
+    def _keys(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def _bucket_value(self, keys):
+        return 2 * np.power(self.gamma, keys) / (self.gamma + 1)
+
+    @property
+    def count(self):
+        return float(self.counts.sum())
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        magnitudes = np.abs(values)
+        tiny = magnitudes < self.min_magnitude
+        self.counts[0, -1] += tiny.sum()
+        buckets = self.counts.shape[1] - 1
+        for row, sign in ((0, values < 0), (1, values > 0)):
+            selected = magnitudes[sign & ~tiny]
+            if len(selected) == 0:
+                continue
+            keys = np.clip(self._keys(selected), self.min_key, self.max_key) - self.min_key
+            self.counts[row, :buckets] += np.bincount(keys, minlength=buckets)
+
+    def merge(self, other):
+        if other.counts.shape != self.counts.shape or other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different parameters")
+        self.counts += other.counts
+
+    def quantile(self, q):
+        total = self.count
+        if total == 0:
+            return math.nan
+        rank = q * (total - 1)
+        buckets = self.counts.shape[1] - 1
+        keys = np.arange(buckets) + self.min_key
+        # Ascending order: large negative magnitudes first, then ~zero, then positives
+        ordered = np.concatenate([self.counts[0, :buckets][::-1], [self.counts[0, -1]], self.counts[1, :buckets]])
+        values = np.concatenate([-self._bucket_value(keys)[::-1], [0.0], self._bucket_value(keys)])
+        position = np.searchsorted(np.cumsum(ordered), rank, side='right')
+        return float(values[min(position, len(values) - 1)])
+
+    def median(self):
+        return self.quantile(0.5)
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+
+from mpi4py import MPI
+import numpy as np
+
+from columnar_cache import DEFAULT_CACHE_DIR, source_signature
+from dates import GRAINS, MISSING_DAY, format_periods, parse_dates, to_periods
+from heatmap_engine import (DATE_COLUMN, DEFAULT_INPUT, DEFAULT_OUTPUT_DIR, POLLUTANTS, period_aligned,
+                            read_cache_slice, read_data_slice, use_cache)
+from partition import rank_byte_range
+from rollup import aggregate_rows, concat_groups, reduce_groups
+from schema import column_index
+
+# Spatial heatmaps from SITE_LATITUDE/SITE_LONGITUDE. Readings are binned
+# into a global lat/long grid of square cells per time period; each rank bins
+# its own rows and the sparse grids are merged with an MPI reduction. From the
+# finest grid, rank 0 derives a pyramid of coarser levels (cell indexes
+# shifted right, so no re-binning) and cuts every level into fixed-size tiles.
+# A zoomed or panned map reads only the tiles under its bounding box.
+
+DEFAULT_TILE_DIR = 'data/processed/tiles'
+MANIFEST = 'manifest.json'
+LAT_LON_COLUMNS = ['SITE_LATITUDE', 'SITE_LONGITUDE']
+TILE_PIXELS = 256
+MAX_LEVEL = 6  # 360 / (256 << 6) = ~0.022 degrees per cell
+MAX_MAP_PIXELS = 1024
+
+
+def grid_shape(level):
+    # Square cells: twice as many columns (360 degrees) as rows (180 degrees)
+    cols = TILE_PIXELS << level
+    return cols // 2, cols
+
+
+def cell_size(level):
+    return 360.0 / (TILE_PIXELS << level)
+
+
+def cell_index(lat, lon, level):
+    rows, cols = grid_shape(level)
+    size = cell_size(level)
+    valid = ~(np.isnan(lat) | np.isnan(lon)) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    iy = np.clip(np.floor((90.0 - np.where(valid, lat, 0)) / size), 0, rows - 1).astype(np.int64)
+    ix = np.clip(np.floor((np.where(valid, lon, 0) + 180.0) / size), 0, cols - 1).astype(np.int64)
+    return iy, ix, valid
+
+
+def read_points(filepath, names, source, cache_dir, rank, size):
+    # Day ordinals, latitude, longitude and one column per pollutant
+    if use_cache(source, filepath, cache_dir):
+        days, readings = read_cache_slice(cache_dir, rank, size, LAT_LON_COLUMNS + names)
+    else:
+        start, end = rank_byte_range(filepath, rank, size)
+        columns = [column_index(name) for name in LAT_LON_COLUMNS + names]
+        days, readings = read_data_slice(filepath, start, end, DATE_COLUMN, columns)
+    return days, readings[:, 0], readings[:, 1], np.ascontiguousarray(readings[:, 2:])
+
+
+def bin_points(periods, lat, lon, readings, level):
+    # Sparse 2D histogram: sum/count/min/max per (period, cell) with data
+    iy, ix, valid = cell_index(lat, lon, level)
+    periods = np.where(valid, periods, MISSING_DAY)
+    return aggregate_rows(periods, iy * grid_shape(level)[1] + ix, readings)
+
+
+def merge_partials(a, b):
+    return reduce_groups(*concat_groups([a, b], None))
+
+
+def coarsen(groups, level, target):
+    # Parent cell of every key at a coarser level; shifting keeps it exact
+    keys, sums, counts, mins, maxs = groups
+    cols = grid_shape(level)[1]
+    shift = level - target
+    iy, ix = keys[:, 1] // cols >> shift, keys[:, 1] % cols >> shift
+    keys = np.column_stack([keys[:, 0], iy * grid_shape(target)[1] + ix])
+    return reduce_groups(keys, sums, counts, mins, maxs)
+
+
+def split_tiles(groups, level):
+    keys, sums, counts, mins, maxs = groups
+    cols = grid_shape(level)[1]
+    iy, ix = keys[:, 1] // cols, keys[:, 1] % cols
+    tiles = (iy // TILE_PIXELS) * (cols // TILE_PIXELS) + ix // TILE_PIXELS
+    order = np.argsort(tiles, kind='stable')
+    tiles = tiles[order]
+    starts = np.flatnonzero(np.concatenate([[True], tiles[1:] != tiles[:-1]])) if len(tiles) else []
+    ends = list(starts[1:]) + [len(tiles)]
+    for start, end in zip(starts, ends):
+        selected = order[start:end]
+        tile = int(tiles[start])
+        yield divmod(tile, cols // TILE_PIXELS), {
+            'periods': keys[selected, 0].astype(np.int32),
+            'y': (iy[selected] % TILE_PIXELS).astype(np.uint16),
+            'x': (ix[selected] % TILE_PIXELS).astype(np.uint16),
+            'sum': sums[selected], 'count': counts[selected],
+            'min': np.where(counts[selected] == 0, np.nan, mins[selected]),
+            'max': np.where(counts[selected] == 0, np.nan, maxs[selected]),
+        }
+
+
+def tile_file(tile_dir, grain, level, ty, tx):
+    return os.path.join(tile_dir, grain, str(level), f'{ty}_{tx}.npz')
+
+
+def write_pyramid(tile_dir, grain, groups, max_level):
+    # Finest level first; each coarser level is folded from the one below it
+    written = {}
+    for level in range(max_level, -1, -1):
+        if level < max_level:
+            groups = coarsen(groups, level + 1, level)
+        os.makedirs(os.path.join(tile_dir, grain, str(level)), exist_ok=True)
+        written[level] = []
+        for (ty, tx), arrays in split_tiles(groups, level):
+            np.savez(tile_file(tile_dir, grain, level, ty, tx), **arrays)
+            written[level].append([ty, tx])
+    return written
+
+
+def build_pyramid(filepath, tile_dir=DEFAULT_TILE_DIR, pollutants=tuple(POLLUTANTS), grains=tuple(GRAINS),
+                  max_level=MAX_LEVEL, source='auto', cache_dir=DEFAULT_CACHE_DIR, comm=MPI.COMM_WORLD):
+    rank = comm.Get_rank()
+    names = [POLLUTANTS[name]['name'] for name in pollutants]
+    days, lat, lon, readings = read_points(filepath, names, source, cache_dir, rank, comm.Get_size())
+    rows = comm.reduce(len(days), op=MPI.SUM, root=0)
+
+    tiles = {}
+    for grain in grains:
+        partial = bin_points(to_periods(days, grain), lat, lon, readings, max_level)
+        # Tree reduction of the sparse grids; message size follows occupied cells, not rows
+        groups = comm.reduce(partial, op=merge_partials, root=0)
+        if rank == 0:
+            tiles[grain] = write_pyramid(tile_dir, grain, groups, max_level)
+    if rank != 0:
+        return None
+
+    manifest = {'pollutants': names, 'grains': list(grains), 'max_level': max_level,
+                'tile_pixels': TILE_PIXELS, 'rows': rows, 'tiles': tiles}
+    if os.path.exists(filepath):
+        manifest['source'] = source_signature(filepath)
+    with open(os.path.join(tile_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file)
+    return manifest
+
+
+def load_tile_manifest(tile_dir=DEFAULT_TILE_DIR):
+    path = os.path.join(tile_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def level_for(lat_range, lon_range, max_level, max_pixels=MAX_MAP_PIXELS):
+    # Finest level whose cells still fit the view in max_pixels
+    span = max(lat_range[1] - lat_range[0], lon_range[1] - lon_range[0])
+    level = max_level
+    while level > 0 and span / cell_size(level) > max_pixels:
+        level -= 1
+    return level
+
+
+def pixel_window(lat_range, lon_range, level):
+    rows, cols = grid_shape(level)
+    size = cell_size(level)
+    top = int(np.clip(np.floor((90.0 - lat_range[1]) / size), 0, rows - 1))
+    bottom = int(np.clip(np.floor((90.0 - lat_range[0]) / size), 0, rows - 1))
+    left = int(np.clip(np.floor((lon_range[0] + 180.0) / size), 0, cols - 1))
+    right = int(np.clip(np.floor((lon_range[1] + 180.0) / size), 0, cols - 1))
+    return top, bottom, left, right
+
+
+def read_region(tile_dir, grain, pollutant, lat_range=(-90, 90), lon_range=(-180, 180), level=None,
+                start_period=None, end_period=None):
+    # Mean over the period range for every cell of the view, read from the
+    # tiles that intersect it; cells without data are NaN
+    manifest = load_tile_manifest(tile_dir)
+    if manifest is None or grain not in manifest['grains']:
+        raise FileNotFoundError(f"No {grain} tile pyramid in {tile_dir}")
+    column = manifest['pollutants'].index(POLLUTANTS[pollutant]['name'])
+    if level is None:
+        level = level_for(lat_range, lon_range, manifest['max_level'])
+    top, bottom, left, right = pixel_window(lat_range, lon_range, level)
+    sums = np.zeros((bottom - top + 1, right - left + 1))
+    counts = np.zeros_like(sums)
+
+    present = {tuple(tile) for tile in manifest['tiles'][grain][str(level)]}
+    for ty in range(top // TILE_PIXELS, bottom // TILE_PIXELS + 1):
+        for tx in range(left // TILE_PIXELS, right // TILE_PIXELS + 1):
+            if (ty, tx) not in present:
+                continue
+            with np.load(tile_file(tile_dir, grain, level, ty, tx)) as tile:
+                y = tile['y'].astype(np.int64) + ty * TILE_PIXELS - top
+                x = tile['x'].astype(np.int64) + tx * TILE_PIXELS - left
+                keep = (y >= 0) & (y < sums.shape[0]) & (x >= 0) & (x < sums.shape[1])
+                if start_period is not None:
+                    keep &= tile['periods'] >= start_period
+                if end_period is not None:
+                    keep &= tile['periods'] <= end_period
+                np.add.at(sums, (y[keep], x[keep]), tile['sum'][keep, column])
+                np.add.at(counts, (y[keep], x[keep]), tile['count'][keep, column])
+
+    size = cell_size(level)
+    extent = (left * size - 180.0, (right + 1) * size - 180.0, 90.0 - (bottom + 1) * size, 90.0 - top * size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan), extent, level
+
+
+def map_path(output_dir, pollutant, grain):
+    return os.path.join(output_dir, POLLUTANTS[pollutant]['figure'].replace('_heatmap_figure.png', f'_{grain}_map.png'))
+
+
+def map_spec(image, extent, pollutant, output_dir, grain, period_label):
+    label = POLLUTANTS[pollutant]['label']
+    return {
+        'kind': 'map',
+        'path': map_path(output_dir, pollutant, grain),
+        'values': image,
+        'extent': extent,
+        'title': f'Mean {label} Concentration by Location, {period_label}',
+        'colorbar': f'{label} Concentration',
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Build or read the lat/long tile pyramid.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='bin every row into the tile pyramid (run under mpiexec)')
+    build.add_argument('--input', default=DEFAULT_INPUT)
+    build.add_argument('--source', choices=['auto', 'csv', 'cache'], default='auto')
+    build.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    build.add_argument('--tile-dir', default=DEFAULT_TILE_DIR)
+    build.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS))
+    build.add_argument('--grains', nargs='+', choices=list(GRAINS), default=list(GRAINS))
+    build.add_argument('--max-level', type=int, default=MAX_LEVEL, help='finest pyramid level')
+
+    render = commands.add_parser('render', help='draw maps from the tiles under a bounding box')
+    render.add_argument('--tile-dir', default=DEFAULT_TILE_DIR)
+    render.add_argument('--pollutants', nargs='+', choices=list(POLLUTANTS), default=list(POLLUTANTS))
+    render.add_argument('--grain', choices=list(GRAINS), default='year')
+    render.add_argument('--start', help='first date to include (YYYY-MM-DD or MM/DD/YYYY)')
+    render.add_argument('--end', help='last date to include')
+    render.add_argument('--lat', nargs=2, type=float, default=[24.0, 50.0], metavar=('MIN', 'MAX'))
+    render.add_argument('--lon', nargs=2, type=float, default=[-125.0, -66.0], metavar=('MIN', 'MAX'))
+    render.add_argument('--level', type=int, default=None, help='pyramid level (default: fit the view)')
+    render.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'build':
+        manifest = build_pyramid(args.input, args.tile_dir, args.pollutants, args.grains, args.max_level,
+                                 args.source, args.cache_dir)
+        if manifest is not None:
+            print(f"Tile pyramid for {manifest['rows']} rows written to {args.tile_dir}")
+        return
+
+    from render import render_batch
+
+    # Tiles hold whole periods, so a range cutting one would silently widen to it
+    days = [int(parse_dates([value])[0]) if value else None for value in (args.start, args.end)]
+    if MISSING_DAY in days:
+        raise SystemExit('--start/--end: unrecognised date (use YYYY-MM-DD or MM/DD/YYYY)')
+    if not period_aligned(args.grain, *days):
+        raise SystemExit(f'--start/--end must cover whole {args.grain}s at --grain {args.grain}; '
+                         'move them to period boundaries or use a finer --grain')
+    periods = [to_periods([day], args.grain)[0] if day is not None else None for day in days]
+    period_label = ' to '.join(str(format_periods([period], args.grain)[0]) for period in periods
+                               if period is not None) or 'all dates'
+    specs = []
+    for pollutant in args.pollutants:
+        image, extent, level = read_region(args.tile_dir, args.grain, pollutant, args.lat, args.lon, args.level,
+                                           *periods)
+        specs.append(map_spec(image, extent, pollutant, args.output_dir, args.grain, period_label))
+    for path in render_batch(specs):
+        print(f"Map written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import re
+import sqlite3
+
+import numpy as np
+
+from dates import format_days, parse_dates
+from schema import PROCESSED_SCHEMA, read_airnow_csv
+
+# Bulk loader for the processed AirNow data. Rows go in with chunked
+# executemany inside explicit transactions, secondary indexes are built after
+# the load, and (Date, Site_ID, POC) keeps incremental appends free of
+# duplicates. Dates are stored as ISO text so range filters use the index.
+
+DEFAULT_DB = 'data/processed/AirNow_database.db'
+TABLE = 'air_now_data'
+DEFAULT_CHUNK_ROWS = 100_000
+
+SECONDARY_INDEXES = {
+    'idx_air_now_date': ['Date'],
+    'idx_air_now_region': ['STATE_CODE', 'COUNTY_CODE', 'Date'],
+    'idx_air_now_site': ['Site_ID', 'Date'],
+}
+
+
+def sql_name(column):
+    # Same renaming as the ETL notebook: spaces, dots and dashes become '_'
+    return re.sub(r'[ .\-]', '_', column)
+
+
+def sql_type(dtype):
+    if dtype == 'category' or dtype is object:
+        return 'TEXT'
+    kind = np.dtype(dtype).kind
+    return 'INTEGER' if kind in 'iu' else 'REAL'
+
+
+COLUMNS = [sql_name(column) for column in PROCESSED_SCHEMA]
+
+# REAL columns are doubles; reading float32 would store values like 12.800000190734863
+LOAD_SCHEMA = {column: (np.float64 if dtype is np.float32 else dtype) for column, dtype in PROCESSED_SCHEMA.items()}
+
+
+def connect(db_path, bulk=False):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    if bulk:
+        # Durability is traded for speed only while loading
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-262144')
+    else:
+        conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def create_table(conn):
+    definitions = ',\n    '.join(f'{sql_name(column)} {sql_type(dtype)}' for column, dtype in PROCESSED_SCHEMA.items())
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {TABLE} (\n    {definitions}\n)')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_air_now_key ON {TABLE} (Date, Site_ID, POC)')
+
+
+def drop_secondary_indexes(conn):
+    for name in SECONDARY_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def create_secondary_indexes(conn):
+    for name, columns in SECONDARY_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {TABLE} ({", ".join(columns)})')
+    conn.execute('ANALYZE')
+
+
+def chunk_rows(chunk):
+    chunk = chunk.reindex(columns=list(PROCESSED_SCHEMA))
+    chunk['Date'] = format_days(parse_dates(chunk['Date'].astype(str).to_numpy()))
+    # Plain Python values for sqlite3; missing readings become NULL
+    chunk = chunk.astype(object).where(chunk.notna(), None)
+    return chunk.itertuples(index=False, name=None)
+
+
+def load_csv(csv_path, db_path=DEFAULT_DB, chunk_rows_count=DEFAULT_CHUNK_ROWS, replace=False, reindex=True):
+    # csv_path may also be an open file; reindex=False keeps the secondary
+    # indexes in place, which is cheaper for small appends
+    conn = connect(db_path, bulk=True)
+    try:
+        if replace:
+            conn.execute(f'DROP TABLE IF EXISTS {TABLE}')
+        create_table(conn)
+        if reindex:
+            # Maintaining secondary indexes row by row is slower than one rebuild
+            drop_secondary_indexes(conn)
+
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        insert = f'INSERT OR IGNORE INTO {TABLE} ({", ".join(COLUMNS)}) VALUES ({placeholders})'
+        before = conn.execute(f'SELECT COUNT(*) FROM {TABLE}').fetchone()[0]
+        for chunk in read_airnow_csv(csv_path, schema=LOAD_SCHEMA, chunksize=chunk_rows_count):
+            conn.execute('BEGIN')
+            conn.executemany(insert, chunk_rows(chunk))
+            conn.execute('COMMIT')
+        after = conn.execute(f'SELECT COUNT(*) FROM {TABLE}').fetchone()[0]
+
+        if reindex:
+            create_secondary_indexes(conn)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+    return after - before
+
+
+def region_filters(start_day=None, end_day=None, state_code=None, county_code=None, site_id=None):
+    clauses = []
+    params = []
+    if start_day is not None:
+        clauses.append('Date >= ?')
+        params.append(str(format_days([start_day])[0]))
+    if end_day is not None:
+        clauses.append('Date <= ?')
+        params.append(str(format_days([end_day])[0]))
+    for column, value in (('STATE_CODE', state_code), ('COUNTY_CODE', county_code), ('Site_ID', site_id)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(int(value))
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def date_bounds(db_path, **filters):
+    where, params = region_filters(**filters)
+    conn = connect(db_path)
+    try:
+        first, last = conn.execute(f'SELECT MIN(Date), MAX(Date) FROM {TABLE}{where}', params).fetchone()
+    finally:
+        conn.close()
+    if first is None:
+        return None, None
+    first_day, last_day = parse_dates([first, last])
+    return int(first_day), int(last_day)
+
+
+def query_daily(db_path, columns, **filters):
+    # Per-day SUM/COUNT for each column, with the date range and region
+    # filters evaluated by SQLite
+    where, params = region_filters(**filters)
+    selects = ', '.join(f'SUM({sql_name(c)}), COUNT({sql_name(c)})' for c in columns)
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(f'SELECT Date, {selects} FROM {TABLE}{where} GROUP BY Date ORDER BY Date', params).fetchall()
+    finally:
+        conn.close()
+    days = parse_dates([row[0] for row in rows])
+    totals = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), 2 * len(columns))
+    sums = np.nan_to_num(totals[:, 0::2])
+    counts = totals[:, 1::2]
+    return days, sums, counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load the processed AirNow CSV into SQLite.')
+    parser.add_argument('--input', default='data/processed/preprocessed_for_cpp.csv')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--replace', action='store_true', help='drop the table first instead of appending')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    inserted = load_csv(args.input, args.db, args.chunk_rows, replace=args.replace)
+    print(f"Loaded {inserted} new rows into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
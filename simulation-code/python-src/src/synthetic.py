@@ -0,0 +1,154 @@
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dates import format_days, parse_dates
+from schema import PROCESSED_COLUMNS, RAW_SCHEMA
+
+# Synthetic AirNow-schema data for benchmarks. Sites get a fixed location,
+# state/county and per-pollutant baseline; daily readings follow a seasonal
+# cycle with lognormal noise. Rows are site-days in date order, so
+# (Date, Site ID, POC) stays unique at any size; once every site-day is used
+# the next pass gets the next POC. Chunks are generated in worker processes,
+# each from its own seed, so output is identical for any worker count and
+# memory does not grow with the row count.
+
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+# (median level, decimals, units, AQS parameter code, description) per pollutant
+POLLUTANT_MODELS = {
+    'Daily Mean PM10 Concentration': (20.0, 1, 'ug/m3 SC', 81102, 'PM10 Total 0-10um STP'),
+    'Daily Mean PM2.5 Concentration': (8.0, 1, 'ug/m3 LC', 88101, 'PM2.5 - Local Conditions'),
+    'Daily Max 8-hour Ozone Concentration': (0.04, 3, 'ppm', 44201, 'Ozone'),
+    'Daily Max 1-hour NO2 Concentration': (15.0, 1, 'ppb', 42602, 'Nitrogen dioxide (NO2)'),
+    'Daily Max 8-hour CO Concentration': (0.3, 1, 'ppm', 42101, 'Carbon monoxide'),
+    'Daily Mean Pb Concentration': (0.01, 3, 'ug/m3 LC', 14129, 'Lead (TSP) LC'),
+    'Daily Max 1-hour SO2 Concentration': (1.5, 1, 'ppb', 42401, 'Sulfur dioxide'),
+}
+
+STATES = ['AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS',
+          'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC',
+          'ND', 'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+
+
+def make_sites(count, rng):
+    state_codes = rng.integers(1, len(STATES) + 1, count)
+    county_codes = 2 * rng.integers(0, 100, count) + 1
+    site_numbers = np.arange(count) % 10_000
+    sites = pd.DataFrame({
+        'Site ID': (state_codes * 10_000_000 + county_codes * 10_000 + site_numbers).astype(np.int64),
+        'STATE_CODE': state_codes,
+        'STATE': np.array(STATES)[state_codes - 1],
+        'COUNTY_CODE': county_codes,
+        'COUNTY': [f'County {code}' for code in county_codes],
+        'Site Name': [f'Site {number}' for number in range(count)],
+        'SITE_LATITUDE': np.round(rng.uniform(25.0, 49.0, count), 6),
+        'SITE_LONGITUDE': np.round(rng.uniform(-124.0, -67.0, count), 6),
+    })
+    for column, (level, _, _, _, _) in POLLUTANT_MODELS.items():
+        sites[column] = level * rng.lognormal(0.0, 0.5, count)
+    sites['phase'] = rng.uniform(0, 2 * np.pi, count)
+    return sites
+
+
+def date_labels(first_day, span):
+    # MM/DD/YYYY like the AirNow exports, formatted once per day of the range
+    return np.array([f'{iso[5:7]}/{iso[8:10]}/{iso[:4]}' for iso in format_days(first_day + np.arange(span))],
+                    dtype=object)
+
+
+def make_rows(first, count, sites, first_day, labels, missing, rng):
+    span = len(labels)
+    index = np.arange(first, first + count, dtype=np.int64)
+    site = index % len(sites)
+    offsets = (index // len(sites)) % span
+    poc = 1 + index // (len(sites) * span)
+    season = 1.0 + 0.3 * np.sin(2 * np.pi * ((first_day + offsets) % 365) / 365.0 + sites['phase'].to_numpy()[site])
+
+    chunk = {'Date': labels[offsets], 'Source': 'AirNow'}
+    for column in ('Site ID', 'STATE_CODE', 'STATE', 'COUNTY_CODE', 'COUNTY', 'Site Name', 'SITE_LATITUDE',
+                   'SITE_LONGITUDE'):
+        chunk[column] = sites[column].to_numpy()[site]
+    chunk['POC'] = poc
+    for column, (_, decimals, _, _, _) in POLLUTANT_MODELS.items():
+        values = sites[column].to_numpy()[site] * season * rng.lognormal(0.0, 0.4, count)
+        values = np.round(values, decimals)
+        values[rng.random(count) < missing] = np.nan
+        chunk[column] = values
+    # The exports describe the PM10 monitor; AQI loosely follows PM2.5
+    _, _, units, code, description = POLLUTANT_MODELS['Daily Mean PM10 Concentration']
+    chunk['UNITS'] = units
+    chunk['AQS_PARAMETER_CODE'] = code
+    chunk['AQS_PARAMETER_DESC'] = description
+    chunk['DAILY_AQI_VALUE'] = np.round(np.nan_to_num(chunk['Daily Mean PM2.5 Concentration'], nan=8.0) * 4.2)
+    chunk['DAILY_OBS_COUNT'] = 1
+    chunk['PERCENT_COMPLETE'] = 100.0
+    chunk['CBSA_CODE'] = np.nan
+    chunk['CBSA_NAME'] = ''
+    return chunk
+
+
+def write_chunk(first, count, sites, start, end, missing, layout, seed):
+    # Runs in a worker; CSV formatting, not the random numbers, is the cost
+    site_table = make_sites(sites, np.random.default_rng(seed))
+    first_day, last_day = (int(day) for day in parse_dates([start, end]))
+    labels = date_labels(first_day, last_day - first_day + 1)
+    chunk = make_rows(first, count, site_table, first_day, labels, missing, np.random.default_rng([seed, first]))
+    columns = PROCESSED_COLUMNS if layout == 'processed' else list(RAW_SCHEMA)
+    return pd.DataFrame({column: chunk[column] for column in columns}).to_csv(
+        index=False, header=(first == 0), lineterminator='\n').encode('utf-8')
+
+
+def generate(output_path, rows, sites=1000, start='2020-01-01', end='2023-12-31', missing=0.1, layout='processed',
+             seed=0, chunk_rows=DEFAULT_CHUNK_ROWS, workers=None):
+    workers = workers or os.cpu_count() or 1
+    chunks = iter(range(0, rows, chunk_rows))
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as output, ProcessPoolExecutor(max_workers=workers) as pool:
+        # Bounded window of in-flight chunks, written in order
+        pending = deque()
+
+        def submit_next():
+            for first in chunks:
+                pending.append(pool.submit(write_chunk, first, min(chunk_rows, rows - first), sites, start, end,
+                                           missing, layout, seed))
+                return
+
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            data = pending.popleft().result()
+            submit_next()
+            output.write(data)
+    return output_path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic AirNow data for benchmarks.')
+    parser.add_argument('output', help='CSV to write')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--sites', type=int, default=1000)
+    parser.add_argument('--start', default='2020-01-01', help='first date (YYYY-MM-DD)')
+    parser.add_argument('--end', default='2023-12-31', help='last date (YYYY-MM-DD)')
+    parser.add_argument('--missing', type=float, default=0.1, help='fraction of pollutant readings left empty')
+    parser.add_argument('--layout', choices=['processed', 'raw'], default='processed',
+                        help="'processed' matches preprocessed_for_cpp.csv, 'raw' matches combined_file_final.csv")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--workers', type=int, default=None, help='generator processes (default: CPU count)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    generate(args.output, args.rows, args.sites, args.start, args.end, args.missing, args.layout, args.seed,
+             args.chunk_rows, args.workers)
+    print(f"Wrote {args.rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
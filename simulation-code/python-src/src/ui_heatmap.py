@@ -1,8 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-import subprocess
 import os
 
+from job_manager import JobManager
+
 # Mapping of pollutant names to their corresponding script files
 pollutant_scripts = {
     'NO2': 'no2_heatmap.py',
@@ -14,17 +15,46 @@ pollutant_scripts = {
     'CO': 'co_heatmap.py'
 }
 
+POLL_MS = 200
+
+# Jobs run in the background; the window stays responsive while they do
+manager = JobManager(core_budget=os.cpu_count())
+reported = set()  # Job ids whose figures or errors were already shown
+
+def show_figure(pollutant, figure_path):
+    window = tk.Toplevel(root)
+    window.title(f"{pollutant} Heatmap")
+    image = tk.PhotoImage(file=figure_path)
+    label = tk.Label(window, image=image)
+    label.image = image  # Keep a reference so Tk does not drop the image
+    label.pack()
+
 def run_heatmap_script(pollutant):
-    script_path = f"src/{pollutant_scripts[pollutant]}"
-    # Check if the script file exists
-    if os.path.exists(script_path):
-        try:
-            # Run the script using subprocess with the correct arguments
-            subprocess.run(["mpiexec", "-np", "4", "python3", script_path], check=True)
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Execution Error", f"An error occurred: {e}")
-    else:
-        messagebox.showinfo("File Not Found", f"Script for {pollutant} does not exist at {script_path}")
+    manager.set_core_budget(core_budget_var.get())
+    job = manager.submit(pollutant, ranks=ranks_var.get())
+    jobs_view.insert('', 'end', iid=str(job.id), values=(pollutant, job.status, ''))
+
+def poll_jobs():
+    for job in manager.drain():
+        jobs_view.item(str(job.id), values=(job.pollutant, job.status, job.summary()))
+        if job.id in reported:
+            continue
+        if job.status == 'done':
+            reported.add(job.id)
+            for figure_path in job.figures:
+                show_figure(job.pollutant, figure_path)
+        elif job.status == 'failed':
+            reported.add(job.id)
+            messagebox.showerror("Execution Error", f"An error occurred: {job.error}")
+    root.after(POLL_MS, poll_jobs)
+
+def on_cancel_button_click():
+    for item in jobs_view.selection():
+        manager.cancel(int(item))
+
+def on_close():
+    manager.cancel_all()
+    root.destroy()
 
 def on_enter_button_click():
     selected_pollutant = pollutant_var.get()
@@ -36,7 +66,7 @@ def on_enter_button_click():
 # Setup the GUI
 root = tk.Tk()
 root.title("Pollutant Heatmap Selector")
-root.geometry("400x200")  # Width x Height
+root.geometry("520x420")  # Width x Height
 root.configure(bg="#34495e")
 
 # Set the theme for ttk
@@ -62,6 +92,29 @@ enter_button = ttk.Button(root, text="Enter", style='TButton', command=on_enter_
 enter_button.grid(column=0, row=1, padx=10, pady=10, sticky="ew")
 enter_button.bind('<Return>', lambda event: on_enter_button_click())
 
+# Core budget shared by all jobs, and ranks per job
+limits = ttk.Frame(root)
+limits.grid(column=0, row=2, padx=10, pady=5, sticky="ew")
+core_budget_var = tk.IntVar(value=os.cpu_count() or 1)
+ranks_var = tk.IntVar(value=min(4, os.cpu_count() or 1))
+ttk.Label(limits, text="Cores").pack(side="left")
+ttk.Spinbox(limits, from_=1, to=256, textvariable=core_budget_var, width=5).pack(side="left", padx=5)
+ttk.Label(limits, text="Ranks per job").pack(side="left")
+ttk.Spinbox(limits, from_=1, to=256, textvariable=ranks_var, width=5).pack(side="left", padx=5)
+
+# Queued, running and finished jobs
+jobs_view = ttk.Treeview(root, columns=("pollutant", "status", "progress"), show="headings", height=8)
+for column, width in (("pollutant", 90), ("status", 90), ("progress", 280)):
+    jobs_view.heading(column, text=column.capitalize())
+    jobs_view.column(column, width=width)
+jobs_view.grid(column=0, row=3, padx=10, pady=5, sticky="nsew")
+
+cancel_button = ttk.Button(root, text="Cancel", style='TButton', command=on_cancel_button_click)
+cancel_button.grid(column=0, row=4, padx=10, pady=5, sticky="ew")
+
+root.protocol("WM_DELETE_WINDOW", on_close)
+root.after(POLL_MS, poll_jobs)
+
 # Center the window on the screen
 root.eval('tk::PlaceWindow . center')
 
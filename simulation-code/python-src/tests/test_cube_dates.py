@@ -0,0 +1,67 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import heatmap_engine as engine  # noqa: E402
+from dates import parse_dates  # noqa: E402
+from executor import create_executor  # noqa: E402
+from init import stream_preprocess  # noqa: E402
+from rollup import build_from_cache  # noqa: E402
+from synthetic import generate  # noqa: E402
+
+
+def day(text):
+    return int(parse_dates([text])[0])
+
+
+@pytest.fixture(scope='module')
+def tree(tmp_path_factory):
+    # Processed CSV with a fresh cache and cube, as init.py leaves them
+    root = tmp_path_factory.mktemp('tree')
+    raw = str(root / 'raw.csv')
+    generate(raw, 20_000, sites=40, start='2020-01-01', end='2020-12-31', layout='raw', workers=1)
+    paths = {'input': str(root / 'processed.csv'), 'cache_dir': str(root / 'cache'), 'cube_dir': str(root / 'cube')}
+    stream_preprocess(raw, paths['input'], cache_dir=paths['cache_dir'])
+    build_from_cache(paths['cache_dir'], paths['cube_dir'])
+    return paths
+
+
+def heatmap_means(tree, source, grain, start_day=None, end_day=None, monkeypatch=None):
+    specs = []
+    monkeypatch.setattr(engine, 'render_all', lambda batch, *args, **kwargs: specs.extend(batch))
+    engine.run(tree['input'], ['NO2'], str(tree['cube_dir']) + '_figures', show=False, source=source,
+               cache_dir=tree['cache_dir'], cube_dir=tree['cube_dir'], grains=[grain], start_day=start_day,
+               end_day=end_day, executor=create_executor('serial'))
+    return specs[0]['tick_labels'], np.asarray(specs[0]['values'])
+
+
+def test_period_aligned():
+    assert engine.period_aligned('month', day('2020-03-01'), day('2020-03-31'))
+    assert not engine.period_aligned('month', day('2020-03-15'))
+    assert not engine.period_aligned('year', None, day('2020-06-30'))
+    assert engine.period_aligned('day', day('2020-03-15'), day('2020-03-16'))
+
+
+@pytest.mark.parametrize('grain', ['month', 'year'])
+def test_partial_periods_are_not_served_from_the_cube(tree, grain, monkeypatch):
+    start_day, end_day = day('2020-03-15'), day('2020-10-20')
+    names = [engine.POLLUTANTS['NO2']['name']]
+    assert not engine.use_cube('auto', tree['input'], tree['cube_dir'], [grain], names, {}, start_day, end_day)
+    labels, means = heatmap_means(tree, 'auto', grain, start_day, end_day, monkeypatch)
+    expected_labels, expected = heatmap_means(tree, 'csv', grain, start_day, end_day, monkeypatch)
+    assert labels == expected_labels
+    np.testing.assert_allclose(means, expected)
+
+
+def test_whole_periods_still_use_the_cube(tree, monkeypatch):
+    start_day, end_day = day('2020-03-01'), day('2020-10-31')
+    names = [engine.POLLUTANTS['NO2']['name']]
+    assert engine.use_cube('auto', tree['input'], tree['cube_dir'], ['month'], names, {}, start_day, end_day)
+    labels, means = heatmap_means(tree, 'auto', 'month', start_day, end_day, monkeypatch)
+    expected_labels, expected = heatmap_means(tree, 'csv', 'month', start_day, end_day, monkeypatch)
+    assert labels == expected_labels
+    np.testing.assert_allclose(means, expected, rtol=1e-6)
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from dates import MISSING_DAY, _parse_fallback, parse_dates  # noqa: E402
+
+
+def test_impossible_dates_are_missing():
+    days = parse_dates(['02/31/2024', '04/31/2021', '02/29/2023', '02/29/1900'])
+    assert (days == MISSING_DAY).all()
+    assert parse_dates(['02/29/2024', '02/29/2000']).tolist() == [19782, 11016]
+
+
+def test_fast_path_agrees_with_pandas():
+    rng = np.random.default_rng(0)
+    months, days, years = rng.integers(1, 13, 5000), rng.integers(1, 32, 5000), rng.integers(1900, 2100, 5000)
+    raw = np.array([f'{month:02d}/{day:02d}/{year}' for month, day, year in zip(months, days, years)]).astype('S')
+    np.testing.assert_array_equal(parse_dates(raw), _parse_fallback(raw))
@@ -0,0 +1,87 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import heatmap_engine as engine  # noqa: E402
+from executor import MPIEXEC, create_executor  # noqa: E402
+from synthetic import generate  # noqa: E402
+
+CHUNKS = 12
+POLLUTANTS = ['NO2', 'PM2.5', 'Ozone']
+
+# Runs the engine on every rank of an mpiexec launch; rank 0 pickles the means
+DRIVER = """
+import pickle
+import sys
+
+sys.path.insert(0, sys.argv[1])
+import heatmap_engine as engine
+from executor import create_executor
+
+executor = create_executor('mpi')
+specs = []
+engine.render_all = lambda batch, *args, **kwargs: specs.extend(batch)
+engine.run(sys.argv[2], sys.argv[4].split(','), sys.argv[3] + '_figures', show=False, source='csv',
+           grains=['day', 'month'], schedule=sys.argv[5], chunks=int(sys.argv[6]), executor=executor)
+if executor.comm.Get_rank() == 0:
+    with open(sys.argv[3], 'wb') as file:
+        pickle.dump([(spec['tick_labels'], list(spec['values'])) for spec in specs], file)
+"""
+
+needs_mpi = pytest.mark.skipif(shutil.which(MPIEXEC[0]) is None, reason='needs mpiexec and mpi4py')
+
+
+@pytest.fixture(scope='module')
+def processed(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('schedules') / 'processed.csv')
+    generate(path, 30_000, sites=40, start='2020-01-01', end='2020-12-31', workers=1)
+    return path
+
+
+def mpi_means(path, ranks, schedule, tmp_path):
+    driver = tmp_path / 'driver.py'
+    driver.write_text(DRIVER)
+    output = tmp_path / f'{schedule}_{ranks}.pickle'
+    environment = dict(os.environ, OMPI_MCA_rmaps_base_oversubscribe='1', MPLBACKEND='Agg')
+    subprocess.run(MPIEXEC + ['-np', str(ranks), sys.executable, str(driver), SRC_DIR, path, str(output),
+                              ','.join(POLLUTANTS), schedule, str(CHUNKS)], check=True, env=environment)
+    with open(output, 'rb') as file:
+        return pickle.load(file)
+
+
+def pool_means(path, monkeypatch):
+    specs = []
+    monkeypatch.setattr(engine, 'render_all', lambda batch, *args, **kwargs: specs.extend(batch))
+    engine.run(path, POLLUTANTS, path + '_figures', show=False, source='csv', grains=['day', 'month'],
+               schedule='dynamic', chunks=CHUNKS, executor=create_executor('pool', 3))
+    return [(spec['tick_labels'], list(spec['values'])) for spec in specs]
+
+
+@needs_mpi
+def test_dynamic_schedule_is_identical_across_rank_counts(processed, tmp_path, monkeypatch):
+    expected = pool_means(processed, monkeypatch)
+    for ranks in [1, 2, 3]:
+        # Same chunks added in the same order: bit-for-bit equal
+        means = mpi_means(processed, ranks, 'dynamic', tmp_path)
+        assert [labels for labels, _ in means] == [labels for labels, _ in expected]
+        for (_, values), (_, pooled) in zip(means, expected):
+            np.testing.assert_array_equal(values, pooled)
+
+
+@needs_mpi
+def test_static_schedule_matches_dynamic(processed, tmp_path):
+    dynamic = mpi_means(processed, 2, 'dynamic', tmp_path)
+    for ranks in [1, 3]:
+        static = mpi_means(processed, ranks, 'static', tmp_path)
+        # Different summation order, so equal only up to rounding
+        assert [labels for labels, _ in static] == [labels for labels, _ in dynamic]
+        for (_, values), (_, expected) in zip(static, dynamic):
+            np.testing.assert_allclose(values, expected, rtol=1e-12)